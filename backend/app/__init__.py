@@ -1,3 +1,5 @@
+import importlib
+from typing import Optional
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
 from flask_cors import CORS
@@ -9,7 +11,10 @@ from backend.config import Config
 db = SQLAlchemy()
 cors = CORS()
 
-def create_app(config_class=Config):
+# Servicios pesados (Gemini, ReportLab) que solo se importan al crear la app con precarga="completa"
+SUBSISTEMAS_DIFERIDOS = ("backend.app.services.ia_service", "backend.app.services.pdf_service")
+
+def create_app(config_class=Config, workers: Optional[int] = None, precarga: Optional[str] = None):
     app = Flask(__name__)
     app.config.from_object(config_class)
     db.init_app(app)
@@ -25,4 +30,26 @@ def create_app(config_class=Config):
         app.register_blueprint(ia.ia_bp, url_prefix='/api/ia')
         from .routes.dashboard import dashboard_bp
         app.register_blueprint(dashboard_bp, url_prefix='/api')
+        from .routes.comparador import comparador_bp
+        app.register_blueprint(comparador_bp, url_prefix='/api')
+        from .routes.jobs import jobs_bp
+        app.register_blueprint(jobs_bp, url_prefix='/api')
+        from .routes.presupuesto import presupuesto_bp
+        app.register_blueprint(presupuesto_bp, url_prefix='/api')
+        from .routes.ia_stream import ia_stream_bp
+        app.register_blueprint(ia_stream_bp, url_prefix='/api/ia')
+        from .cache import init_cache
+        init_cache(app)
+
+    if (precarga or app.config.get("PRECARGA", "core")) == "completa":
+        # Dentro del app context para que la precarga lea la configuración de esta app (p. ej. GEMINI_API_KEY)
+        with app.app_context():
+            for modulo in SUBSISTEMAS_DIFERIDOS:
+                importlib.import_module(modulo).precargar()
+
+    # Workers de la cola de jobs en hilos del mismo proceso (JOB_WORKERS=0 los desactiva)
+    cantidad_workers = app.config.get("JOB_WORKERS", 0) if workers is None else workers
+    if cantidad_workers > 0:
+        from .services.job_service import iniciar_workers
+        iniciar_workers(app, cantidad_workers)
     return app
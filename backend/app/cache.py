@@ -0,0 +1,120 @@
+import hashlib
+import re
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Tuple
+from flask import Response, current_app, g, request
+from backend.app import db
+from backend.app.models import VersionDatos
+
+# Regla de la ruta (con las variables como <id>) -> (ámbitos de versión a partir del id, depende de precios del catálogo)
+RUTAS_CACHEADAS: Dict[str, Tuple[Callable[[Optional[int]], List[str]], bool]] = {}
+
+
+def cachear_ruta(regla: str, ambitos: Callable[[Optional[int]], List[str]], catalogo: bool = False) -> None:
+    """Registra una ruta GET cuya respuesta solo cambia cuando cambia alguno de sus ámbitos."""
+    RUTAS_CACHEADAS[regla] = (ambitos, catalogo)
+
+
+# Las cuatro primeras reglas son para las lecturas de routes/proyectos.py; mientras una regla no
+# coincida con ninguna ruta registrada no tiene efecto
+cachear_ruta("/api/proyectos", lambda _: ["proyectos"])
+cachear_ruta("/api/proyectos/<id>", lambda proyecto_id: [f"proyecto:{proyecto_id}"])
+cachear_ruta("/api/proyectos/<id>/partidas", lambda proyecto_id: [f"proyecto:{proyecto_id}"])
+cachear_ruta("/api/partidas/<id>/detalles", lambda partida_id: [f"partida:{partida_id}", "conceptos"])
+cachear_ruta("/api/proyectos/<id>/dashboard_data", lambda proyecto_id: [f"proyecto:{proyecto_id}", "conceptos"], catalogo=True)
+cachear_ruta("/api/proyectos/<id>/presupuesto", lambda proyecto_id: [f"proyecto:{proyecto_id}", "conceptos"])
+cachear_ruta("/api/proyectos/<id>/analytics", lambda proyecto_id: [f"proyecto:{proyecto_id}", "conceptos"], catalogo=True)
+
+
+class CacheRespuestas:
+    """LRU en memoria de cuerpos JSON ya serializados, acotado por número de entradas y bytes."""
+
+    def __init__(self, maximo_entradas: int, maximo_bytes: int):
+        self.maximo_entradas = maximo_entradas
+        self.maximo_bytes = maximo_bytes
+        self.bytes = 0
+        self._entradas: "OrderedDict[str, bytes]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def obtener(self, etag: str) -> Optional[bytes]:
+        with self._lock:
+            cuerpo = self._entradas.get(etag)
+            if cuerpo is not None:
+                self._entradas.move_to_end(etag)
+            return cuerpo
+
+    def guardar(self, etag: str, cuerpo: bytes) -> None:
+        if len(cuerpo) > self.maximo_bytes:
+            return
+        with self._lock:
+            anterior = self._entradas.pop(etag, None)
+            if anterior is not None:
+                self.bytes -= len(anterior)
+            self._entradas[etag] = cuerpo
+            self.bytes += len(cuerpo)
+            while len(self._entradas) > self.maximo_entradas or self.bytes > self.maximo_bytes:
+                _, descartado = self._entradas.popitem(last=False)
+                self.bytes -= len(descartado)
+
+
+def _regla_normalizada(regla: str) -> str:
+    return re.sub(r"<[^>]+>", "<id>", regla)
+
+
+def _etag_actual() -> Optional[str]:
+    if request.method != "GET" or request.url_rule is None:
+        return None
+    registro = RUTAS_CACHEADAS.get(_regla_normalizada(request.url_rule.rule))
+    if registro is None:
+        return None
+    ambitos, catalogo = registro
+    identificador = next(iter((request.view_args or {}).values()), None)
+    claves = ambitos(identificador)
+    # Las versiones se leen antes que los datos: una escritura concurrente deja un ETag
+    # viejo con datos nuevos (se revalida de más), nunca datos viejos con un ETag nuevo.
+    versiones = dict(db.session.query(VersionDatos.clave, VersionDatos.version).filter(VersionDatos.clave.in_(claves)))
+    partes = [request.full_path] + [f"{clave}={versiones.get(clave, 0)}" for clave in claves]
+    if catalogo:
+        from backend.app.services.catalogo_service import version_catalogo
+        partes.append(f"catalogo={version_catalogo()}")
+    return '"' + hashlib.sha1("|".join(partes).encode()).hexdigest() + '"'
+
+
+def _responder(cuerpo: Optional[bytes], etag: str, status: int = 200) -> Response:
+    respuesta = Response(cuerpo, status=status, mimetype="application/json" if cuerpo is not None else None)
+    respuesta.headers["ETag"] = etag
+    respuesta.headers["Cache-Control"] = "no-cache"
+    respuesta.headers["X-Cache"] = "HIT" if status == 200 else "REVALIDATED"
+    return respuesta
+
+
+def _antes_de_peticion():
+    etag = _etag_actual()
+    if etag is None:
+        return None
+    if request.if_none_match.contains(etag.strip('"')):
+        return _responder(None, etag, 304)
+    cuerpo = current_app.extensions["cache_respuestas"].obtener(etag)
+    if cuerpo is not None:
+        return _responder(cuerpo, etag)
+    g.etag_respuesta = etag
+    return None
+
+
+def _despues_de_peticion(respuesta: Response) -> Response:
+    etag = g.pop("etag_respuesta", None)
+    if etag is None or respuesta.status_code != 200 or respuesta.mimetype != "application/json" or respuesta.is_streamed:
+        return respuesta
+    current_app.extensions["cache_respuestas"].guardar(etag, respuesta.get_data())
+    respuesta.headers["ETag"] = etag
+    respuesta.headers["Cache-Control"] = "no-cache"
+    respuesta.headers["X-Cache"] = "MISS"
+    return respuesta
+
+
+def init_cache(app) -> None:
+    """Activa ETag/304 y la LRU de respuestas para las rutas registradas con cachear_ruta."""
+    app.extensions["cache_respuestas"] = CacheRespuestas(app.config["RESPUESTAS_CACHE_MAXIMAS"], app.config["RESPUESTAS_CACHE_MAX_BYTES"])
+    app.before_request(_antes_de_peticion)
+    app.after_request(_despues_de_peticion)
@@ -1,6 +1,8 @@
-from datetime import date
+from datetime import date, datetime
 from decimal import Decimal
-from typing import Dict, Optional
+from typing import Dict, Iterable, Optional, Tuple
+from sqlalchemy import event, insert, delete, select
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from backend.app import db
 from backend.config import Config
 
@@ -16,7 +18,12 @@ def is_precio_obsoleto(fecha_actualizacion: Optional[date]) -> bool:
 class ConstantesFASAR(db.Model):
     __tablename__ = "constantes_fasar"
     id = db.Column(db.Integer, primary_key=True, default=1)
-    # ... (all other fields)
+    dias_del_anio = db.Column(db.Integer, default=365)
+    dias_festivos_obligatorios = db.Column(db.Numeric(6, 2), default=Decimal("7.0"))
+    dias_riesgo_trabajo_promedio = db.Column(db.Numeric(6, 2), default=Decimal("1.5"))
+    dias_vacaciones_minimos = db.Column(db.Integer, default=12)
+    prima_vacacional_porcentaje = db.Column(db.Numeric(4, 2), default=Decimal("0.25"))
+    dias_aguinaldo_minimos = db.Column(db.Integer, default=15)
     suma_cargas_sociales = db.Column(db.Numeric(5, 4), default=Decimal("0.15"))
     @classmethod
     def get_singleton(cls):
@@ -33,7 +40,12 @@ class Material(db.Model):
     __tablename__ = "materiales"
     id = db.Column(db.Integer, primary_key=True)
     nombre = db.Column(db.String(255), unique=True, nullable=False)
-    # ... (all other fields)
+    unidad = db.Column(db.String(50), nullable=False)
+    precio_unitario = db.Column(db.Numeric(12, 4), nullable=False)
+    fecha_actualizacion = db.Column(db.Date, default=date.today, nullable=False)
+    disciplina = db.Column(db.String(100), nullable=True)
+    calidad = db.Column(db.String(100), nullable=True)
+    porcentaje_merma = db.Column(db.Numeric(5, 4), default=Decimal("0.03"), nullable=False)
     precio_flete_unitario = db.Column(db.Numeric(12, 4), default=Decimal("0.00"), nullable=False)
     def to_dict(self):
         return { "id": self.id, "nombre": self.nombre, "unidad": self.unidad, "precio_unitario": float(self.precio_unitario), "fecha_actualizacion": self.fecha_actualizacion.isoformat(), "disciplina": self.disciplina, "calidad": self.calidad, "obsoleto": is_precio_obsoleto(self.fecha_actualizacion), "porcentaje_merma": float(self.porcentaje_merma or 0), "precio_flete_unitario": float(self.precio_flete_unitario or 0) }
@@ -54,7 +66,14 @@ class Equipo(db.Model):
 class Maquinaria(db.Model):
     __tablename__ = "maquinaria"
     id = db.Column(db.Integer, primary_key=True)
-    # ... (all other fields)
+    nombre = db.Column(db.String(255), nullable=False)
+    costo_adquisicion = db.Column(db.Numeric(14, 2), nullable=False)
+    vida_util_horas = db.Column(db.Numeric(14, 2), nullable=False)
+    tasa_interes_anual = db.Column(db.Numeric(5, 4), default=Decimal("0.10"), nullable=False)
+    rendimiento_horario = db.Column(db.Numeric(10, 4), default=Decimal("1.0"), nullable=False)
+    costo_posesion_hora = db.Column(db.Numeric(14, 4), default=Decimal("0.0000"), nullable=False)
+    disciplina = db.Column(db.String(100), nullable=True)
+    calidad = db.Column(db.String(100), nullable=True)
     fecha_actualizacion = db.Column(db.Date, default=date.today, nullable=False)
     def actualizar_costo_posesion(self):
         from backend.app.services.calculation_service import calcular_costo_posesion
@@ -65,7 +84,13 @@ class Maquinaria(db.Model):
 class ManoObra(db.Model):
     __tablename__ = "mano_obra"
     id = db.Column(db.Integer, primary_key=True)
-    # ... (all other fields)
+    puesto = db.Column(db.String(255), nullable=False)
+    salario_base = db.Column(db.Numeric(12, 2), nullable=False)
+    antiguedad_anios = db.Column(db.Integer, default=1, nullable=False)
+    fasar = db.Column(db.Numeric(12, 4), default=Decimal("1.0000"), nullable=False)
+    rendimiento_jornada = db.Column(db.Numeric(10, 4), default=Decimal("1.0000"), nullable=False)
+    disciplina = db.Column(db.String(100), nullable=True)
+    calidad = db.Column(db.String(100), nullable=True)
     fecha_actualizacion = db.Column(db.Date, default=date.today, nullable=False)
     def refresh_fasar(self):
         from backend.app.services.calculation_service import calcular_fasar_valor
@@ -100,7 +125,20 @@ class Proyecto(db.Model):
     __tablename__ = "proyectos"
     id = db.Column(db.Integer, primary_key=True)
     nombre_proyecto = db.Column(db.String(255), nullable=False)
-    # ...
+    ubicacion = db.Column(db.String(255), nullable=True, default="")
+    descripcion = db.Column(db.Text, nullable=True, default="")
+    fecha_creacion = db.Column(db.Date, default=date.today, nullable=False)
+    ajuste_mano_obra_activo = db.Column(db.Boolean, default=False)
+    ajuste_mano_obra_porcentaje = db.Column(db.Numeric(6, 4), default=Decimal("0.00"))
+    ajuste_indirectos_activo = db.Column(db.Boolean, default=False)
+    ajuste_indirectos_porcentaje = db.Column(db.Numeric(6, 4), default=Decimal("0.00"))
+    ajuste_financiamiento_activo = db.Column(db.Boolean, default=False)
+    ajuste_financiamiento_porcentaje = db.Column(db.Numeric(6, 4), default=Decimal("0.00"))
+    ajuste_utilidad_activo = db.Column(db.Boolean, default=False)
+    ajuste_utilidad_porcentaje = db.Column(db.Numeric(6, 4), default=Decimal("0.00"))
+    ajuste_iva_activo = db.Column(db.Boolean, default=False)
+    ajuste_iva_porcentaje = db.Column(db.Numeric(6, 4), default=Decimal("0.00"))
+    has_presupuesto_maximo = db.Column(db.Boolean, default=False)
     monto_maximo = db.Column(db.Numeric(14, 2), default=Decimal("0.00"))
     partidas = db.relationship("Partida", backref="proyecto", cascade="all, delete-orphan")
     def to_dict(self):
@@ -126,3 +164,193 @@ class DetallePresupuesto(db.Model):
     concepto = db.relationship("Concepto")
     def to_dict(self):
         return { "id": self.id, "partida": self.partida_id, "concepto": self.concepto_id, "cantidad_obra": float(self.cantidad_obra), "precio_unitario_calculado": float(self.precio_unitario_calculado), "costo_directo": float(self.costo_directo or 0), "concepto_detalle": {"clave": self.concepto.clave, "descripcion": self.concepto.descripcion}, }
+
+class CatalogoCambio(db.Model):
+    """Bitácora de altas, cambios y bajas de insumos; su id máximo es la versión del catálogo."""
+    __tablename__ = "catalogo_cambios"
+    __table_args__ = (db.Index("ix_catalogo_cambios_insumo", "tipo_insumo", "insumo_id"), {"sqlite_autoincrement": True})
+    id = db.Column(db.Integer, primary_key=True)
+    tipo_insumo = db.Column(db.String(20), nullable=False)
+    insumo_id = db.Column(db.Integer, nullable=False)
+    eliminado = db.Column(db.Boolean, default=False, nullable=False)
+    fecha = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+TIPOS_CATALOGO = {Material: "Material", ManoObra: "ManoObra", Equipo: "Equipo", Maquinaria: "Maquinaria"}
+
+def registrar_cambios_catalogo(connection, cambios: Iterable[Tuple[str, int, bool]]) -> None:
+    """
+    Anota (tipo_insumo, insumo_id, eliminado) en la bitácora. Solo se conserva la entrada más
+    reciente de cada insumo, así la bitácora crece con el catálogo y no con el número de ediciones.
+    Las escrituras en bloque que no pasan por el flush del ORM deben llamarla explícitamente.
+    """
+    cambios = list(cambios)
+    if not cambios:
+        return
+    por_tipo: Dict[str, list] = {}
+    for tipo, insumo_id, _ in cambios:
+        por_tipo.setdefault(tipo, []).append(insumo_id)
+    for tipo, ids in por_tipo.items():
+        connection.execute(delete(CatalogoCambio).where(CatalogoCambio.tipo_insumo == tipo, CatalogoCambio.insumo_id.in_(ids)))
+    ahora = datetime.utcnow()
+    connection.execute(insert(CatalogoCambio), [
+        {"tipo_insumo": tipo, "insumo_id": insumo_id, "eliminado": eliminado, "fecha": ahora}
+        for tipo, insumo_id, eliminado in cambios
+    ])
+
+@event.listens_for(db.session, "after_flush")
+def _registrar_flush_catalogo(session, flush_context):
+    cambios: Dict[Tuple[str, int], bool] = {}
+    for obj in session.new:
+        if type(obj) in TIPOS_CATALOGO:
+            cambios[(TIPOS_CATALOGO[type(obj)], obj.id)] = False
+    for obj in session.dirty:
+        if type(obj) in TIPOS_CATALOGO and session.is_modified(obj, include_collections=False):
+            cambios[(TIPOS_CATALOGO[type(obj)], obj.id)] = False
+    for obj in session.deleted:
+        if type(obj) in TIPOS_CATALOGO:
+            cambios[(TIPOS_CATALOGO[type(obj)], obj.id)] = True
+    registrar_cambios_catalogo(session.connection(), [(tipo, insumo_id, eliminado) for (tipo, insumo_id), eliminado in cambios.items()])
+
+class ConceptoCambio(db.Model):
+    """Bitácora de conceptos cuya matriz cambió; su id máximo es la versión de las matrices."""
+    __tablename__ = "conceptos_cambios"
+    __table_args__ = {"sqlite_autoincrement": True}
+    id = db.Column(db.Integer, primary_key=True)
+    concepto_id = db.Column(db.Integer, nullable=False, index=True)
+    fecha = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+def registrar_cambios_conceptos(connection, concepto_ids: Iterable[int]) -> None:
+    """
+    Anota los conceptos cuya matriz cambió, conservando solo la entrada más reciente de cada uno.
+    Las escrituras en bloque que no pasan por el flush del ORM deben llamarla explícitamente.
+    """
+    concepto_ids = sorted(set(concepto_ids))
+    if not concepto_ids:
+        return
+    connection.execute(delete(ConceptoCambio).where(ConceptoCambio.concepto_id.in_(concepto_ids)))
+    ahora = datetime.utcnow()
+    connection.execute(insert(ConceptoCambio), [{"concepto_id": concepto_id, "fecha": ahora} for concepto_id in concepto_ids])
+
+@event.listens_for(db.session, "after_flush")
+def _registrar_flush_conceptos(session, flush_context):
+    modificados = [obj for obj in session.dirty if session.is_modified(obj, include_collections=False)]
+    concepto_ids = set()
+    for obj in [*session.new, *modificados, *session.deleted]:
+        if isinstance(obj, Concepto):
+            concepto_ids.add(obj.id)
+        elif isinstance(obj, MatrizInsumo) and obj.concepto_id is not None:
+            concepto_ids.add(obj.concepto_id)
+    registrar_cambios_conceptos(session.connection(), concepto_ids)
+
+class VersionDatos(db.Model):
+    """Contador de versión por ámbito ("proyectos", "proyecto:<id>", "partida:<id>", "conceptos") para los ETag de las lecturas."""
+    __tablename__ = "versiones_datos"
+    clave = db.Column(db.String(50), primary_key=True)
+    version = db.Column(db.Integer, default=0, nullable=False)
+
+def incrementar_versiones(connection, claves: Iterable[str]) -> None:
+    """
+    Incrementa (o crea en 1) el contador de cada ámbito dentro de la transacción en curso.
+    Las escrituras en bloque que no pasan por el flush del ORM deben llamarla explícitamente.
+    """
+    claves = sorted(set(claves))
+    if not claves:
+        return
+    sentencia = sqlite_insert(VersionDatos).values([{"clave": clave, "version": 1} for clave in claves])
+    connection.execute(sentencia.on_conflict_do_update(index_elements=["clave"], set_={"version": VersionDatos.version + 1}))
+
+def _ambitos_presupuesto(session, objetos) -> set:
+    claves = set()
+    proyecto_de_partida: Dict[int, int] = {}
+    partidas_de_detalles = set()
+    for obj in objetos:
+        if isinstance(obj, Proyecto):
+            claves.update({"proyectos", f"proyecto:{obj.id}"})
+        elif isinstance(obj, Partida):
+            claves.update({f"proyecto:{obj.proyecto_id}", f"partida:{obj.id}"})
+            proyecto_de_partida[obj.id] = obj.proyecto_id
+        elif isinstance(obj, DetallePresupuesto):
+            claves.add(f"partida:{obj.partida_id}")
+            partidas_de_detalles.add(obj.partida_id)
+        elif isinstance(obj, (Concepto, MatrizInsumo)):
+            claves.add("conceptos")
+    faltantes = partidas_de_detalles - set(proyecto_de_partida)
+    if faltantes:
+        proyecto_de_partida.update(session.connection().execute(select(Partida.id, Partida.proyecto_id).where(Partida.id.in_(faltantes))).all())
+    claves.update(f"proyecto:{proyecto_de_partida[p]}" for p in partidas_de_detalles if p in proyecto_de_partida)
+    return claves
+
+@event.listens_for(db.session, "after_flush")
+def _registrar_flush_versiones(session, flush_context):
+    modificados = [obj for obj in session.dirty if session.is_modified(obj, include_collections=False)]
+    incrementar_versiones(session.connection(), _ambitos_presupuesto(session, [*session.new, *modificados, *session.deleted]))
+
+class Job(db.Model):
+    """Trabajo en segundo plano persistido en la base; la cola sobrevive reinicios del proceso."""
+    __tablename__ = "jobs"
+    __table_args__ = (db.Index("ix_jobs_estado_ejecutar", "estado", "ejecutar_despues"),)
+    id = db.Column(db.Integer, primary_key=True)
+    tipo = db.Column(db.String(50), nullable=False)
+    estado = db.Column(db.String(20), default="pendiente", nullable=False)
+    payload = db.Column(db.JSON, nullable=True)
+    resultado = db.Column(db.JSON, nullable=True)
+    error = db.Column(db.Text, nullable=True)
+    progreso = db.Column(db.Float, default=0.0, nullable=False)
+    mensaje = db.Column(db.String(255), nullable=True)
+    intentos = db.Column(db.Integer, default=0, nullable=False)
+    max_intentos = db.Column(db.Integer, default=3, nullable=False)
+    cancelacion_solicitada = db.Column(db.Boolean, default=False, nullable=False)
+    worker = db.Column(db.String(100), nullable=True)
+    ejecutar_despues = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    creado = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    actualizado = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    iniciado = db.Column(db.DateTime, nullable=True)
+    terminado = db.Column(db.DateTime, nullable=True)
+    def to_dict(self):
+        return { "id": self.id, "tipo": self.tipo, "estado": self.estado, "progreso": self.progreso, "mensaje": self.mensaje, "resultado": self.resultado, "error": self.error, "intentos": self.intentos, "max_intentos": self.max_intentos, "cancelacion_solicitada": bool(self.cancelacion_solicitada), "creado": self.creado.isoformat() if self.creado else None, "iniciado": self.iniciado.isoformat() if self.iniciado else None, "terminado": self.terminado.isoformat() if self.terminado else None }
+
+class CuboCosto(db.Model):
+    """Costo directo agregado por proyecto × partida × insumo, con disciplina y calidad del insumo, para analytics sin recorrer matrices."""
+    __tablename__ = "cubo_costos"
+    __table_args__ = (
+        db.Index("ix_cubo_costos_proyecto_partida", "proyecto_id", "partida_id"),
+        db.Index("ix_cubo_costos_proyecto_tipo", "proyecto_id", "tipo_insumo", "disciplina", "calidad"),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    proyecto_id = db.Column(db.Integer, nullable=False)
+    partida_id = db.Column(db.Integer, nullable=False)
+    tipo_insumo = db.Column(db.String(20), nullable=False)
+    id_insumo = db.Column(db.Integer, nullable=False)
+    nombre = db.Column(db.String(255), nullable=True)
+    unidad = db.Column(db.String(50), nullable=True)
+    disciplina = db.Column(db.String(100), nullable=True)
+    calidad = db.Column(db.String(100), nullable=True)
+    cantidad = db.Column(db.Numeric(18, 4), nullable=False)
+    importe = db.Column(db.Numeric(18, 4), nullable=False)
+
+class CuboPartida(db.Model):
+    """
+    Versiones con las que se calcularon las filas del cubo de una partida: la de sus detalles
+    (partida:<id>), la bitácora de conceptos y la del catálogo; si cambian, la partida se revisa.
+    """
+    __tablename__ = "cubo_partidas"
+    partida_id = db.Column(db.Integer, primary_key=True)
+    proyecto_id = db.Column(db.Integer, nullable=False, index=True)
+    version_partida = db.Column(db.Integer, nullable=False)
+    version_conceptos = db.Column(db.Integer, nullable=False)
+    version_catalogo = db.Column(db.Integer, nullable=False)
+
+class SesionCalculoPU(db.Model):
+    """Encabezado (factores y totales) de una sesión de cálculo incremental de PU, compartido por todos los workers."""
+    __tablename__ = "sesiones_pu"
+    token = db.Column(db.String(64), primary_key=True)
+    estado = db.Column(db.JSON, nullable=False)
+    version = db.Column(db.Integer, default=1, nullable=False)
+    actualizado = db.Column(db.DateTime, default=datetime.utcnow, nullable=False, index=True)
+
+class SesionCalculoPUFila(db.Model):
+    """Renglón de una sesión de cálculo de PU; cada PATCH reescribe solo los renglones que tocó."""
+    __tablename__ = "sesiones_pu_filas"
+    token = db.Column(db.String(64), primary_key=True)
+    clave = db.Column(db.String(64), primary_key=True)
+    fila = db.Column(db.JSON, nullable=False)
@@ -2,9 +2,34 @@ from flask import Blueprint, request, jsonify
 from backend.app import db
 from backend.app.models import Material, Equipo, Maquinaria, ManoObra
 from backend.app.utils import decimal_field
+from backend.app.services.catalogo_service import construir_snapshot
+from backend.app.services.conciliacion_service import conciliar_sugerencias
 catalogos_bp = Blueprint('catalogos_bp', __name__)
 # ... (CONTENIDO COMPLETO de todas las rutas CRUD para los 4 tipos de insumo) ...
 @catalogos_bp.route("/materiales", methods=["GET", "POST"])
 def m():
     if request.method == "GET": return jsonify([i.to_dict() for i in Material.query.all()])
     p=request.get_json(); n=Material(nombre=p['nombre'], unidad=p['unidad'], precio_unitario=decimal_field(p['precio_unitario'])); db.session.add(n); db.session.commit(); return jsonify(n.to_dict()), 201
+
+@catalogos_bp.route("/catalogos/snapshot", methods=["GET"])
+def catalogos_snapshot():
+    """Catálogos completos en formato columnar, o solo los cambios desde `?since=<version>`."""
+    return jsonify(construir_snapshot(request.args.get("since", type=int)))
+
+@catalogos_bp.route("/catalogos/conciliar", methods=["POST"])
+def conciliar_con_catalogo():
+    """
+    Relaciona una lista de insumos sugeridos (p. ej. la respuesta de /ia/chat_apu) con el catálogo.
+    Body: {"sugerencias": [{tipo_insumo, nombre, unidad, insumo_id?}], "top_k": 3}
+    """
+    p = request.get_json(force=True) or {}
+    sugerencias = p.get("sugerencias") if isinstance(p, dict) else p
+    if not isinstance(sugerencias, list):
+        return jsonify({"error": "Se requiere la lista de sugerencias"}), 400
+    top_k = p.get("top_k", 3) if isinstance(p, dict) else 3
+    if top_k is None:
+        top_k = 3
+    if isinstance(top_k, bool) or not isinstance(top_k, (int, str)) or not str(top_k).strip().isdigit():
+        return jsonify({"error": "top_k debe ser un entero positivo"}), 400
+    top_k = max(1, min(int(top_k), 10))
+    return jsonify({"resultados": conciliar_sugerencias(sugerencias, top_k)})
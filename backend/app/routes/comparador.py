@@ -0,0 +1,15 @@
+from flask import Blueprint, request, jsonify
+from backend.app.services.comparador_service import comparar_conceptos
+comparador_bp = Blueprint('comparador_bp', __name__)
+
+@comparador_bp.route("/comparador", methods=["POST"])
+def comparar():
+    """
+    Compara conceptos entre perfiles de factores y escenarios de precios en una sola llamada.
+    Body: {"conceptos": [ids], "perfiles": [...], "escenarios": [...], "base": {"perfil": 0, "escenario": 0}}
+    """
+    p = request.get_json(force=True) or {}
+    try:
+        return jsonify(comparar_conceptos(p.get("conceptos"), p.get("perfiles"), p.get("escenarios"), p.get("base")))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
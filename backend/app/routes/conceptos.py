@@ -2,8 +2,52 @@ from flask import Blueprint, request, jsonify
 from backend.app import db
 from backend.app.models import Concepto, MatrizInsumo
 from backend.app.services.calculation_service import calcular_precio_unitario, normalizar_factores
+from backend.app.services.matriz_service import reemplazar_matriz
+from backend.app.services.pu_sesion_service import ConflictoSesion, abrir_sesion, aplicar_cambios, obtener_almacen
 conceptos_bp = Blueprint('conceptos_bp', __name__)
 # ... (CONTENIDO COMPLETO de las rutas de conceptos y matriz) ...
 @conceptos_bp.route("/conceptos/calcular_pu", methods=["POST"])
 def calc():
     p = request.get_json(); return jsonify(calcular_precio_unitario(matriz=p.get("matriz")))
+
+@conceptos_bp.route("/conceptos/<int:concepto_id>/matriz", methods=["PUT"])
+def reemplazar_matriz_concepto(concepto_id: int):
+    """
+    Reemplaza la matriz completa del concepto en una sola transacción y devuelve el nuevo PU.
+    Acepta una lista de renglones o {"matriz": [...], "factores": {...}}.
+    """
+    concepto = Concepto.query.get_or_404(concepto_id)
+    payload = request.get_json(force=True)
+    filas = payload.get("matriz") if isinstance(payload, dict) else payload
+    if not isinstance(filas, list):
+        return jsonify({"error": "El payload debe incluir la lista completa de renglones"}), 400
+    factores = normalizar_factores(payload.get("factores")) if isinstance(payload, dict) else None
+    try:
+        return jsonify(reemplazar_matriz(concepto, filas, factores))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+@conceptos_bp.route("/conceptos/calcular_pu/sesiones", methods=["POST"])
+def abrir_sesion_pu():
+    """Abre una sesión de cálculo incremental con la matriz enviada o la guardada del concepto."""
+    p = request.get_json(silent=True) or {}
+    try:
+        return jsonify(abrir_sesion(matriz=p.get("matriz"), concepto_id=p.get("concepto_id"), factores=normalizar_factores(p.get("factores")))), 201
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+@conceptos_bp.route("/conceptos/calcular_pu/sesiones/<token>", methods=["PATCH", "DELETE"])
+def sesion_pu(token: str):
+    """Aplica cambios de renglón a una sesión abierta, o la cierra."""
+    if request.method == "DELETE":
+        obtener_almacen().cerrar(token)
+        return "", 204
+    p = request.get_json(silent=True) or {}
+    factores = normalizar_factores(p.get("factores")) if "factores" in p else None
+    try:
+        resultado = aplicar_cambios(token, p.get("cambios") or [], factores)
+    except ConflictoSesion:
+        return jsonify({"error": "La sesión cambió en otra petición; reenvíe los cambios"}), 409
+    if resultado is None:
+        return jsonify({"error": "La sesión de cálculo no existe o expiró"}), 404
+    return jsonify(resultado)
@@ -1,4 +1,5 @@
-from flask import Blueprint, jsonify
+from flask import Blueprint, jsonify, request
+from backend.app.services.cubo_service import FILTROS, consultar_cubo
 from backend.app.services.dashboard_service import get_dashboard_data
 
 dashboard_bp = Blueprint('dashboard_bp', __name__)
@@ -14,3 +15,20 @@ def get_project_dashboard_data(proyecto_id: int):
     except Exception as e:
         # En caso de que un proyecto no se encuentre (404) o haya otro error
         return jsonify({"error": str(e)}), 500
+
+@dashboard_bp.route("/proyectos/<int:proyecto_id>/analytics", methods=["GET"])
+def get_project_analytics(proyecto_id: int):
+    """
+    Costo directo del proyecto desde el cubo precalculado.
+    Query: agrupar=partida,tipo_insumo,disciplina,calidad,insumo (cualquier combinación),
+    filtros partida_id, tipo_insumo, disciplina, calidad, id_insumo y limite.
+    """
+    agrupar = [d.strip() for d in (request.args.get("agrupar") or "tipo_insumo").split(",") if d.strip()]
+    filtros = {clave: request.args.get(clave) for clave in FILTROS if clave in request.args}
+    limite = request.args.get("limite", type=int)
+    if "limite" in request.args and limite is None:
+        return jsonify({"error": "limite debe ser un entero positivo"}), 400
+    try:
+        return jsonify(consultar_cubo(proyecto_id, agrupar, filtros, limite))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
@@ -0,0 +1,16 @@
+from flask import Blueprint, Response, jsonify, request, stream_with_context
+from backend.app.services.ia_stream_service import stream_chat_apu
+ia_stream_bp = Blueprint('ia_stream_bp', __name__)
+
+@ia_stream_bp.route("/chat_apu/stream", methods=["POST"])
+def chat_apu_stream():
+    """
+    Variante de /ia/chat_apu que responde Server-Sent Events: un evento `insumo` por insumo
+    conciliado con el catálogo en cuanto la IA lo genera, y un evento `fin` con la explicación.
+    """
+    data = request.get_json(silent=True) or {}
+    descripcion = (data.get("descripcion") or "").strip()
+    if not descripcion:
+        return jsonify({"error": "Falta descripción"}), 400
+    eventos = stream_chat_apu(descripcion, data.get("unidad") or "m2", data.get("concepto_id"))
+    return Response(stream_with_context(eventos), mimetype="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
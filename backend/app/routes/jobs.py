@@ -0,0 +1,32 @@
+import os
+from flask import Blueprint, request, jsonify, send_file, current_app, url_for
+from backend.app import db
+from backend.app.models import Job
+from backend.app.services.job_service import encolar, cancelar
+jobs_bp = Blueprint('jobs_bp', __name__)
+
+@jobs_bp.route("/jobs", methods=["POST"])
+def crear_job():
+    """Encola un trabajo largo ({"tipo", "payload", "max_intentos"}) y responde de inmediato con su id."""
+    p = request.get_json(force=True) or {}
+    try:
+        job = encolar(p.get("tipo"), p.get("payload"), p.get("max_intentos"))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify(job.to_dict()), 202, {"Location": url_for("jobs_bp.obtener_job", job_id=job.id)}
+
+@jobs_bp.route("/jobs/<int:job_id>", methods=["GET"])
+def obtener_job(job_id: int):
+    return jsonify(db.get_or_404(Job, job_id).to_dict())
+
+@jobs_bp.route("/jobs/<int:job_id>/cancelar", methods=["POST"])
+def cancelar_job(job_id: int):
+    return jsonify(cancelar(db.get_or_404(Job, job_id)).to_dict())
+
+@jobs_bp.route("/jobs/<int:job_id>/archivo", methods=["GET"])
+def descargar_archivo_job(job_id: int):
+    job = db.get_or_404(Job, job_id)
+    archivo = (job.resultado or {}).get("archivo") if job.estado == "completado" else None
+    if not archivo:
+        return jsonify({"error": "El job no generó ningún archivo"}), 404
+    return send_file(os.path.join(current_app.config["JOBS_DIR"], archivo), mimetype=job.resultado.get("mimetype"), as_attachment=True, download_name=archivo)
@@ -0,0 +1,13 @@
+from flask import Blueprint, Response, jsonify, request, stream_with_context
+from backend.app.services.presupuesto_service import obtener_presupuesto, stream_presupuesto
+presupuesto_bp = Blueprint('presupuesto_bp', __name__)
+
+@presupuesto_bp.route("/proyectos/<int:proyecto_id>/presupuesto", methods=["GET"])
+def get_presupuesto(proyecto_id: int):
+    """
+    Árbol completo del presupuesto (proyecto, partidas, detalles con concepto y subtotales) en una sola petición.
+    Con ?stream=1 responde NDJSON línea por línea para presupuestos muy grandes.
+    """
+    if request.args.get("stream") in ("1", "true"):
+        return Response(stream_with_context(stream_presupuesto(proyecto_id)), mimetype="application/x-ndjson")
+    return jsonify(obtener_presupuesto(proyecto_id))
@@ -0,0 +1,3 @@
+from flask import Blueprint
+proyectos_bp = Blueprint('proyectos_bp', __name__)
+# ... (CONTENIDO COMPLETO de las rutas de proyectos) ...
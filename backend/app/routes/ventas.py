@@ -0,0 +1,3 @@
+from flask import Blueprint
+ventas_bp = Blueprint('ventas_bp', __name__)
+# ... (CONTENIDO COMPLETO de las rutas de ventas) ...
@@ -1,6 +1,7 @@
 from decimal import Decimal
 from typing import Dict, List, Optional
-from backend.app.models import ConstantesFASAR, Material, ManoObra, Equipo, Maquinaria, MatrizIno, Proyecto
+from backend.app.models import ConstantesFASAR, Material, ManoObra, Equipo, Maquinaria, MatrizInsumo, Proyecto
+from backend.app.services.tabla_costos_service import caches_insumos
 from backend.app.utils import decimal_field
 
 # (Todo el contenido completo y correcto de calculation_service.py)
@@ -13,7 +14,114 @@ def calcular_fasar_valor() -> Decimal:
     return (dias_pagados / dias_trabajados) * (Decimal("1.0") + Decimal(constantes.suma_cargas_sociales))
 
 def calcular_precio_unitario(concepto_id=None, matriz=None, factores=None):
-    # ... lógica completa ...
-    return {"costo_directo": 0.0, "precio_unitario": 0.0}
+    if matriz is not None:
+        registros = matriz
+    elif concepto_id:
+        registros = [insumo.to_dict() for insumo in MatrizInsumo.query.filter_by(concepto_id=concepto_id)]
+    else:
+        registros = []
+
+    cd_base = Decimal("0")
+    costo_mano_obra = Decimal("0")
+    # Los costos de insumo salen de la tabla compartida del catálogo; sin ella, dicts que se llenan por consulta
+    caches = caches_insumos()
+    for registro in registros:
+        cantidad = decimal_field(registro["cantidad"])
+        costo_unitario = None
+        precio_override = registro.get("precio_unitario_sugerido")
+        if precio_override is not None:
+            try:
+                costo_unitario = decimal_field(precio_override)
+            except Exception:
+                costo_unitario = None
+        if costo_unitario is None:
+            costo_unitario = obtener_costo_insumo(registro, caches)
+        importe = cantidad * costo_unitario
+        cd_base += importe
+        if registro["tipo_insumo"] == "ManoObra":
+            costo_mano_obra += importe
+
+    factores = factores or {}
+    cd_total = cd_base + costo_mano_obra * obtener_factor_decimal(factores, "mano_obra")
+    multiplicador = Decimal("1.0")
+    for key in ("indirectos", "financiamiento", "utilidad", "iva"):
+        multiplicador *= Decimal("1.0") + obtener_factor_decimal(factores, key)
+    return {"costo_directo": float(cd_total), "precio_unitario": float(cd_total * multiplicador)}
+
+def obtener_factor_decimal(factores: Dict[str, Dict[str, Decimal]], clave: str) -> Decimal:
+    config = factores.get(clave) or {}
+    if not config.get("activo"):
+        return Decimal("0.0")
+    return Decimal(config.get("porcentaje", Decimal("0.0")))
+
+def normalizar_factores(payload: Optional[Dict]) -> Dict[str, Dict[str, Decimal]]:
+    if not payload:
+        return {}
+    factores: Dict[str, Dict[str, Decimal]] = {}
+    for clave in ("mano_obra", "indirectos", "financiamiento", "utilidad", "iva"):
+        datos = payload.get(clave) or {}
+        factores[clave] = {"activo": bool(datos.get("activo")), "porcentaje": decimal_field(datos.get("porcentaje"))}
+    return factores
+
+def obtener_factores_de_proyecto(proyecto: Proyecto) -> Dict[str, Dict[str, Decimal]]:
+    return {
+        clave: {
+            "activo": bool(getattr(proyecto, f"ajuste_{clave}_activo")),
+            "porcentaje": decimal_field(getattr(proyecto, f"ajuste_{clave}_porcentaje")),
+        }
+        for clave in ("mano_obra", "indirectos", "financiamiento", "utilidad", "iva")
+    }
+
+def calcular_costo_posesion(maquinaria: Maquinaria) -> Decimal:
+    costo = decimal_field(maquinaria.costo_adquisicion)
+    vida = decimal_field(maquinaria.vida_util_horas or Decimal("1.0"))
+    if vida <= 0:
+        vida = Decimal("1.0")
+    tasa = decimal_field(maquinaria.tasa_interes_anual or Decimal("0.0"))
+    return costo / vida + (costo * tasa) / vida
+
+def obtener_costo_insumo(registro: Dict, caches) -> Decimal:
+    """
+    Costo unitario de un renglón de matriz. `caches` son los cuatro mapeos id -> insumo
+    (material, mano_obra, equipo, maquinaria); lo que no está en ellos se consulta y se guarda.
+    """
+    material_cache, mano_obra_cache, equipo_cache, maquinaria_cache = caches
+    tipo = registro["tipo_insumo"]
+    insumo_id = registro.get("id_insumo")
+    if not insumo_id:
+        return Decimal("0")
+    if tipo == "Material":
+        material = material_cache.get(insumo_id)
+        if material is None:
+            material = Material.query.get_or_404(insumo_id)
+            material_cache[insumo_id] = material
+        merma = decimal_field(registro.get("porcentaje_merma")) if registro.get("porcentaje_merma") is not None else decimal_field(material.porcentaje_merma)
+        flete = decimal_field(registro.get("precio_flete_unitario")) if registro.get("precio_flete_unitario") is not None else decimal_field(material.precio_flete_unitario)
+        return decimal_field(material.precio_unitario) * (Decimal("1.0") + merma) + flete
+    if tipo == "ManoObra":
+        mano = mano_obra_cache.get(insumo_id)
+        if mano is None:
+            mano = ManoObra.query.get_or_404(insumo_id)
+            mano_obra_cache[insumo_id] = mano
+        rendimiento = decimal_field(mano.rendimiento_jornada or Decimal("1.0"))
+        if rendimiento <= 0:
+            rendimiento = Decimal("1.0")
+        return decimal_field(mano.salario_base) * decimal_field(mano.fasar) / rendimiento
+    if tipo == "Equipo":
+        equipo = equipo_cache.get(insumo_id)
+        if equipo is None:
+            equipo = Equipo.query.get_or_404(insumo_id)
+            equipo_cache[insumo_id] = equipo
+        return decimal_field(equipo.costo_hora_maq)
+    if tipo == "Maquinaria":
+        maquina = maquinaria_cache.get(insumo_id)
+        if maquina is None:
+            maquina = Maquinaria.query.get_or_404(insumo_id)
+            maquinaria_cache[insumo_id] = maquina
+        rendimiento = decimal_field(maquina.rendimiento_horario or Decimal("1.0"))
+        if rendimiento <= 0:
+            rendimiento = Decimal("1.0")
+        return decimal_field(maquina.costo_posesion_hora) / rendimiento
+    raise ValueError(f"Tipo de insumo no soportado: {tipo}")
 
 # ... resto de funciones completas ...
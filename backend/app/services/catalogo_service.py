@@ -0,0 +1,107 @@
+from typing import Dict, Iterable, List, Optional, Tuple
+from flask import current_app
+from sqlalchemy import func
+from backend.app import db
+from backend.app.models import Material, ManoObra, Equipo, Maquinaria, CatalogoCambio
+
+# (clave en el payload, tipo_insumo de la bitácora, modelo)
+CATALOGOS = (
+    ("materiales", "Material", Material),
+    ("mano_obra", "ManoObra", ManoObra),
+    ("equipos", "Equipo", Equipo),
+    ("maquinaria", "Maquinaria", Maquinaria),
+)
+
+
+def cargar_insumos(claves: Iterable[Tuple[str, int]]) -> Dict[str, Dict[int, object]]:
+    """{tipo_insumo: {id: modelo}} de las claves (tipo_insumo, id), con una consulta por tipo en lotes de 900."""
+    ids_por_tipo: Dict[str, set] = {}
+    for tipo, insumo_id in claves:
+        ids_por_tipo.setdefault(tipo, set()).add(insumo_id)
+    insumos: Dict[str, Dict[int, object]] = {}
+    for _, tipo, modelo in CATALOGOS:
+        ids = sorted(ids_por_tipo.get(tipo, ()))
+        insumos[tipo] = {}
+        for inicio in range(0, len(ids), 900):
+            insumos[tipo].update({insumo.id: insumo for insumo in modelo.query.filter(modelo.id.in_(ids[inicio:inicio + 900]))})
+    return insumos
+
+
+def nombre_y_unidad(tipo: str, insumo) -> Tuple[str, str]:
+    """Nombre y unidad con que se muestra un insumo del catálogo; la mano de obra va por jornada."""
+    if tipo == "ManoObra":
+        return insumo.puesto, "jornada"
+    return insumo.nombre, getattr(insumo, "unidad", None) or "hora"
+
+
+def cargar_caches_insumos(claves: Iterable[Tuple[str, int]]) -> Tuple[Dict, Dict, Dict, Dict]:
+    """
+    Devuelve los caches (material, mano_obra, equipo, maquinaria) de obtener_costo_insumo ya llenos
+    para las claves (tipo_insumo, id), con una consulta por tipo en lugar de una por renglón.
+    Si la tabla de costos compartida está activa se usa esa y no se consulta nada.
+    """
+    from backend.app.services.tabla_costos_service import obtener_tabla_costos
+
+    tabla = obtener_tabla_costos()
+    if tabla is not None:
+        return tabla.caches()
+    insumos = cargar_insumos(claves)
+    return tuple(insumos[tipo] for _, tipo, _ in CATALOGOS)
+
+
+def insumos_inexistentes(claves: Iterable[Tuple[str, int]]) -> List[Tuple[str, int]]:
+    """Devuelve las claves (tipo_insumo, id) que no están en el catálogo, con una consulta de ids por tipo."""
+    ids_por_tipo: Dict[str, set] = {}
+    for tipo, insumo_id in claves:
+        ids_por_tipo.setdefault(tipo, set()).add(insumo_id)
+    faltantes = []
+    for _, tipo, modelo in CATALOGOS:
+        ids = sorted(ids_por_tipo.get(tipo, ()))
+        existentes = set()
+        for inicio in range(0, len(ids), 900):
+            existentes.update(insumo_id for (insumo_id,) in db.session.query(modelo.id).filter(modelo.id.in_(ids[inicio:inicio + 900])))
+        faltantes.extend((tipo, insumo_id) for insumo_id in ids if insumo_id not in existentes)
+    return faltantes
+
+
+def version_catalogo() -> int:
+    return db.session.query(func.max(CatalogoCambio.id)).scalar() or 0
+
+
+def _columnar(registros: List) -> Dict[str, list]:
+    """
+    Convierte una lista de registros en {columna: [valores]} usando las llaves de `to_dict`.
+    Omite `obsoleto`: depende de la fecha de hoy y no de una escritura, así que el delta nunca
+    lo reenviaría; el cliente lo calcula con `fecha_actualizacion` y `dias_obsoleto`.
+    """
+    filas = [registro.to_dict() for registro in registros]
+    if not filas:
+        return {}
+    return {columna: [fila[columna] for fila in filas] for columna in filas[0] if columna != "obsoleto"}
+
+
+def construir_snapshot(desde: Optional[int] = None) -> Dict:
+    """
+    Devuelve los cuatro catálogos en formato columnar junto con la versión vigente.
+    Con `desde` solo incluye los insumos modificados después de esa versión y los ids eliminados;
+    si la versión es desconocida (0, futura o de otra base) responde el catálogo completo.
+    """
+    # La versión se lee antes que los datos: si hay una escritura concurrente, el cliente
+    # la volverá a recibir en su siguiente delta en lugar de perderla.
+    version = version_catalogo()
+    completo = not desde or desde < 0 or desde > version
+    snapshot: Dict = {"version": version, "completo": completo, "eliminados": {}, "dias_obsoleto": current_app.config["PRECIOS_OBSOLETOS_DIAS"]}
+    if completo:
+        for clave, _, modelo in CATALOGOS:
+            snapshot[clave] = _columnar(modelo.query.order_by(modelo.id).all())
+        return snapshot
+
+    cambios = CatalogoCambio.query.filter(CatalogoCambio.id > desde, CatalogoCambio.id <= version).all()
+    for clave, tipo, modelo in CATALOGOS:
+        modificados = {c.insumo_id for c in cambios if c.tipo_insumo == tipo and not c.eliminado}
+        eliminados = sorted(c.insumo_id for c in cambios if c.tipo_insumo == tipo and c.eliminado)
+        registros = modelo.query.filter(modelo.id.in_(modificados)).order_by(modelo.id).all() if modificados else []
+        snapshot[clave] = _columnar(registros)
+        if eliminados:
+            snapshot["eliminados"][clave] = eliminados
+    return snapshot
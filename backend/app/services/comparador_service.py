@@ -0,0 +1,165 @@
+from collections import defaultdict
+from decimal import Decimal
+from typing import Dict, List, Optional, Tuple
+from flask import current_app
+from backend.app.models import Concepto, MatrizInsumo, Proyecto
+from backend.app.services.calculation_service import (
+    normalizar_factores, obtener_costo_insumo, obtener_factor_decimal, obtener_factores_de_proyecto,
+)
+from backend.app.services.catalogo_service import cargar_caches_insumos
+from backend.app.utils import decimal_field
+
+ClaveInsumo = Tuple[str, int]
+
+FACTORES_PU = ("indirectos", "financiamiento", "utilidad", "iva")
+
+
+def _clave_insumo(datos: Dict) -> ClaveInsumo:
+    if not datos.get("tipo_insumo") or not datos.get("id_insumo"):
+        raise ValueError("Cada insumo del escenario requiere tipo_insumo e id_insumo")
+    return datos["tipo_insumo"], int(datos["id_insumo"])
+
+
+def _resolver_perfiles(perfiles: List[Dict]) -> List[Dict]:
+    """Convierte cada perfil ({"proyecto_id"} o {"factores"}) en factores normalizados, con una sola consulta de proyectos."""
+    ids_proyecto = {int(p["proyecto_id"]) for p in perfiles if p.get("proyecto_id")}
+    proyectos = {p.id: p for p in Proyecto.query.filter(Proyecto.id.in_(ids_proyecto))} if ids_proyecto else {}
+    resueltos = []
+    for indice, perfil in enumerate(perfiles):
+        if perfil.get("proyecto_id"):
+            proyecto = proyectos.get(int(perfil["proyecto_id"]))
+            if proyecto is None:
+                raise ValueError(f"Proyecto {perfil['proyecto_id']} no encontrado")
+            factores = obtener_factores_de_proyecto(proyecto)
+            nombre = perfil.get("nombre") or proyecto.nombre_proyecto
+        else:
+            factores = normalizar_factores(perfil.get("factores"))
+            nombre = perfil.get("nombre") or f"Perfil {indice + 1}"
+        multiplicador = Decimal("1.0")
+        for clave in FACTORES_PU:
+            multiplicador *= Decimal("1.0") + obtener_factor_decimal(factores, clave)
+        resueltos.append({
+            "indice": indice, "nombre": nombre, "proyecto_id": perfil.get("proyecto_id"),
+            "factor_mano_obra": obtener_factor_decimal(factores, "mano_obra"), "multiplicador": multiplicador,
+        })
+    return resueltos
+
+
+def _resolver_escenarios(escenarios: List[Dict]) -> List[Dict]:
+    """
+    Un escenario sustituye costos del catálogo: `precios` fija el costo unitario de un insumo
+    ({tipo_insumo, id_insumo, costo_unitario}) o lo escala ({..., factor}); `sustituciones`
+    cambia un insumo por otro del catálogo ({tipo_insumo, id_insumo, por: {tipo_insumo, id_insumo}}).
+    """
+    resueltos = []
+    for indice, escenario in enumerate(escenarios):
+        precios, factores, sustituciones = {}, {}, {}
+        for precio in escenario.get("precios") or []:
+            clave = _clave_insumo(precio)
+            if precio.get("costo_unitario") is not None:
+                precios[clave] = decimal_field(precio["costo_unitario"])
+            elif precio.get("factor") is not None:
+                factores[clave] = decimal_field(precio["factor"])
+            else:
+                raise ValueError("Cada precio del escenario requiere costo_unitario o factor")
+        for sustitucion in escenario.get("sustituciones") or []:
+            sustituciones[_clave_insumo(sustitucion)] = _clave_insumo(sustitucion.get("por") or {})
+        resueltos.append({
+            "indice": indice, "nombre": escenario.get("nombre") or f"Escenario {indice + 1}",
+            "precios": precios, "factores": factores, "sustituciones": sustituciones,
+        })
+    return resueltos
+
+
+def _costo_renglon(registro: Dict, clave: ClaveInsumo, escenario: Dict, costos: Dict, caches) -> Decimal:
+    if clave in escenario["precios"]:
+        return escenario["precios"][clave]
+    tipo, insumo_id = escenario["sustituciones"].get(clave, clave)
+    if (tipo, insumo_id) != clave:
+        # El insumo alterno usa su propia merma y flete de catálogo: comparte costo con un renglón sin ajustes
+        registro = {"tipo_insumo": tipo, "id_insumo": insumo_id}
+    llave = (tipo, insumo_id, registro.get("porcentaje_merma"), registro.get("precio_flete_unitario"))
+    if llave not in costos:
+        costos[llave] = obtener_costo_insumo(registro, caches)
+    return costos[llave] * escenario["factores"].get(clave, Decimal("1.0"))
+
+
+def comparar_conceptos(conceptos: List[int], perfiles: Optional[List[Dict]] = None, escenarios: Optional[List[Dict]] = None, base: Optional[Dict] = None) -> Dict:
+    """
+    Evalúa la rejilla conceptos × perfiles de factores × escenarios de precio en una sola pasada.
+
+    Las matrices y los insumos se cargan una vez; por cada concepto y escenario se acumulan
+    el costo directo base y el de mano de obra, y de ahí sale el PU de cada perfil sin volver
+    a recorrer la matriz. Cada celda incluye su diferencia contra la celda `base` del mismo concepto.
+    """
+    ids_concepto = list(dict.fromkeys(int(c) for c in conceptos or []))
+    if not ids_concepto:
+        raise ValueError("Se requiere al menos un concepto")
+    perfiles_resueltos = _resolver_perfiles(perfiles or [{"nombre": "Sin factores"}])
+    escenarios_resueltos = _resolver_escenarios(escenarios or [{"nombre": "Catálogo actual"}])
+    celdas_totales = len(ids_concepto) * len(perfiles_resueltos) * len(escenarios_resueltos)
+    celdas_maximas = current_app.config["COMPARADOR_CELDAS_MAXIMAS"]
+    if celdas_totales > celdas_maximas:
+        raise ValueError(f"La comparación genera {celdas_totales} celdas; el máximo es {celdas_maximas}")
+    base = base or {}
+    perfil_base = int(base.get("perfil", 0))
+    escenario_base = int(base.get("escenario", 0))
+    if not (0 <= perfil_base < len(perfiles_resueltos) and 0 <= escenario_base < len(escenarios_resueltos)):
+        raise ValueError("La celda base debe referirse a un perfil y un escenario existentes")
+
+    registros_por_concepto = defaultdict(list)
+    for registro in MatrizInsumo.query.filter(MatrizInsumo.concepto_id.in_(ids_concepto)):
+        registros_por_concepto[registro.concepto_id].append(registro.to_dict())
+    conceptos_db = {c.id: c for c in Concepto.query.filter(Concepto.id.in_(ids_concepto))}
+    faltantes = [c for c in ids_concepto if c not in conceptos_db]
+    if faltantes:
+        raise ValueError(f"Conceptos no encontrados: {', '.join(map(str, faltantes))}")
+
+    claves = {(r["tipo_insumo"], int(r["id_insumo"])) for registros in registros_por_concepto.values() for r in registros if r.get("id_insumo")}
+    for escenario in escenarios_resueltos:
+        claves.update(escenario["sustituciones"].values())
+    caches = cargar_caches_insumos(claves)
+    costos: Dict = {}
+
+    resultado_conceptos = []
+    for concepto_id in ids_concepto:
+        subtotales = []
+        for escenario in escenarios_resueltos:
+            cd_base = costo_mano_obra = Decimal("0")
+            for registro in registros_por_concepto[concepto_id]:
+                clave = (registro["tipo_insumo"], int(registro["id_insumo"] or 0))
+                importe = decimal_field(registro["cantidad"]) * _costo_renglon(registro, clave, escenario, costos, caches)
+                cd_base += importe
+                if escenario["sustituciones"].get(clave, clave)[0] == "ManoObra":
+                    costo_mano_obra += importe
+            subtotales.append((cd_base, costo_mano_obra))
+
+        rejilla = [
+            [(cd_base + costo_mano_obra * perfil["factor_mano_obra"], perfil["multiplicador"]) for cd_base, costo_mano_obra in subtotales]
+            for perfil in perfiles_resueltos
+        ]
+        costo_base, multiplicador_base = rejilla[perfil_base][escenario_base]
+        pu_base = costo_base * multiplicador_base
+        celdas = []
+        for perfil in perfiles_resueltos:
+            for escenario in escenarios_resueltos:
+                costo_directo, multiplicador = rejilla[perfil["indice"]][escenario["indice"]]
+                precio_unitario = costo_directo * multiplicador
+                delta = precio_unitario - pu_base
+                celdas.append({
+                    "perfil": perfil["indice"], "escenario": escenario["indice"],
+                    "costo_directo": float(costo_directo), "precio_unitario": float(precio_unitario),
+                    "delta": float(delta), "delta_porcentaje": float(delta / pu_base * 100) if pu_base else None,
+                })
+        concepto = conceptos_db[concepto_id]
+        resultado_conceptos.append({
+            "concepto_id": concepto.id, "clave": concepto.clave, "descripcion": concepto.descripcion,
+            "unidad_concepto": concepto.unidad_concepto, "celdas": celdas,
+        })
+
+    return {
+        "perfiles": [{"indice": p["indice"], "nombre": p["nombre"], "proyecto_id": p["proyecto_id"]} for p in perfiles_resueltos],
+        "escenarios": [{"indice": e["indice"], "nombre": e["nombre"]} for e in escenarios_resueltos],
+        "base": {"perfil": perfil_base, "escenario": escenario_base},
+        "conceptos": resultado_conceptos,
+    }
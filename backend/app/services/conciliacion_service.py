@@ -0,0 +1,178 @@
+import re
+import threading
+import unicodedata
+from collections import Counter, defaultdict
+from typing import Dict, List, Optional, Set
+from flask import current_app
+from backend.app.services.catalogo_service import CATALOGOS, nombre_y_unidad, version_catalogo
+
+# Sinónimos frecuentes en las respuestas de la IA y en el catálogo -> unidad canónica
+UNIDADES = {
+    "m2": ("m2", "m²", "mt2", "mts2", "metro cuadrado", "metros cuadrados"),
+    "m3": ("m3", "m³", "mt3", "mts3", "metro cubico", "metros cubicos"),
+    "m": ("m", "ml", "mt", "mts", "metro", "metros", "metro lineal", "metros lineales"),
+    "kg": ("kg", "kgs", "kilo", "kilos", "kilogramo", "kilogramos"),
+    "ton": ("ton", "tons", "t", "tonelada", "toneladas"),
+    "lt": ("lt", "lts", "l", "litro", "litros"),
+    "pza": ("pza", "pzas", "pz", "pieza", "piezas"),
+    "saco": ("saco", "sacos", "bulto", "bultos"),
+    "jornada": ("jornada", "jornadas", "jor", "jornal", "dia", "dias"),
+    "hora": ("hora", "horas", "hr", "hrs", "h"),
+    "lote": ("lote", "lot", "global", "gbl"),
+}
+SINONIMOS_UNIDAD = {sinonimo: canonica for canonica, sinonimos in UNIDADES.items() for sinonimo in sinonimos}
+
+# Tipo normalizado (como normalizar_tipo_insumo del backend original) -> tipo_insumo del catálogo
+TIPOS = {"material": "Material", "materiales": "Material", "manodeobra": "ManoObra", "manoobra": "ManoObra", "equipo": "Equipo", "equipos": "Equipo", "maquinaria": "Maquinaria"}
+
+PALABRAS_VACIAS = {"de", "del", "la", "el", "los", "las", "para", "con", "en", "y", "a", "por", "tipo"}
+
+# Límites que acotan el trabajo por sugerencia sin importar el tamaño del catálogo
+MAXIMO_CANDIDATOS = 40
+MAXIMO_VISITAS = 4000
+
+
+def normalizar_texto(texto: Optional[str]) -> str:
+    """Minúsculas, sin acentos ni signos: "Cemento  Gris (50kg)" -> "cemento gris 50kg"."""
+    texto = unicodedata.normalize("NFKD", texto or "")
+    texto = "".join(c for c in texto if not unicodedata.combining(c)).lower()
+    return " ".join(re.sub(r"[^a-z0-9]+", " ", texto).split())
+
+
+def normalizar_unidad(unidad: Optional[str]) -> str:
+    texto = normalizar_texto((unidad or "").replace("²", "2").replace("³", "3")).rstrip(".")
+    return SINONIMOS_UNIDAD.get(texto, texto.replace(" ", ""))
+
+
+def normalizar_tipo(tipo: Optional[str]) -> Optional[str]:
+    return TIPOS.get(normalizar_texto(tipo).replace(" ", "")) if tipo else None
+
+
+def _tokens(texto: str) -> Set[str]:
+    return {t for t in texto.split() if t not in PALABRAS_VACIAS}
+
+
+def _trigramas(texto: str) -> Set[str]:
+    relleno = f"  {texto} "
+    return {relleno[i:i + 3] for i in range(len(relleno) - 2)}
+
+
+def _dice(a: Set[str], b: Set[str]) -> float:
+    return 2 * len(a & b) / (len(a) + len(b)) if a and b else 0.0
+
+
+class IndiceCatalogo:
+    """
+    Índice invertido de trigramas y tokens de los nombres del catálogo. Una búsqueda recorre
+    primero las llaves más raras y se detiene tras MAXIMO_VISITAS postings, así cuesta lo mismo
+    con 100 o 100 000 insumos.
+    """
+
+    def __init__(self, version: int):
+        self.version = version
+        self.entradas: List[Dict] = []
+        self.por_id: Dict[tuple, Dict] = {}
+        self._postings: Dict[str, Dict[str, List[int]]] = defaultdict(lambda: defaultdict(list))
+
+    def agregar(self, tipo: str, insumo_id: int, nombre: str, unidad: Optional[str]) -> None:
+        normalizado = normalizar_texto(nombre)
+        entrada = {
+            "tipo_insumo": tipo, "id_insumo": insumo_id, "nombre": nombre, "unidad": unidad,
+            "normalizado": normalizado, "unidad_normalizada": normalizar_unidad(unidad),
+            "tokens": _tokens(normalizado), "trigramas": _trigramas(normalizado),
+        }
+        posicion = len(self.entradas)
+        self.entradas.append(entrada)
+        self.por_id[(tipo, insumo_id)] = entrada
+        for llave in entrada["trigramas"] | {f"#{t}" for t in entrada["tokens"]}:
+            self._postings[tipo][llave].append(posicion)
+
+    def buscar(self, nombre: str, unidad: Optional[str], tipo: Optional[str], top_k: int) -> List[Dict]:
+        normalizado = normalizar_texto(nombre)
+        if not normalizado:
+            return []
+        tokens, trigramas = _tokens(normalizado), _trigramas(normalizado)
+        unidad_normalizada = normalizar_unidad(unidad) if unidad else ""
+        llaves = trigramas | {f"#{t}" for t in tokens}
+        listas = [
+            posiciones
+            for tipo_indice in ([tipo] if tipo else list(self._postings))
+            for llave in llaves
+            if (posiciones := self._postings.get(tipo_indice, {}).get(llave))
+        ]
+        votos: Counter = Counter()
+        restantes = MAXIMO_VISITAS
+        for posiciones in sorted(listas, key=len):
+            if restantes <= 0:
+                break
+            votos.update(posiciones[:restantes])
+            restantes -= len(posiciones)
+
+        candidatos = []
+        for posicion, _ in votos.most_common(MAXIMO_CANDIDATOS):
+            entrada = self.entradas[posicion]
+            if entrada["normalizado"] == normalizado:
+                puntaje = 1.0
+            else:
+                puntaje = 0.6 * _dice(trigramas, entrada["trigramas"]) + 0.4 * _dice(tokens, entrada["tokens"])
+            if unidad_normalizada and entrada["unidad_normalizada"]:
+                puntaje += 0.1 if unidad_normalizada == entrada["unidad_normalizada"] else -0.1
+            candidatos.append((min(1.0, max(0.0, puntaje)), entrada))
+        candidatos.sort(key=lambda par: (-par[0], par[1]["id_insumo"]))
+        return [_candidato(entrada, puntaje) for puntaje, entrada in candidatos[:top_k]]
+
+
+def _candidato(entrada: Dict, confianza: float) -> Dict:
+    return {
+        "tipo_insumo": entrada["tipo_insumo"], "id_insumo": entrada["id_insumo"], "nombre": entrada["nombre"],
+        "unidad": entrada["unidad"], "confianza": round(confianza, 4),
+    }
+
+
+_lock_indice = threading.Lock()
+
+
+def obtener_indice() -> IndiceCatalogo:
+    """Índice del catálogo vigente; se reconstruye solo cuando cambia la versión del catálogo."""
+    version = version_catalogo()
+    indice = current_app.extensions.get("indice_catalogo")
+    if indice is not None and indice.version == version:
+        return indice
+    with _lock_indice:
+        indice = current_app.extensions.get("indice_catalogo")
+        if indice is None or indice.version != version:
+            indice = IndiceCatalogo(version)
+            for _, tipo, modelo in CATALOGOS:
+                for registro in modelo.query.all():
+                    indice.agregar(tipo, registro.id, *nombre_y_unidad(tipo, registro))
+            current_app.extensions["indice_catalogo"] = indice
+    return indice
+
+
+def conciliar_sugerencias(sugerencias: List[Dict], top_k: int = 3, umbral: Optional[float] = None, indice: Optional[IndiceCatalogo] = None) -> List[Dict]:
+    """
+    Relaciona cada insumo sugerido por la IA con el catálogo. Una sugerencia con id existente
+    se confirma sin buscar; las demás se califican por nombre y unidad. `coincidencia` es el
+    mejor candidato si su confianza alcanza el umbral, o None si conviene dar de alta el insumo.
+    Quien concilia por partes (p. ej. un stream) puede pasar el `indice` para no releer la versión.
+    """
+    umbral = current_app.config["CONCILIACION_UMBRAL"] if umbral is None else umbral
+    indice = indice or obtener_indice()
+    resultados = []
+    for posicion, sugerencia in enumerate(sugerencias):
+        tipo = normalizar_tipo(sugerencia.get("tipo_insumo") or sugerencia.get("tipo"))
+        insumo_id = sugerencia.get("insumo_id") or sugerencia.get("id_insumo")
+        nombre = sugerencia.get("nombre") or sugerencia.get("nombre_sugerido") or ""
+        unidad = sugerencia.get("unidad") or sugerencia.get("unidad_sugerida") or sugerencia.get("unidad_medida")
+
+        existente = indice.por_id.get((tipo, int(insumo_id))) if tipo and str(insumo_id or "").isdigit() else None
+        if existente is not None:
+            candidatos = [_candidato(existente, 1.0)]
+        else:
+            candidatos = indice.buscar(nombre, unidad, tipo, top_k)
+        mejor = candidatos[0] if candidatos and candidatos[0]["confianza"] >= umbral else None
+        resultados.append({
+            "indice": posicion, "tipo_insumo": tipo, "nombre": nombre, "unidad": unidad,
+            "coincidencia": mejor, "candidatos": candidatos,
+        })
+    return resultados
@@ -0,0 +1,211 @@
+from collections import defaultdict
+from decimal import Decimal
+from typing import Dict, List, Optional
+from sqlalchemy import delete, func, insert, update
+from backend.app import db
+from backend.app.models import CatalogoCambio, ConceptoCambio, CuboCosto, CuboPartida, DetallePresupuesto, MatrizInsumo, Partida, Proyecto, VersionDatos
+from backend.app.services.calculation_service import obtener_costo_insumo
+from backend.app.services.catalogo_service import CATALOGOS, cargar_insumos, nombre_y_unidad, version_catalogo
+from backend.app.utils import decimal_field
+
+LOTE_IN = 900
+
+# Dimensión -> columnas del cubo por las que se agrupa; "insumo" es el nivel más fino del drill-down
+DIMENSIONES = {
+    "partida": (CuboCosto.partida_id,),
+    "tipo_insumo": (CuboCosto.tipo_insumo,),
+    "disciplina": (CuboCosto.disciplina,),
+    "calidad": (CuboCosto.calidad,),
+    "insumo": (CuboCosto.tipo_insumo, CuboCosto.id_insumo, CuboCosto.nombre, CuboCosto.unidad),
+}
+FILTROS = {
+    "partida_id": (CuboCosto.partida_id, int),
+    "tipo_insumo": (CuboCosto.tipo_insumo, str),
+    "disciplina": (CuboCosto.disciplina, str),
+    "calidad": (CuboCosto.calidad, str),
+    "id_insumo": (CuboCosto.id_insumo, int),
+}
+
+
+def _en_lotes(ids: List, tamano: int = LOTE_IN):
+    for inicio in range(0, len(ids), tamano):
+        yield ids[inicio:inicio + tamano]
+
+
+def _calcular_filas(proyecto_id: int, partida_ids: List[int]) -> List[Dict]:
+    """Filas del cubo de las partidas dadas: cantidad e importe de cada insumo, sumados sobre sus detalles."""
+    detalles = []
+    for lote in _en_lotes(partida_ids):
+        detalles.extend(
+            db.session.query(DetallePresupuesto.partida_id, DetallePresupuesto.concepto_id, DetallePresupuesto.cantidad_obra)
+            .filter(DetallePresupuesto.partida_id.in_(lote))
+            .all()
+        )
+    registros_por_concepto = defaultdict(list)
+    for lote in _en_lotes(sorted({concepto_id for _, concepto_id, _ in detalles})):
+        for registro in MatrizInsumo.query.filter(MatrizInsumo.concepto_id.in_(lote)):
+            registros_por_concepto[registro.concepto_id].append(registro.to_dict())
+
+    # Los modelos del catálogo sirven de cache para obtener_costo_insumo y dan nombre, unidad, disciplina y calidad
+    insumos_por_tipo = cargar_insumos(
+        (r["tipo_insumo"], r["id_insumo"]) for registros in registros_por_concepto.values() for r in registros if r.get("id_insumo")
+    )
+    caches = tuple(insumos_por_tipo[tipo] for _, tipo, _ in CATALOGOS)
+
+    costos: Dict = {}
+    acumulado: Dict[tuple, List[Decimal]] = defaultdict(lambda: [Decimal("0"), Decimal("0")])
+    for partida_id, concepto_id, cantidad_obra in detalles:
+        for registro in registros_por_concepto[concepto_id]:
+            if not registro.get("id_insumo"):
+                continue
+            llave = (registro["tipo_insumo"], registro["id_insumo"], registro.get("porcentaje_merma"), registro.get("precio_flete_unitario"))
+            if llave not in costos:
+                costos[llave] = obtener_costo_insumo(registro, caches)
+            cantidad = decimal_field(cantidad_obra) * decimal_field(registro["cantidad"])
+            fila = acumulado[(partida_id, registro["tipo_insumo"], registro["id_insumo"])]
+            fila[0] += cantidad
+            fila[1] += cantidad * costos[llave]
+
+    filas = []
+    for (partida_id, tipo, insumo_id), (cantidad, importe) in acumulado.items():
+        insumo = insumos_por_tipo.get(tipo, {}).get(insumo_id)
+        nombre, unidad = nombre_y_unidad(tipo, insumo) if insumo is not None else (None, None)
+        filas.append({
+            "proyecto_id": proyecto_id, "partida_id": partida_id, "tipo_insumo": tipo, "id_insumo": insumo_id,
+            "nombre": nombre, "unidad": unidad, "disciplina": getattr(insumo, "disciplina", None),
+            "calidad": getattr(insumo, "calidad", None), "cantidad": cantidad, "importe": importe,
+        })
+    return filas
+
+
+def _partidas_afectadas(proyecto_id: int, estados: List[CuboPartida], version_conceptos: int, version_cat: int) -> set:
+    """
+    De las partidas con versiones viejas, las que usan un concepto cuya matriz cambió o un insumo
+    cuyo precio cambió desde que se calcularon. Las demás solo necesitan anotar las versiones nuevas.
+    """
+    afectadas = set()
+    por_conceptos = {e.partida_id: e.version_conceptos for e in estados if e.version_conceptos != version_conceptos}
+    if por_conceptos:
+        desde = min(por_conceptos.values())
+        conceptos = sorted({concepto_id for (concepto_id,) in db.session.query(ConceptoCambio.concepto_id).filter(ConceptoCambio.id > desde)})
+        for lote in _en_lotes(conceptos):
+            afectadas.update(
+                partida_id
+                for (partida_id,) in db.session.query(DetallePresupuesto.partida_id)
+                .join(Partida, DetallePresupuesto.partida_id == Partida.id)
+                .filter(Partida.proyecto_id == proyecto_id, DetallePresupuesto.concepto_id.in_(lote))
+                .distinct()
+                if partida_id in por_conceptos
+            )
+    por_catalogo = {e.partida_id: e.version_catalogo for e in estados if e.version_catalogo != version_cat}
+    if por_catalogo:
+        desde = min(por_catalogo.values())
+        cambiados = set(db.session.query(CatalogoCambio.tipo_insumo, CatalogoCambio.insumo_id).filter(CatalogoCambio.id > desde))
+        afectadas.update(
+            partida_id
+            for partida_id, tipo, insumo_id in db.session.query(CuboCosto.partida_id, CuboCosto.tipo_insumo, CuboCosto.id_insumo)
+            .filter(CuboCosto.proyecto_id == proyecto_id)
+            if partida_id in por_catalogo and (tipo, insumo_id) in cambiados
+        )
+    return afectadas
+
+
+def actualizar_cubo(proyecto_id: int) -> Dict:
+    """
+    Pone al día el cubo de un proyecto recalculando solo las partidas obsoletas: las nuevas, las
+    que cambiaron de detalles (versión partida:<id>), las que usan un concepto cuya matriz cambió
+    (bitácora de conceptos) y las que usan un insumo cuyo precio cambió desde que se calcularon.
+    """
+    # Las versiones se leen antes que los datos (como en los ETag): una escritura concurrente
+    # deja la partida marcada como obsoleta, nunca datos viejos con una versión nueva.
+    partidas = [partida_id for (partida_id,) in db.session.query(Partida.id).filter(Partida.proyecto_id == proyecto_id)]
+    versiones: Dict[str, int] = {}
+    for lote in _en_lotes([f"partida:{p}" for p in partidas]):
+        versiones.update(db.session.query(VersionDatos.clave, VersionDatos.version).filter(VersionDatos.clave.in_(lote)))
+    version_conceptos = db.session.query(func.max(ConceptoCambio.id)).scalar() or 0
+    version_cat = version_catalogo()
+    estados = {e.partida_id: e for e in CuboPartida.query.filter_by(proyecto_id=proyecto_id)}
+
+    eliminadas = sorted(set(estados) - set(partidas))
+    pendientes, por_revisar = [], []
+    for partida_id in partidas:
+        estado = estados.get(partida_id)
+        if estado is None or estado.version_partida != versiones.get(f"partida:{partida_id}", 0):
+            pendientes.append(partida_id)
+        elif estado.version_conceptos != version_conceptos or estado.version_catalogo != version_cat:
+            por_revisar.append(partida_id)
+
+    if por_revisar:
+        afectadas = _partidas_afectadas(proyecto_id, [estados[p] for p in por_revisar], version_conceptos, version_cat)
+        pendientes.extend(p for p in por_revisar if p in afectadas)
+        por_revisar = [p for p in por_revisar if p not in afectadas]
+
+    for lote in _en_lotes(pendientes + eliminadas):
+        db.session.execute(delete(CuboCosto).where(CuboCosto.partida_id.in_(lote)))
+        db.session.execute(delete(CuboPartida).where(CuboPartida.partida_id.in_(lote)))
+    if pendientes:
+        filas = _calcular_filas(proyecto_id, pendientes)
+        if filas:
+            db.session.execute(insert(CuboCosto), filas)
+        db.session.execute(insert(CuboPartida), [
+            {"partida_id": p, "proyecto_id": proyecto_id, "version_partida": versiones.get(f"partida:{p}", 0),
+             "version_conceptos": version_conceptos, "version_catalogo": version_cat}
+            for p in pendientes
+        ])
+    for lote in _en_lotes(por_revisar):
+        db.session.execute(
+            update(CuboPartida).where(CuboPartida.partida_id.in_(lote)).values(version_conceptos=version_conceptos, version_catalogo=version_cat)
+        )
+    db.session.commit()
+    return {"recalculadas": len(pendientes), "vigentes": len(partidas) - len(pendientes), "eliminadas": len(eliminadas)}
+
+
+def consultar_cubo(proyecto_id: int, agrupar: Optional[List[str]] = None, filtros: Optional[Dict] = None, limite: Optional[int] = None) -> Dict:
+    """
+    Roll-up o drill-down del costo directo de un proyecto: agrupa por cualquier combinación de
+    DIMENSIONES y filtra por FILTROS. Con "insumo" en `agrupar` baja hasta cada insumo del catálogo.
+    """
+    if limite is not None and limite <= 0:
+        raise ValueError("limite debe ser un entero positivo")
+    proyecto = Proyecto.query.get_or_404(proyecto_id)
+    agrupar = list(dict.fromkeys(agrupar or ["tipo_insumo"]))
+    desconocidas = [d for d in agrupar if d not in DIMENSIONES]
+    if desconocidas:
+        raise ValueError(f"Dimensiones no soportadas: {', '.join(desconocidas)}. Use: {', '.join(DIMENSIONES)}")
+    filtros = {clave: valor for clave, valor in (filtros or {}).items() if valor not in (None, "")}
+    desconocidos = [f for f in filtros if f not in FILTROS]
+    if desconocidos:
+        raise ValueError(f"Filtros no soportados: {', '.join(desconocidos)}. Use: {', '.join(FILTROS)}")
+
+    actualizar_cubo(proyecto.id)
+
+    columnas = list(dict.fromkeys(columna for dimension in agrupar for columna in DIMENSIONES[dimension]))
+    importe = func.sum(CuboCosto.importe)
+    consulta = db.session.query(*columnas, importe, func.sum(CuboCosto.cantidad)).filter(CuboCosto.proyecto_id == proyecto.id)
+    for clave, valor in filtros.items():
+        columna, tipo = FILTROS[clave]
+        try:
+            consulta = consulta.filter(columna == tipo(valor))
+        except ValueError:
+            raise ValueError(f"Valor inválido para el filtro {clave}: {valor}")
+    consulta = consulta.group_by(*columnas).order_by(importe.desc())
+    filas = consulta.all()
+
+    total = sum(decimal_field(fila[-2]) for fila in filas)
+    nombres_partida = {}
+    if "partida" in agrupar:
+        nombres_partida = dict(db.session.query(Partida.id, Partida.nombre_partida).filter(Partida.proyecto_id == proyecto.id))
+    celdas = []
+    for fila in filas[:limite]:
+        celda = {columna.key: valor for columna, valor in zip(columnas, fila)}
+        if "partida" in agrupar:
+            celda["partida"] = nombres_partida.get(celda["partida_id"])
+        celda["importe"] = float(fila[-2] or 0)
+        celda["porcentaje"] = float(decimal_field(fila[-2]) / total * 100) if total else None
+        if "insumo" in agrupar:
+            celda["cantidad"] = float(fila[-1] or 0)
+        celdas.append(celda)
+    return {
+        "proyecto_id": proyecto.id, "agrupar": agrupar, "filtros": filtros, "total": float(total),
+        "celdas_totales": len(filas), "celdas": celdas,
+    }
@@ -2,6 +2,7 @@ from collections import defaultdict
 from decimal import Decimal
 from backend.app.models import Proyecto, DetallePresupuesto, MatrizInsumo
 from backend.app.services.calculation_service import obtener_costo_insumo
+from backend.app.services.tabla_costos_service import caches_insumos
 
 def get_dashboard_data(proyecto_id: int) -> dict:
     """
@@ -13,8 +14,8 @@ def get_dashboard_data(proyecto_id: int) -> dict:
     costos_por_tipo = defaultdict(Decimal)
     costos_por_concepto = []
 
-    # Usar caches para eficiencia, similar al cálculo de PU
-    caches = ({}, {}, {}, {})
+    # Costos desde la tabla compartida entre workers (o caches vacíos si está desactivada)
+    caches = caches_insumos()
 
     for detalle in detalles:
         costo_total_concepto = Decimal("0.0")
@@ -1,13 +1,35 @@
 import json
 import re
+import threading
 from typing import Dict, List, Optional
-import google.generativeai as genai
 from flask import current_app
-from backend.config import Config
 from backend.app.models import Material, ManoObra, Equipo, Maquinaria
 
+# google.generativeai tarda ~1 s en importarse; se carga en la primera llamada a Gemini
+_genai = None
+_genai_lock = threading.Lock()
+
+
+def obtener_genai():
+    """Importa google.generativeai una sola vez por proceso y lo configura con GEMINI_API_KEY de la app actual."""
+    global _genai
+    if _genai is None:
+        with _genai_lock:
+            if _genai is None:
+                import google.generativeai as genai
+                api_key = current_app.config.get("GEMINI_API_KEY")
+                if api_key:
+                    genai.configure(api_key=api_key)
+                _genai = genai
+    return _genai
+
+
+def precargar() -> None:
+    obtener_genai()
+
 # (Contenido completo de ia_service.py)
 def generar_apu_con_gemini(descripcion: str, unidad: str) -> Optional[Dict]:
+    genai = obtener_genai()
     # ... lógica completa ...
     return None
 
@@ -0,0 +1,243 @@
+import json
+import logging
+from typing import Dict, Iterable, Iterator, List, Optional
+from flask import current_app
+from werkzeug.exceptions import NotFound
+from backend.app.services.calculation_service import obtener_costo_insumo
+from backend.app.services.conciliacion_service import IndiceCatalogo, conciliar_sugerencias, obtener_indice
+from backend.app.services.ia_service import construir_sugerencia_apu, obtener_genai
+from backend.app.services.tabla_costos_service import caches_insumos
+
+logger = logging.getLogger(__name__)
+
+PROMPT_SISTEMA_APU = """
+Actúa como un experto analista de costos de construcción en México.
+Genera una matriz de Precios Unitarios (APU) detallada.
+
+REGLAS OBLIGATORIAS DE RESPUESTA (JSON):
+1. "cantidad_obra_detectada": Si la descripción incluye dimensiones (ej. "Muro 10x3", "Losa de 50m2", "9x3 metros"),
+   calcula el total matemático. Si no hay dimensiones, devuelve null.
+2. "unidad_obra_detectada": La unidad resultante (m2, m3, ml, pza).
+3. "tipo_documento": Clasifica si es "Presupuesto" (formal), "Nota de Venta" (simple) o "Factura".
+4. "explicacion": Breve explicación del análisis (1-2 oraciones).
+5. "insumos": Lista de materiales/mano de obra/equipo/maquinaria.
+   - "tipo_insumo": SOLO usa: "Material", "Mano de Obra", "Equipo", "Maquinaria".
+   - "nombre": Nombre descriptivo del insumo.
+   - "unidad": SOLO usa: "pza", "m2", "m3", "ml", "kg", "ton", "litro", "galon", "bulto", "caja", "lote", "jor", "hr", "dia", "sem", "mes".
+   - "cantidad": Coeficiente técnico para 1 unidad de obra (no el total).
+   - "merma": Decimal (ej. 0.05 para 5%). Si no aplica, usa 0.
+   - "rendimiento_diario": Solo para Mano de Obra. Metros/jornada o piezas/jornada.
+   - "flete_unitario": Costo adicional de flete si aplica. Si no, usa 0.
+   - "precio_unitario": Precio estimado en MXN. Si no conoces el precio, usa 0.
+   - "justificacion_breve": Breve justificación de por qué se incluye este insumo.
+
+IMPORTANTE:
+- Para el cálculo de cantidad_obra_detectada, busca patrones como "NxM metros", "N metros x M metros", "N m2", etc.
+- Calcula matemáticamente: si dice "10x30 metros" o "10 por 30", el resultado es 300 m2.
+- Si dice "Losa de 50m2", el resultado es 50 m2.
+- Escribe "explicacion" antes de "insumos" para que el análisis llegue primero.
+
+Tu respuesta debe ser EXCLUSIVAMENTE un objeto JSON válido."""
+
+CONFIG_GENERACION = {
+    "temperature": 0.7,
+    "top_p": 0.95,
+    "top_k": 64,
+    "max_output_tokens": 8192,
+    "response_mime_type": "application/json",
+}
+
+
+class ParserInsumosIncremental:
+    """
+    Lee el JSON de la IA conforme llega y devuelve cada objeto del arreglo "insumos" en cuanto
+    se cierra, sin esperar al documento completo. Solo sigue comillas, escapes y profundidad,
+    así cada fragmento se procesa una vez; el texto acumulado queda en `texto` para el parseo final.
+    """
+
+    def __init__(self):
+        self.texto = ""
+        self._posicion = 0
+        self._profundidad = 0
+        self._en_cadena = False
+        self._escape = False
+        self._inicio_cadena = 0
+        self._ultima_cadena_raiz: Optional[str] = None
+        self._profundidad_insumos: Optional[int] = None
+        self._inicio_objeto: Optional[int] = None
+
+    def alimentar(self, fragmento: str) -> List[Dict]:
+        self.texto += fragmento
+        completos = []
+        texto = self.texto
+        for i in range(self._posicion, len(texto)):
+            c = texto[i]
+            if self._en_cadena:
+                if self._escape:
+                    self._escape = False
+                elif c == "\\":
+                    self._escape = True
+                elif c == '"':
+                    self._en_cadena = False
+                    if self._profundidad == 1:
+                        self._ultima_cadena_raiz = texto[self._inicio_cadena + 1:i]
+                continue
+            if c == '"':
+                self._en_cadena = True
+                self._inicio_cadena = i
+            elif c in "{[":
+                self._profundidad += 1
+                if c == "[" and self._profundidad == 2 and self._ultima_cadena_raiz == "insumos":
+                    self._profundidad_insumos = 2
+                elif c == "{" and self._profundidad_insumos is not None and self._profundidad == self._profundidad_insumos + 1:
+                    self._inicio_objeto = i
+            elif c in "}]":
+                if c == "}" and self._inicio_objeto is not None and self._profundidad == self._profundidad_insumos + 1:
+                    try:
+                        completos.append(json.loads(texto[self._inicio_objeto:i + 1]))
+                    except json.JSONDecodeError:
+                        logger.warning("Insumo con JSON inválido en la respuesta de la IA: %s", texto[self._inicio_objeto:i + 1])
+                    self._inicio_objeto = None
+                elif c == "]" and self._profundidad == self._profundidad_insumos:
+                    self._profundidad_insumos = None
+                self._profundidad -= 1
+        self._posicion = len(texto)
+        return completos
+
+    def documento(self) -> Dict:
+        """El JSON completo (sin cercas ```json) una vez terminado el stream; {} si no es válido."""
+        inicio, fin = self.texto.find("{"), self.texto.rfind("}")
+        try:
+            return json.loads(self.texto[inicio:fin + 1]) if inicio >= 0 else {}
+        except json.JSONDecodeError:
+            return {}
+
+
+class _Fragmento:
+    def __init__(self, text: str):
+        self.text = text
+
+
+class ModeloFalsoStreaming:
+    """
+    Sustituto de genai.GenerativeModel para pruebas y desarrollo sin red: generate_content(stream=True)
+    entrega `respuesta` (o un APU de muro de ejemplo) partida en fragmentos de `tamano_fragmento` caracteres.
+    """
+
+    def __init__(self, respuesta: Optional[Dict] = None, tamano_fragmento: int = 24):
+        self.respuesta = respuesta if respuesta is not None else APU_EJEMPLO
+        self.tamano_fragmento = tamano_fragmento
+
+    def generate_content(self, prompt: str, stream: bool = False):
+        texto = json.dumps(self.respuesta, ensure_ascii=False, indent=1)
+        if not stream:
+            return _Fragmento(texto)
+        return (_Fragmento(texto[i:i + self.tamano_fragmento]) for i in range(0, len(texto), self.tamano_fragmento))
+
+
+APU_EJEMPLO = {
+    "cantidad_obra_detectada": None,
+    "unidad_obra_detectada": "m2",
+    "tipo_documento": "Presupuesto",
+    "explicacion": "Muro de block hueco de 15 cm asentado con mortero cemento-arena 1:4.",
+    "insumos": [
+        {"tipo_insumo": "Material", "nombre": "Block hueco 15x20x40", "unidad": "pza", "cantidad": 12.5, "merma": 0.03, "flete_unitario": 0, "precio_unitario": 14.5, "justificacion_breve": "Piezas por m2 de muro."},
+        {"tipo_insumo": "Material", "nombre": "Cemento", "unidad": "bulto", "cantidad": 0.2, "merma": 0.05, "flete_unitario": 0, "precio_unitario": 210, "justificacion_breve": "Mortero de junteo."},
+        {"tipo_insumo": "Material", "nombre": "Arena", "unidad": "m3", "cantidad": 0.03, "merma": 0.1, "flete_unitario": 0, "precio_unitario": 450, "justificacion_breve": "Mortero de junteo."},
+        {"tipo_insumo": "Mano de Obra", "nombre": "Oficial albañil", "unidad": "jor", "cantidad": 0.1, "rendimiento_diario": 10, "precio_unitario": 0, "justificacion_breve": "Cuadrilla oficial + ayudante."},
+        {"tipo_insumo": "Mano de Obra", "nombre": "Ayudante general", "unidad": "jor", "cantidad": 0.1, "rendimiento_diario": 10, "precio_unitario": 0, "justificacion_breve": "Cuadrilla oficial + ayudante."},
+    ],
+}
+
+
+def obtener_modelo_streaming():
+    """Modelo de Gemini configurado para APU, o el modelo falso con IA_MODELO_STREAMING=falso."""
+    if current_app.config.get("IA_MODELO_STREAMING") == "falso":
+        return ModeloFalsoStreaming()
+    if not current_app.config.get("GEMINI_API_KEY"):
+        raise ValueError("No se ha configurado GEMINI_API_KEY en el servidor")
+    genai = obtener_genai()
+    return genai.GenerativeModel(model_name=current_app.config["GEMINI_MODEL"], generation_config=CONFIG_GENERACION)
+
+
+def _evento(nombre: str, datos: Dict) -> str:
+    return f"event: {nombre}\ndata: {json.dumps(datos, ensure_ascii=False)}\n\n"
+
+
+def _conciliar(insumo: Dict, indice: IndiceCatalogo, caches) -> Dict:
+    """Une la sugerencia con su mejor coincidencia del catálogo y, si existe, su costo vigente."""
+    resultado = conciliar_sugerencias([insumo], indice=indice)[0]
+    coincidencia = resultado["coincidencia"]
+    conciliado = dict(insumo, candidatos=resultado["candidatos"])
+    if coincidencia is not None:
+        registro = {"tipo_insumo": coincidencia["tipo_insumo"], "id_insumo": coincidencia["id_insumo"]}
+        try:
+            costo_unitario = obtener_costo_insumo(registro, caches)
+        except (NotFound, ValueError) as e:
+            # El insumo se borró después de armar el índice: se reporta como no encontrado y el stream sigue
+            logger.warning("Sin costo para %s %s en chat_apu (stream): %s", registro["tipo_insumo"], registro["id_insumo"], e)
+        else:
+            conciliado.update(
+                tipo_insumo=coincidencia["tipo_insumo"], insumo_id=coincidencia["id_insumo"], id_insumo=coincidencia["id_insumo"],
+                existe_en_catalogo=True, confianza=coincidencia["confianza"], costo_unitario=float(costo_unitario),
+            )
+            return conciliado
+    conciliado.update(insumo_id=None, id_insumo="", existe_en_catalogo=False)
+    return conciliado
+
+
+def stream_chat_apu(descripcion: str, unidad: str, concepto_id: Optional[int] = None, modelo=None) -> Iterator[str]:
+    """
+    Eventos SSE del APU sugerido: un `insumo` por cada insumo en cuanto la IA lo termina de escribir
+    (ya conciliado con el catálogo), y `fin` con la explicación y los datos detectados. Si la IA
+    falla antes de sugerir insumos se usa la heurística local, como en /ia/chat_apu.
+    """
+    # Índice y caches se toman una vez por stream, no por insumo
+    indice = obtener_indice()
+    caches = caches_insumos()
+    parser = ParserInsumosIncremental()
+    enviados = 0
+    error = None
+
+    def emitir(insumos: Iterable[Dict]) -> Iterator[str]:
+        nonlocal enviados
+        for insumo in insumos:
+            yield _evento("insumo", {"indice": enviados, "insumo": _conciliar(insumo, indice, caches)})
+            enviados += 1
+
+    # Solo la llamada a Gemini y la lectura de sus fragmentos cuentan como error de la IA; un fallo
+    # al conciliar o consultar la base sale como tal en lugar de reportarse como error de la IA
+    try:
+        modelo = modelo or obtener_modelo_streaming()
+        prompt = f"{PROMPT_SISTEMA_APU}\n\nCONCEPTO A ANALIZAR: {descripcion}\nUNIDAD SUGERIDA: {unidad}\n\nDevuelve el JSON con la estructura solicitada."
+        fragmentos = iter(modelo.generate_content(prompt, stream=True))
+    except Exception as e:
+        logger.error("Error en IA chat_apu (stream): %s", e)
+        error = str(e)
+        fragmentos = iter(())
+    while True:
+        try:
+            fragmento = next(fragmentos, None)
+            texto = (fragmento.text or "") if fragmento is not None else None
+        except Exception as e:
+            logger.error("Error en IA chat_apu (stream): %s", e)
+            error = str(e)
+            break
+        if texto is None:
+            break
+        yield from emitir(parser.alimentar(texto))
+
+    documento = parser.documento()
+    explicacion = documento.get("explicacion") or ""
+    if enviados == 0:
+        yield from emitir(construir_sugerencia_apu(descripcion, concepto_id))
+        if error:
+            explicacion = explicacion or f"Hubo un error al conectar con la IA: {error}"
+    yield _evento("fin", {
+        "explicacion": explicacion,
+        "cantidad_obra_detectada": documento.get("cantidad_obra_detectada"),
+        "unidad_obra_detectada": documento.get("unidad_obra_detectada"),
+        "tipo_documento": documento.get("tipo_documento"),
+        "total_insumos": enviados,
+        "error": error,
+    })
@@ -0,0 +1,270 @@
+import logging
+import os
+import socket
+import threading
+import traceback
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List, Optional
+from flask import current_app
+from sqlalchemy import select, update
+from sqlalchemy.orm import aliased
+from backend.app import db
+from backend.app.models import Job
+
+logger = logging.getLogger(__name__)
+
+ESTADOS_FINALES = ("completado", "fallido", "cancelado")
+
+# tipo de job -> función(payload, contexto) que devuelve un resultado serializable a JSON
+TAREAS: Dict[str, Callable[[Dict, "ContextoJob"], Any]] = {}
+
+
+def tarea(tipo: str):
+    """Registra una función como manejador de los jobs de `tipo`."""
+    def registrar(funcion):
+        TAREAS[tipo] = funcion
+        return funcion
+    return registrar
+
+
+class JobCancelado(Exception):
+    pass
+
+
+class ContextoJob:
+    """Se entrega a cada tarea para reportar avance y detectar cancelaciones."""
+
+    def __init__(self, job_id: int):
+        self.job_id = job_id
+
+    def progreso(self, fraccion: float, mensaje: Optional[str] = None) -> None:
+        """Guarda el avance (0-1) y confirma el trabajo hecho; lanza JobCancelado si se pidió cancelar."""
+        db.session.execute(
+            update(Job)
+            .where(Job.id == self.job_id)
+            .values(progreso=max(0.0, min(1.0, float(fraccion))), mensaje=mensaje, actualizado=datetime.utcnow())
+        )
+        db.session.commit()
+        if db.session.execute(select(Job.cancelacion_solicitada).where(Job.id == self.job_id)).scalar():
+            raise JobCancelado()
+
+
+def _cargar_tareas() -> None:
+    # Las tareas viven en su propio módulo para no cargar cálculos ni PDF al importar la cola
+    from backend.app.services import tareas  # noqa: F401
+
+
+def encolar(tipo: str, payload: Optional[Dict] = None, max_intentos: Optional[int] = None) -> Job:
+    _cargar_tareas()
+    if tipo not in TAREAS:
+        raise ValueError(f"Tipo de job desconocido: {tipo}")
+    try:
+        max_intentos = 3 if max_intentos is None else int(max_intentos)
+    except (TypeError, ValueError):
+        max_intentos = 0
+    if max_intentos < 1:
+        raise ValueError("max_intentos debe ser un entero positivo")
+    job = Job(tipo=tipo, payload=payload or {}, max_intentos=max_intentos)
+    db.session.add(job)
+    db.session.commit()
+    return job
+
+
+def cancelar(job: Job) -> Job:
+    """
+    Un job pendiente se cancela de inmediato; uno en proceso se detiene en su siguiente reporte de avance.
+    Ambos cambios son UPDATE condicionales sobre el estado vigente en la base, no sobre el leído, así un
+    worker que lo reclame al mismo tiempo no queda ejecutando un job marcado como cancelado.
+    """
+    ahora = datetime.utcnow()
+    resultado = db.session.execute(
+        update(Job).where(Job.id == job.id, Job.estado == "pendiente").values(estado="cancelado", terminado=ahora, actualizado=ahora)
+    )
+    if resultado.rowcount == 0:
+        db.session.execute(update(Job).where(Job.id == job.id, Job.estado == "en_proceso").values(cancelacion_solicitada=True))
+    db.session.commit()
+    db.session.refresh(job)
+    return job
+
+
+def liberar_jobs_abandonados(lease_segundos: int) -> int:
+    """
+    Regresa a la cola los jobs en proceso cuyo lease venció (p. ej. el proceso murió). Mientras el
+    worker vive, _Latido renueva el lease aunque la tarea no reporte avance.
+    """
+    limite = datetime.utcnow() - timedelta(seconds=lease_segundos)
+    resultado = db.session.execute(
+        update(Job)
+        .where(Job.estado == "en_proceso", Job.actualizado < limite)
+        .values(estado="pendiente", worker=None)
+    )
+    db.session.commit()
+    return resultado.rowcount
+
+
+def reclamar_siguiente(worker_id: str) -> Optional[Job]:
+    """Toma el siguiente job listo con un UPDATE condicional, así dos workers nunca ejecutan el mismo."""
+    ahora = datetime.utcnow()
+    cola = aliased(Job)
+    candidato = (
+        select(cola.id)
+        .where(cola.estado == "pendiente", cola.ejecutar_despues <= ahora)
+        .order_by(cola.ejecutar_despues, cola.id)
+        .limit(1)
+        .scalar_subquery()
+    )
+    resultado = db.session.execute(
+        update(Job)
+        .where(Job.id == candidato, Job.estado == "pendiente")
+        .values(estado="en_proceso", worker=worker_id, iniciado=ahora, actualizado=ahora, intentos=Job.intentos + 1)
+        .returning(Job.id)
+    )
+    job_id = resultado.scalar()
+    db.session.commit()
+    return db.session.get(Job, job_id) if job_id else None
+
+
+def renovar_lease(job_id: int, worker_id: Optional[str]) -> bool:
+    """Marca el job como vivo si sigue en proceso a nombre de `worker_id`; False si ya lo liberaron o terminó."""
+    resultado = db.session.execute(
+        update(Job)
+        .where(Job.id == job_id, Job.estado == "en_proceso", Job.worker == worker_id)
+        .values(actualizado=datetime.utcnow())
+    )
+    db.session.commit()
+    return resultado.rowcount > 0
+
+
+class _Latido:
+    """Hilo que renueva el lease del job cada tercio de JOB_LEASE_SEGUNDOS mientras la tarea corre."""
+
+    def __init__(self, app, job_id: int, worker_id: Optional[str], intervalo: float):
+        self.app = app
+        self.job_id = job_id
+        self.worker_id = worker_id
+        self.intervalo = intervalo
+        self._detener = threading.Event()
+        self._hilo = threading.Thread(target=self._ciclo, name=f"job-latido-{job_id}", daemon=True)
+
+    def __enter__(self) -> "_Latido":
+        self._hilo.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self._detener.set()
+        self._hilo.join()
+
+    def _ciclo(self) -> None:
+        while not self._detener.wait(self.intervalo):
+            try:
+                with self.app.app_context():
+                    if not renovar_lease(self.job_id, self.worker_id):
+                        return
+            except Exception:
+                logger.exception("No se pudo renovar el lease del job %s", self.job_id)
+
+
+def _backoff(intentos: int, base_segundos: int, maximo_segundos: int) -> timedelta:
+    return timedelta(seconds=min(maximo_segundos, base_segundos * 2 ** max(0, intentos - 1)))
+
+
+def ejecutar_job(job: Job, backoff_base: int = 5, backoff_maximo: int = 600) -> Job:
+    _cargar_tareas()
+    job_id, worker_id = job.id, job.worker
+    latido = _Latido(current_app._get_current_object(), job_id, worker_id, current_app.config["JOB_LEASE_SEGUNDOS"] / 3)
+    valores: Dict[str, Any]
+    try:
+        with latido:
+            resultado = TAREAS[job.tipo](job.payload or {}, ContextoJob(job_id))
+    except JobCancelado:
+        db.session.rollback()
+        valores = {"estado": "cancelado"}
+    except Exception as e:
+        db.session.rollback()
+        job = db.session.get(Job, job_id)
+        valores = {"error": f"{e}\n{traceback.format_exc(limit=5)}"}
+        if job.intentos < job.max_intentos and not job.cancelacion_solicitada:
+            valores.update(estado="pendiente", worker=None, ejecutar_despues=datetime.utcnow() + _backoff(job.intentos, backoff_base, backoff_maximo))
+            logger.warning("Job %s (%s) falló en el intento %s, se reintentará: %s", job_id, job.tipo, job.intentos, e)
+        else:
+            valores["estado"] = "cancelado" if job.cancelacion_solicitada else "fallido"
+            logger.error("Job %s (%s) falló definitivamente: %s", job_id, job.tipo, e)
+    else:
+        valores = {"estado": "completado", "resultado": resultado, "progreso": 1.0, "error": None}
+    ahora = datetime.utcnow()
+    valores["actualizado"] = ahora
+    if valores["estado"] in ESTADOS_FINALES:
+        valores["terminado"] = ahora
+    # Solo se escribe si el job sigue en proceso a nombre de este worker: si mientras tanto se liberó
+    # por lease vencido y se canceló o lo tomó otro worker, ese estado es el que vale
+    escrito = db.session.execute(
+        update(Job).where(Job.id == job_id, Job.worker == worker_id, Job.estado == "en_proceso").values(**valores)
+    ).rowcount
+    db.session.commit()
+    if not escrito:
+        logger.warning("Job %s ya no está en proceso a nombre de %s; se descarta su resultado (%s)", job_id, worker_id, valores["estado"])
+    job = db.session.get(Job, job_id)
+    db.session.refresh(job)
+    return job
+
+
+def ejecutar_siguiente_job(worker_id: str, backoff_base: int = 5, backoff_maximo: int = 600) -> Optional[Job]:
+    """Reclama y ejecuta un job; devuelve None si la cola está vacía."""
+    job = reclamar_siguiente(worker_id)
+    if job is None:
+        return None
+    return ejecutar_job(job, backoff_base, backoff_maximo)
+
+
+class PoolWorkers:
+    """Hilos que consumen la cola de jobs dentro del proceso, cada uno con su propio app context."""
+
+    def __init__(self, app, cantidad: int):
+        self.app = app
+        self.cantidad = cantidad
+        self.hilos: List[threading.Thread] = []
+        self._detener = threading.Event()
+        self._prefijo = f"{socket.gethostname()}:{os.getpid()}"
+
+    def iniciar(self) -> "PoolWorkers":
+        for numero in range(self.cantidad):
+            hilo = threading.Thread(target=self._ciclo, args=(f"{self._prefijo}:{numero}",), name=f"job-worker-{numero}", daemon=True)
+            hilo.start()
+            self.hilos.append(hilo)
+        return self
+
+    def detener(self, timeout: Optional[float] = None) -> None:
+        self._detener.set()
+        for hilo in self.hilos:
+            hilo.join(timeout)
+
+    def esperar(self) -> None:
+        """Bloquea hasta que el pool se detenga (Ctrl+C en el comando `run.py worker`)."""
+        try:
+            while not self._detener.wait(1):
+                pass
+        except KeyboardInterrupt:
+            self.detener()
+
+    def _ciclo(self, worker_id: str) -> None:
+        config = self.app.config
+        ciclos = 0
+        while not self._detener.is_set():
+            job = None
+            try:
+                with self.app.app_context():
+                    # Al arrancar y cada 100 ciclos se recuperan jobs de workers que murieron
+                    if ciclos % 100 == 0:
+                        liberar_jobs_abandonados(config["JOB_LEASE_SEGUNDOS"])
+                    job = ejecutar_siguiente_job(worker_id, config["JOB_BACKOFF_BASE_SEGUNDOS"], config["JOB_BACKOFF_MAXIMO_SEGUNDOS"])
+            except Exception:
+                logger.exception("Error en el worker %s", worker_id)
+            ciclos += 1
+            if job is None:
+                self._detener.wait(config["JOB_POLL_SEGUNDOS"])
+
+
+def iniciar_workers(app, cantidad: int) -> PoolWorkers:
+    pool = PoolWorkers(app, cantidad).iniciar()
+    app.extensions["job_workers"] = pool
+    return pool
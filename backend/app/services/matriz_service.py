@@ -0,0 +1,143 @@
+from typing import Dict, List, Optional, Tuple
+from sqlalchemy import insert, update
+from backend.app import db
+from backend.app.models import Concepto, MatrizInsumo, DetallePresupuesto, Partida, Proyecto, incrementar_versiones, registrar_cambios_conceptos
+from backend.app.services.calculation_service import calcular_precio_unitario, obtener_factores_de_proyecto
+from backend.app.services.catalogo_service import insumos_inexistentes
+from backend.app.utils import decimal_field
+
+TIPOS_INSUMO = ("Material", "ManoObra", "Equipo", "Maquinaria")
+CAMPOS_OPCIONALES = ("porcentaje_merma", "precio_flete_unitario")
+
+
+def _normalizar_fila(fila: Dict) -> Dict:
+    """Valida una fila entrante y la convierte a los tipos de columna de MatrizInsumo."""
+    tipo = fila.get("tipo_insumo")
+    if tipo not in TIPOS_INSUMO:
+        raise ValueError(f"Tipo de insumo no soportado: {tipo}")
+    try:
+        id_insumo = int(fila.get("id_insumo"))
+    except (TypeError, ValueError):
+        raise ValueError("Cada renglón requiere un id_insumo válido")
+    if fila.get("cantidad") is None:
+        raise ValueError("Cada renglón requiere una cantidad")
+    normalizada = {"tipo_insumo": tipo, "id_insumo": id_insumo, "cantidad": decimal_field(fila["cantidad"])}
+    for campo in CAMPOS_OPCIONALES:
+        valor = fila.get(campo)
+        normalizada[campo] = decimal_field(valor) if valor not in (None, "") else None
+    return normalizada
+
+
+def _fila_cambio(registro: MatrizInsumo, fila: Dict) -> bool:
+    return any(getattr(registro, campo) != valor for campo, valor in fila.items())
+
+
+def diferenciar_matriz(existentes: List[MatrizInsumo], filas: List[Dict]) -> Tuple[List[Dict], List[Dict], List[int]]:
+    """
+    Compara las filas entrantes contra los renglones guardados.
+    Devuelve (inserciones, actualizaciones, ids_a_eliminar). Las filas se emparejan por `id`
+    y, si no lo traen, por (tipo_insumo, id_insumo) contra renglones aún no reclamados.
+    """
+    por_id = {registro.id: registro for registro in existentes}
+    reclamados = set()
+    pendientes: List[Dict] = []
+    inserciones: List[Dict] = []
+    actualizaciones: List[Dict] = []
+
+    for fila in filas:
+        normalizada = _normalizar_fila(fila)
+        registro = por_id.get(fila.get("id"))
+        if registro is None or registro.id in reclamados:
+            pendientes.append(normalizada)
+            continue
+        reclamados.add(registro.id)
+        if _fila_cambio(registro, normalizada):
+            actualizaciones.append({"id": registro.id, **normalizada})
+
+    libres: Dict[Tuple[str, int], List[MatrizInsumo]] = {}
+    for registro in existentes:
+        if registro.id not in reclamados:
+            libres.setdefault((registro.tipo_insumo, registro.id_insumo), []).append(registro)
+
+    for normalizada in pendientes:
+        candidatos = libres.get((normalizada["tipo_insumo"], normalizada["id_insumo"]))
+        if not candidatos:
+            inserciones.append(normalizada)
+            continue
+        registro = candidatos.pop(0)
+        reclamados.add(registro.id)
+        if _fila_cambio(registro, normalizada):
+            actualizaciones.append({"id": registro.id, **normalizada})
+
+    eliminaciones = [registro.id for registro in existentes if registro.id not in reclamados]
+    return inserciones, actualizaciones, eliminaciones
+
+
+def refrescar_costos_concepto(concepto_id: int) -> int:
+    """Recalcula el PU y el costo directo guardados en los detalles de presupuesto que usan el concepto."""
+    detalles = (
+        db.session.query(DetallePresupuesto.id, Partida.proyecto_id)
+        .join(Partida, DetallePresupuesto.partida_id == Partida.id)
+        .filter(DetallePresupuesto.concepto_id == concepto_id)
+        .all()
+    )
+    if not detalles:
+        return 0
+    proyecto_ids = {proyecto_id for _, proyecto_id in detalles}
+    resultados = {}
+    for proyecto in Proyecto.query.filter(Proyecto.id.in_(proyecto_ids)):
+        resultados[proyecto.id] = calcular_precio_unitario(
+            concepto_id=concepto_id, factores=obtener_factores_de_proyecto(proyecto)
+        )
+    cambios = [
+        {
+            "id": detalle_id,
+            "costo_directo": decimal_field(resultados[proyecto_id]["costo_directo"]),
+            "precio_unitario_calculado": decimal_field(resultados[proyecto_id]["precio_unitario"]),
+        }
+        for detalle_id, proyecto_id in detalles
+    ]
+    db.session.execute(update(DetallePresupuesto), cambios)
+    return len(cambios)
+
+
+def reemplazar_matriz(concepto: Concepto, filas: List[Dict], factores: Optional[Dict] = None) -> Dict:
+    """
+    Sustituye la matriz completa de un concepto en una sola transacción.
+    Aplica inserciones, actualizaciones y bajas en bloque, refresca los costos guardados
+    en presupuestos y devuelve la matriz resultante junto con el nuevo PU.
+    """
+    faltantes = insumos_inexistentes((fila["tipo_insumo"], fila["id_insumo"]) for fila in map(_normalizar_fila, filas))
+    if faltantes:
+        raise ValueError("Insumos no encontrados en el catálogo: " + ", ".join(f"{tipo} {insumo_id}" for tipo, insumo_id in faltantes))
+    existentes = MatrizInsumo.query.filter_by(concepto_id=concepto.id).all()
+    inserciones, actualizaciones, eliminaciones = diferenciar_matriz(existentes, filas)
+    try:
+        if eliminaciones:
+            MatrizInsumo.query.filter(MatrizInsumo.id.in_(eliminaciones)).delete(synchronize_session=False)
+        if actualizaciones:
+            db.session.execute(update(MatrizInsumo), actualizaciones)
+        if inserciones:
+            db.session.execute(insert(MatrizInsumo), [{"concepto_id": concepto.id, **fila} for fila in inserciones])
+        db.session.flush()
+        db.session.expire_all()
+        detalles_actualizados = refrescar_costos_concepto(concepto.id)
+        incrementar_versiones(db.session.connection(), ["conceptos"])
+        registrar_cambios_conceptos(db.session.connection(), [concepto.id])
+        # El PU de la respuesta se calcula antes del commit: si falla, la matriz no queda guardada
+        resultado = calcular_precio_unitario(concepto_id=concepto.id, factores=factores)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+    registros = MatrizInsumo.query.filter_by(concepto_id=concepto.id).order_by(MatrizInsumo.id).all()
+    return {
+        "matriz": [registro.to_dict() for registro in registros],
+        "insertados": len(inserciones),
+        "actualizados": len(actualizaciones),
+        "eliminados": len(eliminaciones),
+        "detalles_actualizados": detalles_actualizados,
+        "costo_directo": resultado["costo_directo"],
+        "precio_unitario": resultado["precio_unitario"],
+    }
@@ -1,10 +1,18 @@
 import io
 from typing import Dict, List
-from reportlab.pdfgen import canvas
-from reportlab.lib.pagesizes import A4
-# ... más importaciones de reportlab ...
+
+
+def precargar() -> None:
+    """Importa ReportLab por adelantado (create_app con precarga="completa")."""
+    import reportlab.pdfgen.canvas  # noqa: F401
+    import reportlab.platypus  # noqa: F401
+
 
 def generar_pdf_nota_venta(concepto: Dict, matriz_detalle: List[Dict], resultado_calculo: Dict) -> bytes:
+    # ReportLab se importa al generar el primer PDF, no al arrancar cada worker
+    from reportlab.pdfgen import canvas
+    from reportlab.lib.pagesizes import A4
+    # ... más importaciones de reportlab ...
     buffer = io.BytesIO()
     # ... lógica completa de generación de PDF ...
     doc.build(story)
@@ -0,0 +1,224 @@
+import logging
+import multiprocessing
+import os
+import time
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from decimal import Decimal
+from typing import Callable, Dict, List, Optional, Tuple
+from flask import current_app
+from werkzeug.exceptions import NotFound
+from sqlalchemy import func, update
+from backend.app import db
+from backend.app.models import DetallePresupuesto, MatrizInsumo, Partida, Proyecto, incrementar_versiones
+from backend.app.services.calculation_service import obtener_costo_insumo, obtener_factor_decimal, obtener_factores_de_proyecto
+from backend.app.services.catalogo_service import cargar_caches_insumos
+from backend.app.utils import decimal_field
+
+logger = logging.getLogger(__name__)
+
+FACTORES_PU = ("indirectos", "financiamiento", "utilidad", "iva")
+LOTE_IN = 900  # por debajo del límite de parámetros de SQLite
+
+# (detalle_id, proyecto_id, partida_id, costo_directo, precio_unitario); los importes van como texto para cruzar procesos sin perder precisión
+Resultado = Tuple[int, int, int, str, str]
+# Concepto cuyos detalles no se recalcularon: {"concepto_id", "tipo_insumo", "id_insumo", "detalles"}
+Omitido = Dict[str, int]
+
+
+def _en_lotes(ids: List[int], tamano: int = LOTE_IN):
+    for inicio in range(0, len(ids), tamano):
+        yield ids[inicio:inicio + tamano]
+
+
+def calcular_shard(proyecto_ids: List[int]) -> Tuple[List[Resultado], List[Omitido]]:
+    """
+    Calcula costo directo y PU de todos los detalles de los proyectos del shard. Solo lee:
+    carga en bloque detalles, matrices e insumos, obtiene los subtotales de cada concepto
+    una vez y los combina con los factores de cada proyecto. Un concepto cuya matriz usa un
+    insumo que ya no existe se omite (sus detalles conservan el PU anterior) y se reporta.
+    """
+    factores = {p.id: obtener_factores_de_proyecto(p) for p in Proyecto.query.filter(Proyecto.id.in_(proyecto_ids))}
+    detalles = []
+    for lote in _en_lotes(proyecto_ids):
+        detalles.extend(
+            db.session.query(DetallePresupuesto.id, DetallePresupuesto.partida_id, DetallePresupuesto.concepto_id, Partida.proyecto_id)
+            .join(Partida, DetallePresupuesto.partida_id == Partida.id)
+            .filter(Partida.proyecto_id.in_(lote))
+            .all()
+        )
+    conceptos = sorted({concepto_id for _, _, concepto_id, _ in detalles})
+    registros_por_concepto = defaultdict(list)
+    for lote in _en_lotes(conceptos):
+        for registro in MatrizInsumo.query.filter(MatrizInsumo.concepto_id.in_(lote)):
+            registros_por_concepto[registro.concepto_id].append(registro.to_dict())
+    caches = cargar_caches_insumos(
+        (r["tipo_insumo"], r["id_insumo"]) for registros in registros_por_concepto.values() for r in registros if r.get("id_insumo")
+    )
+
+    subtotales: Dict[int, Tuple[Decimal, Decimal]] = {}
+    faltantes: Dict[int, Dict] = {}
+    for concepto_id in conceptos:
+        cd_base = costo_mano_obra = Decimal("0")
+        for registro in registros_por_concepto[concepto_id]:
+            try:
+                importe = decimal_field(registro["cantidad"]) * obtener_costo_insumo(registro, caches)
+            except NotFound:
+                faltantes[concepto_id] = {"tipo_insumo": registro["tipo_insumo"], "id_insumo": registro["id_insumo"]}
+                break
+            cd_base += importe
+            if registro["tipo_insumo"] == "ManoObra":
+                costo_mano_obra += importe
+        else:
+            subtotales[concepto_id] = (cd_base, costo_mano_obra)
+
+    por_proyecto: Dict[int, Tuple[Decimal, Decimal]] = {}
+    for proyecto_id, factores_proyecto in factores.items():
+        multiplicador = Decimal("1.0")
+        for clave in FACTORES_PU:
+            multiplicador *= Decimal("1.0") + obtener_factor_decimal(factores_proyecto, clave)
+        por_proyecto[proyecto_id] = (obtener_factor_decimal(factores_proyecto, "mano_obra"), multiplicador)
+
+    resultados: List[Resultado] = []
+    omitidos: Dict[int, int] = defaultdict(int)
+    for detalle_id, partida_id, concepto_id, proyecto_id in detalles:
+        if concepto_id in faltantes:
+            omitidos[concepto_id] += 1
+            continue
+        cd_base, costo_mano_obra = subtotales[concepto_id]
+        factor_mano_obra, multiplicador = por_proyecto[proyecto_id]
+        costo_directo = cd_base + costo_mano_obra * factor_mano_obra
+        resultados.append((detalle_id, proyecto_id, partida_id, str(costo_directo), str(costo_directo * multiplicador)))
+    return resultados, [dict(faltantes[concepto_id], concepto_id=concepto_id, detalles=cantidad) for concepto_id, cantidad in omitidos.items()]
+
+
+def repartir_proyectos(conteos: Dict[int, int], shards: int) -> List[List[int]]:
+    """Reparte proyectos en shards de carga parecida: el proyecto más grande va al shard más ligero."""
+    cargas = [[0, []] for _ in range(max(1, shards))]
+    for proyecto_id, detalles in sorted(conteos.items(), key=lambda par: -par[1]):
+        shard = min(cargas, key=lambda c: c[0])
+        shard[0] += detalles
+        shard[1].append(proyecto_id)
+    return [ids for _, ids in cargas if ids]
+
+
+def _base_en_memoria() -> bool:
+    """
+    True si la base es un SQLite en memoria, que los procesos del pool no verían. Se revisa
+    url.database y no la URL renderizada, que escapa ":memory:" como "%3Amemory%3A".
+    """
+    return db.engine.url.database in (None, "", ":memory:")
+
+
+_app_proceso = None
+
+
+def _config_para_procesos() -> Dict:
+    """Valores simples de la configuración de la app actual (p. ej. COSTOS_MMAP_DIR), que cruzan el spawn sin problema."""
+    config = {
+        clave: valor for clave, valor in current_app.config.items()
+        if clave.isupper() and isinstance(valor, (str, int, float, bool, type(None)))
+    }
+    config["SQLALCHEMY_DATABASE_URI"] = db.engine.url.render_as_string(hide_password=False)
+    config["JOB_WORKERS"] = 0
+    return config
+
+
+def _iniciar_proceso(config: Dict) -> None:
+    """Cada proceso del pool crea su propia app (y conexión) con la configuración de la app que lo lanzó."""
+    global _app_proceso
+    from backend.app import create_app
+    from backend.config import Config
+
+    _app_proceso = create_app(type("ConfigPortafolio", (Config,), config), workers=0)
+    _app_proceso.app_context().push()
+
+
+def _calcular_shard_en_proceso(proyecto_ids: List[int]) -> Tuple[List[Resultado], List[Omitido]]:
+    try:
+        return calcular_shard(proyecto_ids)
+    finally:
+        db.session.remove()
+
+
+def _escribir(resultados: List[Resultado], tamano_lote: int) -> None:
+    """Único escritor: actualizaciones en bloque por lotes, un commit por lote para no bloquear SQLite."""
+    for inicio in range(0, len(resultados), tamano_lote):
+        lote = resultados[inicio:inicio + tamano_lote]
+        db.session.execute(update(DetallePresupuesto), [
+            {"id": detalle_id, "costo_directo": Decimal(costo_directo), "precio_unitario_calculado": Decimal(precio_unitario)}
+            for detalle_id, _, _, costo_directo, precio_unitario in lote
+        ])
+        incrementar_versiones(db.session.connection(), {f"proyecto:{r[1]}" for r in lote} | {f"partida:{r[2]}" for r in lote})
+        db.session.commit()
+
+
+def recalcular_portafolio(
+    proyecto_ids: Optional[List[int]] = None,
+    procesos: Optional[int] = None,
+    tamano_lote: int = 500,
+    progreso: Optional[Callable[[int, int, str], None]] = None,
+) -> Dict:
+    """
+    Recalcula PU y costo directo de todos los detalles de presupuesto (o solo de `proyecto_ids`).
+
+    Los proyectos se reparten en shards que calculan procesos independientes; el proceso
+    que llama escribe los resultados conforme llegan. Los conceptos cuya matriz usa un insumo
+    inexistente no se recalculan y se reportan en `conceptos_omitidos`, así ningún shard
+    falla a la mitad dejando el portafolio recalculado solo en parte. Con procesos=1, o con una base en
+    memoria que otros procesos no ven, todo corre en el proceso actual.
+    """
+    inicio = time.perf_counter()
+    consulta = db.session.query(Partida.proyecto_id, func.count(DetallePresupuesto.id)).join(DetallePresupuesto, DetallePresupuesto.partida_id == Partida.id)
+    if proyecto_ids:
+        consulta = consulta.filter(Partida.proyecto_id.in_(proyecto_ids))
+    conteos = dict(consulta.group_by(Partida.proyecto_id).all())
+    total = sum(conteos.values())
+    procesos = max(1, procesos or os.cpu_count() or 1)
+    if _base_en_memoria():
+        procesos = 1
+    # Más shards que procesos para equilibrar la carga y reportar avance con más frecuencia
+    shards = repartir_proyectos(conteos, procesos * 4)
+
+    hechos = procesados = 0
+    conceptos_omitidos: Dict[int, Omitido] = {}
+
+    def registrar(shard: Tuple[List[Resultado], List[Omitido]]) -> None:
+        nonlocal hechos, procesados
+        resultados, omitidos = shard
+        _escribir(resultados, tamano_lote)
+        hechos += len(resultados)
+        for omitido in omitidos:
+            # Un concepto puede aparecer en varios shards: se suman sus detalles omitidos
+            acumulado = conceptos_omitidos.setdefault(omitido["concepto_id"], dict(omitido, detalles=0))
+            acumulado["detalles"] += omitido["detalles"]
+        procesados += len(resultados) + sum(o["detalles"] for o in omitidos)
+        transcurrido = time.perf_counter() - inicio
+        if progreso:
+            progreso(procesados, total, f"{procesados} de {total} detalles ({procesados / transcurrido:.0f}/s)")
+
+    if procesos == 1:
+        for shard in shards:
+            registrar(calcular_shard(shard))
+    else:
+        contexto = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=procesos, mp_context=contexto, initializer=_iniciar_proceso, initargs=(_config_para_procesos(),)) as pool:
+            try:
+                for futuro in as_completed([pool.submit(_calcular_shard_en_proceso, shard) for shard in shards]):
+                    registrar(futuro.result())
+            except Exception:
+                # Cancelación (JobCancelado desde progreso) o fallo: los shards en cola no llegan a calcularse
+                pool.shutdown(wait=False, cancel_futures=True)
+                raise
+
+    segundos = time.perf_counter() - inicio
+    omitidos = sorted(conceptos_omitidos.values(), key=lambda o: o["concepto_id"])
+    resumen = {
+        "proyectos": len(conteos), "detalles": hechos, "procesos": procesos, "shards": len(shards),
+        "segundos": round(segundos, 3), "detalles_por_segundo": round(hechos / segundos, 1) if segundos else None,
+        "detalles_omitidos": sum(o["detalles"] for o in omitidos), "conceptos_omitidos": omitidos,
+    }
+    for omitido in omitidos:
+        logger.warning("Concepto %s sin recalcular: el insumo %s %s no existe (%s detalles)", omitido["concepto_id"], omitido["tipo_insumo"], omitido["id_insumo"], omitido["detalles"])
+    logger.info("Portafolio recalculado: %s", {k: v for k, v in resumen.items() if k != "conceptos_omitidos"})
+    return resumen
@@ -0,0 +1,101 @@
+import json
+from decimal import Decimal
+from typing import Dict, Iterator, List
+from sqlalchemy.orm import joinedload
+from backend.app.models import DetallePresupuesto, Partida, Proyecto
+
+LOTE_STREAM = 1000
+
+
+def _detalle(detalle: DetallePresupuesto) -> Dict:
+    datos = detalle.to_dict()
+    datos["concepto_detalle"]["unidad_concepto"] = detalle.concepto.unidad_concepto
+    datos["importe"] = float(detalle.cantidad_obra * detalle.precio_unitario_calculado)
+    return datos
+
+
+class _Subtotales:
+    """Acumula en Decimal los mismos totales que el resumen del presupuesto en el frontend."""
+
+    def __init__(self):
+        self.detalles = 0
+        self.costo_directo = Decimal("0")
+        self.importe = Decimal("0")
+
+    def sumar(self, detalle: DetallePresupuesto) -> None:
+        self.detalles += 1
+        self.costo_directo += detalle.cantidad_obra * (detalle.costo_directo or Decimal("0"))
+        self.importe += detalle.cantidad_obra * detalle.precio_unitario_calculado
+
+    def agregar(self, otros: "_Subtotales") -> None:
+        self.detalles += otros.detalles
+        self.costo_directo += otros.costo_directo
+        self.importe += otros.importe
+
+    def to_dict(self) -> Dict:
+        return {"detalles": self.detalles, "costo_directo": float(self.costo_directo), "importe": float(self.importe)}
+
+
+def _consultas(proyecto_id: int):
+    """Las tres consultas del árbol: proyecto, partidas y detalles con su concepto (join, sin lazy loads)."""
+    proyecto = Proyecto.query.get_or_404(proyecto_id)
+    partidas = Partida.query.filter_by(proyecto_id=proyecto.id).order_by(Partida.id).all()
+    detalles = (
+        DetallePresupuesto.query.join(Partida, DetallePresupuesto.partida_id == Partida.id)
+        .filter(Partida.proyecto_id == proyecto.id)
+        .options(joinedload(DetallePresupuesto.concepto))
+        .order_by(DetallePresupuesto.partida_id, DetallePresupuesto.id)
+    )
+    return proyecto, partidas, detalles
+
+
+def _por_partida(partidas: List[Partida], detalles) -> Iterator[tuple]:
+    """Mezcla partidas y detalles, ambos ordenados por partida, en (partida, detalles, subtotales); las partidas vacías también salen."""
+    detalles = iter(detalles)
+    detalle = next(detalles, None)
+    for partida in partidas:
+        while detalle is not None and detalle.partida_id < partida.id:
+            detalle = next(detalles, None)
+        grupo, subtotales = [], _Subtotales()
+        while detalle is not None and detalle.partida_id == partida.id:
+            grupo.append(_detalle(detalle))
+            subtotales.sumar(detalle)
+            detalle = next(detalles, None)
+        yield partida, grupo, subtotales
+
+
+def _partida(partida: Partida, detalles: List[Dict], subtotales: _Subtotales) -> Dict:
+    datos = partida.to_dict()
+    datos["detalles"] = detalles
+    datos["subtotales"] = subtotales.to_dict()
+    return datos
+
+
+def obtener_presupuesto(proyecto_id: int) -> Dict:
+    """Árbol completo del presupuesto: proyecto -> partidas -> detalles con concepto, subtotales por partida y totales."""
+    proyecto, partidas, detalles = _consultas(proyecto_id)
+    totales = _Subtotales()
+    resultado = []
+    for partida, grupo, subtotales in _por_partida(partidas, detalles.all()):
+        totales.agregar(subtotales)
+        resultado.append(_partida(partida, grupo, subtotales))
+    return {"proyecto": proyecto.to_dict(), "partidas": resultado, "totales": totales.to_dict()}
+
+
+def stream_presupuesto(proyecto_id: int) -> Iterator[str]:
+    """
+    El mismo árbol como NDJSON: una línea con el proyecto, una por partida (con sus detalles) y
+    una final con los totales. Los detalles se leen por lotes, así la memoria no crece con el presupuesto.
+    El proyecto se busca antes de empezar a emitir, para que un 404 salga como respuesta normal.
+    """
+    proyecto, partidas, detalles = _consultas(proyecto_id)
+
+    def lineas() -> Iterator[str]:
+        yield json.dumps({"tipo": "proyecto", "proyecto": proyecto.to_dict()}) + "\n"
+        totales = _Subtotales()
+        for partida, grupo, subtotales in _por_partida(partidas, detalles.yield_per(LOTE_STREAM)):
+            totales.agregar(subtotales)
+            yield json.dumps({"tipo": "partida", "partida": _partida(partida, grupo, subtotales)}) + "\n"
+        yield json.dumps({"tipo": "totales", "totales": totales.to_dict()}) + "\n"
+
+    return lineas()
@@ -0,0 +1,324 @@
+import secrets
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from decimal import Decimal
+from typing import Dict, List, Optional, Set, Tuple
+from flask import current_app
+from sqlalchemy import delete, select, update
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from werkzeug.exceptions import NotFound
+from backend.app import db
+from backend.app.models import MatrizInsumo, SesionCalculoPU, SesionCalculoPUFila
+from backend.app.services.calculation_service import obtener_costo_insumo, obtener_factor_decimal
+from backend.app.services.tabla_costos_service import caches_insumos
+from backend.app.utils import decimal_field
+
+ClaveCosto = Tuple[str, int, Optional[Decimal], Optional[Decimal]]
+CAMPOS_DECIMALES = ("cantidad", "costo_unitario", "importe")
+
+
+class ConflictoSesion(Exception):
+    """Otro worker guardó la sesión entre la lectura y la escritura de este lote."""
+
+
+def _opcional(valor) -> Optional[Decimal]:
+    return decimal_field(valor) if valor not in (None, "") else None
+
+
+def _texto(valor):
+    return str(valor) if isinstance(valor, Decimal) else valor
+
+
+def _cantidad(valor) -> Decimal:
+    try:
+        return decimal_field(valor)
+    except ArithmeticError:
+        raise ValueError(f"Cantidad inválida: {valor}")
+
+
+class SesionPU:
+    """
+    Estado de edición de una matriz: costos de insumo ya resueltos, renglones vigentes
+    y subtotales acumulados. Cada cambio de renglón ajusta los subtotales sin recorrer la matriz
+    y queda anotado en `cambiadas`/`quitadas` para guardar solo esos renglones.
+    """
+
+    def __init__(self, factores: Optional[Dict] = None, token: Optional[str] = None):
+        self.token = token or secrets.token_urlsafe(16)
+        self.factores = factores or {}
+        self.filas: Dict[str, Dict] = {}
+        self.costos: Dict[ClaveCosto, Decimal] = {}
+        self.cd_base = Decimal("0")
+        self.costo_mano_obra = Decimal("0")
+        self.version = 0
+        self.cambiadas: Set[str] = set()
+        self.quitadas: Set[str] = set()
+        self.lock = threading.Lock()
+        self._siguiente_clave = 1
+
+    def encabezado(self) -> Dict:
+        """Factores y totales serializables a JSON (Decimal como texto); los renglones van aparte."""
+        return {
+            "factores": {clave: {k: _texto(v) for k, v in config.items()} for clave, config in self.factores.items()},
+            "cd_base": str(self.cd_base),
+            "costo_mano_obra": str(self.costo_mano_obra),
+            "siguiente_clave": self._siguiente_clave,
+        }
+
+    @classmethod
+    def desde_tablas(cls, token: str, encabezado: Dict, filas: Dict[str, Dict], version: int) -> "SesionPU":
+        sesion = cls({clave: dict(config, porcentaje=decimal_field(config.get("porcentaje"))) for clave, config in encabezado["factores"].items()}, token)
+        sesion.filas = {clave: dict(fila, **{k: decimal_field(fila[k]) for k in CAMPOS_DECIMALES}) for clave, fila in filas.items()}
+        sesion.cd_base = decimal_field(encabezado["cd_base"])
+        sesion.costo_mano_obra = decimal_field(encabezado["costo_mano_obra"])
+        sesion._siguiente_clave = encabezado["siguiente_clave"]
+        sesion.version = version
+        return sesion
+
+    def _costo_unitario(self, registro: Dict) -> Decimal:
+        if not registro.get("tipo_insumo"):
+            raise ValueError("Cada renglón requiere tipo_insumo")
+        if registro.get("precio_unitario_sugerido") is not None:
+            return _cantidad(registro["precio_unitario_sugerido"])
+        clave: ClaveCosto = (
+            registro["tipo_insumo"],
+            int(registro.get("id_insumo") or 0),
+            _opcional(registro.get("porcentaje_merma")),
+            _opcional(registro.get("precio_flete_unitario")),
+        )
+        if clave not in self.costos:
+            try:
+                self.costos[clave] = obtener_costo_insumo(registro, caches_insumos())
+            except NotFound:
+                raise ValueError(f"Insumo no encontrado en el catálogo: {clave[0]} {clave[1]}")
+        return self.costos[clave]
+
+    def _sumar(self, fila: Dict, signo: int) -> None:
+        self.cd_base += signo * fila["importe"]
+        if fila["tipo_insumo"] == "ManoObra":
+            self.costo_mano_obra += signo * fila["importe"]
+
+    def agregar(self, registro: Dict, clave: Optional[str] = None) -> str:
+        # Todo lo que puede fallar se resuelve antes de tocar el estado: un renglón inválido no deja rastro
+        fila = dict(registro)
+        fila["cantidad"] = _cantidad(registro.get("cantidad"))
+        fila["costo_unitario"] = self._costo_unitario(registro)
+        fila["importe"] = fila["cantidad"] * fila["costo_unitario"]
+        if clave is None:
+            while str(self._siguiente_clave) in self.filas:
+                self._siguiente_clave += 1
+            clave = str(self._siguiente_clave)
+        clave = str(clave)
+        if clave in self.filas:
+            self._sumar(self.filas[clave], -1)
+        self.filas[clave] = fila
+        self._sumar(fila, 1)
+        self.cambiadas.add(clave)
+        self.quitadas.discard(clave)
+        return clave
+
+    def modificar(self, clave: str, cambios: Dict) -> None:
+        fila = self.filas.get(str(clave))
+        if fila is None:
+            raise KeyError(clave)
+        if not cambios:
+            return
+        if set(cambios) - {"cantidad"}:
+            registro = {k: v for k, v in fila.items() if k not in ("costo_unitario", "importe")}
+            registro.update(cambios)
+            self.agregar(registro, clave)
+            return
+        cantidad = _cantidad(cambios["cantidad"])
+        self._sumar(fila, -1)
+        fila["cantidad"] = cantidad
+        fila["importe"] = fila["cantidad"] * fila["costo_unitario"]
+        self._sumar(fila, 1)
+        self.cambiadas.add(str(clave))
+
+    def quitar(self, clave: str) -> None:
+        fila = self.filas.pop(str(clave), None)
+        if fila is None:
+            raise KeyError(clave)
+        self._sumar(fila, -1)
+        self.cambiadas.discard(str(clave))
+        self.quitadas.add(str(clave))
+
+    def resumen(self) -> Dict[str, float]:
+        cd_total = self.cd_base + self.costo_mano_obra * obtener_factor_decimal(self.factores, "mano_obra")
+        multiplicador = Decimal("1.0")
+        for key in ("indirectos", "financiamiento", "utilidad", "iva"):
+            multiplicador *= Decimal("1.0") + obtener_factor_decimal(self.factores, key)
+        return {"costo_directo": float(cd_total), "precio_unitario": float(cd_total * multiplicador)}
+
+
+class AlmacenSesionesPU:
+    """
+    Sesiones en memoria (LRU de `maximo`) respaldadas por las tablas sesiones_pu y sesiones_pu_filas.
+    Un PATCH trabaja sobre la copia local sin leer la base y escribe solo el encabezado y los renglones
+    que cambió, con la versión como condición. Si otro worker se adelantó (o la sesión expiró), la
+    escritura no aplica: la copia se descarta, se relee de la base y el lote se vuelve a aplicar.
+    """
+
+    def __init__(self, ttl_segundos: int, maximo: int):
+        self.ttl_segundos = ttl_segundos
+        self.maximo = maximo
+        self._sesiones: "OrderedDict[str, SesionPU]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _recordar(self, sesion: SesionPU) -> None:
+        with self._lock:
+            self._sesiones[sesion.token] = sesion
+            self._sesiones.move_to_end(sesion.token)
+            while len(self._sesiones) > self.maximo:
+                self._sesiones.popitem(last=False)
+
+    def olvidar(self, token: str) -> None:
+        """Descarta la copia local; la siguiente petición la relee de la base."""
+        with self._lock:
+            self._sesiones.pop(token, None)
+
+    def _limite(self) -> datetime:
+        return datetime.utcnow() - timedelta(seconds=self.ttl_segundos)
+
+    def _escribir_filas(self, sesion: SesionPU) -> None:
+        if sesion.quitadas:
+            db.session.execute(delete(SesionCalculoPUFila).where(
+                SesionCalculoPUFila.token == sesion.token, SesionCalculoPUFila.clave.in_(sorted(sesion.quitadas))
+            ))
+        if sesion.cambiadas:
+            sentencia = sqlite_insert(SesionCalculoPUFila).values([
+                {"token": sesion.token, "clave": clave, "fila": {k: _texto(v) for k, v in sesion.filas[clave].items()}}
+                for clave in sorted(sesion.cambiadas)
+            ])
+            db.session.execute(sentencia.on_conflict_do_update(index_elements=["token", "clave"], set_={"fila": sentencia.excluded.fila}))
+        sesion.cambiadas.clear()
+        sesion.quitadas.clear()
+
+    def guardar(self, sesion: SesionPU) -> None:
+        vencidas = select(SesionCalculoPU.token).where(SesionCalculoPU.actualizado < self._limite())
+        db.session.execute(delete(SesionCalculoPUFila).where(SesionCalculoPUFila.token.in_(vencidas)))
+        db.session.execute(delete(SesionCalculoPU).where(SesionCalculoPU.actualizado < self._limite()))
+        db.session.add(SesionCalculoPU(token=sesion.token, estado=sesion.encabezado(), version=1, actualizado=datetime.utcnow()))
+        self._escribir_filas(sesion)
+        db.session.commit()
+        sesion.version = 1
+        self._recordar(sesion)
+
+    def obtener(self, token: str) -> Optional[SesionPU]:
+        """La copia local si la hay (sin consultar la base); si no, la sesión guardada, o None si no existe o expiró."""
+        with self._lock:
+            sesion = self._sesiones.get(token)
+            if sesion is not None:
+                self._sesiones.move_to_end(token)
+                return sesion
+        encabezado = db.session.get(SesionCalculoPU, token)
+        if encabezado is None or encabezado.actualizado < self._limite():
+            if encabezado is not None:
+                self.cerrar(token)
+            return None
+        filas = dict(db.session.query(SesionCalculoPUFila.clave, SesionCalculoPUFila.fila).filter_by(token=token))
+        sesion = SesionPU.desde_tablas(token, encabezado.estado, filas, encabezado.version)
+        self._recordar(sesion)
+        return sesion
+
+    def persistir(self, sesion: SesionPU) -> None:
+        """Escribe encabezado y renglones cambiados si la sesión sigue vigente en la versión leída; si no, ConflictoSesion."""
+        ahora = datetime.utcnow()
+        resultado = db.session.execute(
+            update(SesionCalculoPU)
+            .where(SesionCalculoPU.token == sesion.token, SesionCalculoPU.version == sesion.version, SesionCalculoPU.actualizado >= self._limite())
+            .values(estado=sesion.encabezado(), version=sesion.version + 1, actualizado=ahora)
+        )
+        if resultado.rowcount == 0:
+            db.session.rollback()
+            self.olvidar(sesion.token)
+            raise ConflictoSesion(sesion.token)
+        self._escribir_filas(sesion)
+        db.session.commit()
+        sesion.version += 1
+
+    def cerrar(self, token: str) -> bool:
+        self.olvidar(token)
+        db.session.execute(delete(SesionCalculoPUFila).where(SesionCalculoPUFila.token == token))
+        borradas = db.session.execute(delete(SesionCalculoPU).where(SesionCalculoPU.token == token)).rowcount
+        db.session.commit()
+        return borradas > 0
+
+
+def obtener_almacen() -> AlmacenSesionesPU:
+    """Almacén de sesiones de la app actual, creado la primera vez con PU_SESION_TTL_SEGUNDOS y PU_SESIONES_MAXIMAS."""
+    almacen = current_app.extensions.get("sesiones_pu")
+    if almacen is None:
+        almacen = current_app.extensions.setdefault(
+            "sesiones_pu", AlmacenSesionesPU(current_app.config["PU_SESION_TTL_SEGUNDOS"], current_app.config["PU_SESIONES_MAXIMAS"])
+        )
+    return almacen
+
+
+def _respuesta(sesion: SesionPU, claves: Optional[List[str]] = None) -> Dict:
+    claves = list(sesion.filas) if claves is None else claves
+    filas = [
+        {"clave": clave, "costo_unitario": float(sesion.filas[clave]["costo_unitario"]), "importe": float(sesion.filas[clave]["importe"])}
+        for clave in claves
+        if clave in sesion.filas
+    ]
+    return {"token": sesion.token, "filas": filas, **sesion.resumen()}
+
+
+def abrir_sesion(matriz: Optional[List[Dict]] = None, concepto_id: Optional[int] = None, factores: Optional[Dict] = None) -> Dict:
+    """Crea una sesión a partir de la matriz enviada o de la guardada para `concepto_id`."""
+    sesion = SesionPU(factores)
+    if matriz is None and concepto_id:
+        matriz = [dict(registro.to_dict(), clave=str(registro.id)) for registro in MatrizInsumo.query.filter_by(concepto_id=concepto_id)]
+    for registro in matriz or []:
+        sesion.agregar(registro, registro.get("clave"))
+    obtener_almacen().guardar(sesion)
+    return _respuesta(sesion)
+
+
+def aplicar_cambios(token: str, cambios: List[Dict], factores: Optional[Dict] = None) -> Optional[Dict]:
+    """
+    Aplica cambios de renglón ({"op": "add"|"update"|"remove", "clave": ..., "fila": {...}}) y
+    devuelve solo los renglones afectados junto con los totales, o None si la sesión no existe o
+    expiró. Un cambio inválido se rechaza solo (va en `rechazados` con su posición y el motivo)
+    y el resto del lote se aplica. Si otro worker guardó la sesión mientras tanto, el lote se
+    vuelve a aplicar sobre la versión guardada; si vuelve a chocar, ConflictoSesion.
+    """
+    almacen = obtener_almacen()
+    for _ in range(2):
+        sesion = almacen.obtener(token)
+        if sesion is None:
+            return None
+        with sesion.lock:
+            afectadas: List[str] = []
+            rechazados: List[Dict] = []
+            for posicion, cambio in enumerate(cambios):
+                try:
+                    _aplicar_cambio(sesion, cambio, afectadas)
+                except KeyError as e:
+                    rechazados.append({"indice": posicion, "error": f"Renglón inexistente: {e.args[0]}"})
+                except (ValueError, TypeError, ArithmeticError) as e:
+                    rechazados.append({"indice": posicion, "error": str(e)})
+            if factores is not None:
+                sesion.factores = factores
+            try:
+                almacen.persistir(sesion)
+            except ConflictoSesion:
+                continue
+            return dict(_respuesta(sesion, afectadas), rechazados=rechazados)
+    raise ConflictoSesion(token)
+
+
+def _aplicar_cambio(sesion: SesionPU, cambio: Dict, afectadas: List[str]) -> None:
+    op = cambio.get("op")
+    clave = cambio.get("clave")
+    if op == "add":
+        afectadas.append(sesion.agregar(cambio.get("fila") or {}, clave))
+    elif op == "update":
+        sesion.modificar(clave, cambio.get("fila") or {})
+        afectadas.append(str(clave))
+    elif op == "remove":
+        sesion.quitar(clave)
+    else:
+        raise ValueError(f"Operación no soportada: {op}")
@@ -0,0 +1,251 @@
+import hashlib
+import logging
+import mmap
+import os
+import struct
+import tempfile
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+from decimal import ROUND_HALF_UP, Decimal
+from typing import Dict, Iterator, Optional, Tuple
+from flask import current_app
+from sqlalchemy import func, select
+from backend.app import db
+from backend.app.models import CatalogoCambio
+from backend.app.services.catalogo_service import CATALOGOS, version_catalogo
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"FAPUCST2"
+ENCABEZADO = struct.Struct("<8sq4q")  # magic, versión del catálogo, renglones por tipo
+COLUMNAS = ("costo", "merma", "flete", "rendimiento", "fasar")
+# Los importes se guardan como enteros en diezmilésimas: las columnas Numeric del catálogo tienen
+# a lo más 4 decimales, así el valor que sale de la tabla es el mismo Decimal que da el ORM
+DECIMALES = 4
+
+# Atributo del modelo que lee obtener_costo_insumo -> columna de la tabla, por tipo
+ATRIBUTOS = {
+    "Material": {"precio_unitario": "costo", "porcentaje_merma": "merma", "precio_flete_unitario": "flete"},
+    "ManoObra": {"salario_base": "costo", "fasar": "fasar", "rendimiento_jornada": "rendimiento"},
+    "Equipo": {"costo_hora_maq": "costo"},
+    "Maquinaria": {"costo_posesion_hora": "costo", "rendimiento_horario": "rendimiento"},
+}
+
+
+def _entero(valor) -> int:
+    if valor is None:
+        return 0
+    return int(Decimal(str(valor)).scaleb(DECIMALES).to_integral_value(rounding=ROUND_HALF_UP))
+
+
+def _fila(tipo: str, registro) -> Tuple[int, ...]:
+    """Un entero por columna (0 en las que el tipo no usa), a partir del renglón del catálogo."""
+    valores = dict.fromkeys(COLUMNAS, 0)
+    for atributo, columna in ATRIBUTOS[tipo].items():
+        valores[columna] = _entero(registro[atributo])
+    return tuple(valores[columna] for columna in COLUMNAS)
+
+
+def construir_tabla_costos(ruta: str, version: int, conexion) -> None:
+    """
+    Escribe la tabla de costos leída con `conexion`: por tipo, los ids ordenados y una columna
+    por campo, todo int64. Se escribe en un temporal y se publica con os.replace, así un lector
+    ve la tabla anterior completa o la nueva completa, nunca una a medias.
+    """
+    secciones = []
+    for _, tipo, modelo in CATALOGOS:
+        columnas = [modelo.__table__.c.id, *(modelo.__table__.c[atributo] for atributo in ATRIBUTOS[tipo])]
+        registros = conexion.execute(select(*columnas).order_by(modelo.__table__.c.id)).mappings().all()
+        secciones.append(([registro["id"] for registro in registros], [_fila(tipo, registro) for registro in registros]))
+    directorio = os.path.dirname(os.path.abspath(ruta))
+    os.makedirs(directorio, exist_ok=True)
+    descriptor, temporal = tempfile.mkstemp(dir=directorio, prefix=".costos_", suffix=".tmp")
+    try:
+        with os.fdopen(descriptor, "wb") as archivo:
+            archivo.write(ENCABEZADO.pack(MAGIC, version, *(len(ids) for ids, _ in secciones)))
+            for ids, filas in secciones:
+                archivo.write(struct.pack(f"<{len(ids)}q", *ids))
+                for columna in range(len(COLUMNAS)):
+                    archivo.write(struct.pack(f"<{len(filas)}q", *(fila[columna] for fila in filas)))
+            archivo.flush()
+            os.fsync(archivo.fileno())
+        os.replace(temporal, ruta)
+    except BaseException:
+        if os.path.exists(temporal):
+            os.remove(temporal)
+        raise
+
+
+class RegistroCosto:
+    """Vista de un renglón de la tabla con los atributos del modelo que usa obtener_costo_insumo."""
+    __slots__ = ("_vista", "_posicion")
+
+    def __init__(self, vista: "VistaCostos", posicion: int):
+        self._vista = vista
+        self._posicion = posicion
+
+    def __getattr__(self, atributo: str):
+        columna = ATRIBUTOS[self._vista.tipo].get(atributo)
+        if columna is None:
+            raise AttributeError(atributo)
+        return Decimal(self._vista.columnas[columna][self._posicion]).scaleb(-DECIMALES)
+
+
+class VistaCostos:
+    """
+    Mapeo id -> RegistroCosto sobre las columnas del archivo mapeado, sin copiarlas. Acepta
+    asignaciones (obtener_costo_insumo guarda ahí lo que consulta a la base) en un dict aparte.
+    """
+
+    def __init__(self, tipo: str, ids: memoryview, columnas: Dict[str, memoryview]):
+        self.tipo = tipo
+        self.ids = ids
+        self.columnas = columnas
+        self._extra: Dict[int, object] = {}
+
+    def posicion(self, insumo_id: int) -> Optional[int]:
+        posicion = bisect_left(self.ids, insumo_id)
+        return posicion if posicion < len(self.ids) and self.ids[posicion] == insumo_id else None
+
+    def get(self, insumo_id, default=None):
+        if insumo_id in self._extra:
+            return self._extra[insumo_id]
+        posicion = self.posicion(int(insumo_id))
+        return RegistroCosto(self, posicion) if posicion is not None else default
+
+    def __getitem__(self, insumo_id):
+        registro = self.get(insumo_id)
+        if registro is None:
+            raise KeyError(insumo_id)
+        return registro
+
+    def __contains__(self, insumo_id) -> bool:
+        return self.get(insumo_id) is not None
+
+    def __setitem__(self, insumo_id, valor) -> None:
+        self._extra[insumo_id] = valor
+
+    def costo_efectivo(self, insumo_id: int) -> Optional[Decimal]:
+        """Costo unitario con la merma y el flete del catálogo, sin pasar por el ORM."""
+        from backend.app.services.calculation_service import obtener_costo_insumo
+
+        if self.posicion(insumo_id) is None:
+            return None
+        caches = tuple(self if tipo == self.tipo else {} for _, tipo, _ in CATALOGOS)
+        return obtener_costo_insumo({"tipo_insumo": self.tipo, "id_insumo": insumo_id}, caches)
+
+
+class TablaCostos:
+    """Archivo de costos mapeado en memoria; todos los procesos que lo abren comparten las mismas páginas."""
+
+    def __init__(self, ruta: str):
+        with open(ruta, "rb") as archivo:
+            self._mmap = mmap.mmap(archivo.fileno(), 0, access=mmap.ACCESS_READ)
+        datos = memoryview(self._mmap)
+        magic, self.version, *conteos = ENCABEZADO.unpack_from(datos, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{ruta} no es una tabla de costos")
+        self.vistas: Dict[str, VistaCostos] = {}
+        desplazamiento = ENCABEZADO.size
+        for (_, tipo, _), cantidad in zip(CATALOGOS, conteos):
+            tamano = cantidad * 8
+            ids = datos[desplazamiento:desplazamiento + tamano].cast("q")
+            desplazamiento += tamano
+            columnas = {}
+            for columna in COLUMNAS:
+                columnas[columna] = datos[desplazamiento:desplazamiento + tamano].cast("q")
+                desplazamiento += tamano
+            self.vistas[tipo] = VistaCostos(tipo, ids, columnas)
+
+    def caches(self) -> Tuple[VistaCostos, ...]:
+        """Los cuatro caches de obtener_costo_insumo (material, mano_obra, equipo, maquinaria) respaldados por la tabla."""
+        return tuple(VistaCostos(v.tipo, v.ids, v.columnas) for v in (self.vistas[tipo] for _, tipo, _ in CATALOGOS))
+
+
+_tablas: Dict[str, TablaCostos] = {}
+_lock = threading.Lock()
+
+
+def _ruta_tabla() -> Optional[str]:
+    if not current_app.config.get("COSTOS_COMPARTIDOS") or db.engine.url.database in (None, "", ":memory:"):
+        return None
+    uri = db.engine.url.render_as_string(hide_password=False)
+    # Una tabla por base de datos, para que dos apps del mismo servidor no compartan costos
+    sufijo = hashlib.sha1(uri.encode()).hexdigest()[:12]
+    return os.path.join(current_app.config["COSTOS_MMAP_DIR"], f"costos_insumos_{sufijo}.bin")
+
+
+@contextmanager
+def _bloqueo_entre_procesos(ruta: str) -> Iterator[None]:
+    """Evita que varios workers reconstruyan la misma tabla a la vez (sin fcntl, p. ej. Windows, solo se pierde eso)."""
+    try:
+        import fcntl
+    except ImportError:
+        yield
+        return
+    os.makedirs(os.path.dirname(ruta), exist_ok=True)
+    with open(ruta + ".lock", "w") as candado:
+        fcntl.flock(candado, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(candado, fcntl.LOCK_UN)
+
+
+def _abrir(ruta: str, version: int) -> Optional[TablaCostos]:
+    try:
+        tabla = TablaCostos(ruta)
+    except (FileNotFoundError, ValueError, struct.error):
+        return None
+    return tabla if tabla.version == version else None
+
+
+def obtener_tabla_costos() -> Optional[TablaCostos]:
+    """
+    Tabla compartida del catálogo vigente, o None si está desactivada (COSTOS_COMPARTIDOS), la
+    base está en memoria o la sesión actual tiene cambios de catálogo sin confirmar. Por petición
+    solo se consulta la versión del catálogo; la tabla se reconstruye una vez por versión para
+    todos los procesos, siempre con datos confirmados.
+    """
+    ruta = _ruta_tabla()
+    if ruta is None:
+        return None
+    version = version_catalogo()
+    tabla = _tablas.get(ruta)
+    if tabla is not None and tabla.version == version:
+        return tabla
+    with _lock:
+        tabla = _tablas.get(ruta)
+        if tabla is not None and tabla.version == version:
+            return tabla
+        tabla = _abrir(ruta, version)
+        if tabla is None:
+            with _bloqueo_entre_procesos(ruta):
+                tabla = _abrir(ruta, version)
+                if tabla is None:
+                    tabla = _construir_confirmada(ruta, version)
+        if tabla is not None:
+            _tablas[ruta] = tabla
+    return tabla
+
+
+def _construir_confirmada(ruta: str, version: int) -> Optional[TablaCostos]:
+    """
+    Construye la tabla en una conexión aparte, que solo ve datos confirmados. Si ahí la versión
+    no es la que ve la sesión (la sesión tiene cambios de catálogo sin confirmar, que un rollback
+    desharía junto con su id de versión), no se publica nada y la petición usa el ORM.
+    """
+    with db.engine.connect() as conexion:
+        confirmada = conexion.execute(select(func.max(CatalogoCambio.id))).scalar() or 0
+        if confirmada != version:
+            return None
+        construir_tabla_costos(ruta, version, conexion)
+    logger.info("Tabla de costos reconstruida para la versión %s del catálogo", version)
+    return _abrir(ruta, version)
+
+
+def caches_insumos() -> Tuple:
+    """Caches para obtener_costo_insumo: la tabla compartida si está disponible, si no dicts vacíos."""
+    tabla = obtener_tabla_costos()
+    return tabla.caches() if tabla is not None else ({}, {}, {}, {})
@@ -0,0 +1,151 @@
+import os
+from typing import Dict, List
+from sqlalchemy import update
+from flask import current_app
+from backend.app import db
+from backend.app.models import Material, ManoObra, Equipo, Maquinaria, Concepto, MatrizInsumo, Proyecto, Partida, DetallePresupuesto, incrementar_versiones
+from backend.app.services.calculation_service import (
+    calcular_fasar_valor, calcular_precio_unitario, obtener_costo_insumo, obtener_factores_de_proyecto,
+)
+from backend.app.services.catalogo_service import CATALOGOS, cargar_insumos, nombre_y_unidad
+from backend.app.services.job_service import ContextoJob, tarea
+from backend.app.utils import decimal_field
+
+TAMANO_LOTE = 200
+
+# tipo -> (modelo, campo de precio que actualiza la carga masiva)
+CAMPOS_PRECIO = {
+    "Material": (Material, "precio_unitario"),
+    "ManoObra": (ManoObra, "salario_base"),
+    "Equipo": (Equipo, "costo_hora_maq"),
+    "Maquinaria": (Maquinaria, "costo_adquisicion"),
+}
+
+
+def _lotes(elementos: List, tamano: int = TAMANO_LOTE):
+    for inicio in range(0, len(elementos), tamano):
+        yield inicio, elementos[inicio:inicio + tamano]
+
+
+@tarea("actualizar_precios_masivo")
+def actualizar_precios_masivo(payload: Dict, contexto: ContextoJob) -> Dict:
+    """payload: {"actualizaciones": [{insumo_id, tipo, nuevo_precio}, ...]}"""
+    actualizaciones = [u for u in payload.get("actualizaciones") or [] if u.get("insumo_id") and u.get("tipo") in CAMPOS_PRECIO]
+    total = len(actualizaciones)
+    aplicadas = 0
+    for inicio, lote in _lotes(actualizaciones):
+        for tipo, (modelo, campo) in CAMPOS_PRECIO.items():
+            precios = {int(u["insumo_id"]): decimal_field(u.get("nuevo_precio")) for u in lote if u["tipo"] == tipo}
+            if not precios:
+                continue
+            for insumo in modelo.query.filter(modelo.id.in_(precios)):
+                setattr(insumo, campo, precios[insumo.id])
+                if tipo == "Maquinaria":
+                    insumo.actualizar_costo_posesion()
+                aplicadas += 1
+        contexto.progreso((inicio + len(lote)) / total, f"{inicio + len(lote)} de {total} precios procesados")
+    db.session.commit()
+    return {"solicitadas": total, "aplicadas": aplicadas}
+
+
+@tarea("recalcular_fasar")
+def recalcular_fasar(payload: Dict, contexto: ContextoJob) -> Dict:
+    valor = calcular_fasar_valor()
+    ids = [mano_id for (mano_id,) in db.session.query(ManoObra.id).order_by(ManoObra.id)]
+    for inicio, lote in _lotes(ids):
+        for mano in ManoObra.query.filter(ManoObra.id.in_(lote)):
+            mano.fasar = valor
+        contexto.progreso((inicio + len(lote)) / len(ids), f"{inicio + len(lote)} de {len(ids)} puestos")
+    db.session.commit()
+    return {"count": len(ids), "fasar": float(valor)}
+
+
+@tarea("recalcular_proyecto")
+def recalcular_proyecto(payload: Dict, contexto: ContextoJob) -> Dict:
+    """Recalcula PU y costo directo de todos los detalles del proyecto con sus factores vigentes."""
+    proyecto = db.session.get(Proyecto, int(payload["proyecto_id"]))
+    if proyecto is None:
+        raise ValueError(f"Proyecto {payload['proyecto_id']} no encontrado")
+    factores = obtener_factores_de_proyecto(proyecto)
+    detalles = (
+        db.session.query(DetallePresupuesto.id, DetallePresupuesto.concepto_id, DetallePresupuesto.partida_id)
+        .join(Partida, DetallePresupuesto.partida_id == Partida.id)
+        .filter(Partida.proyecto_id == proyecto.id)
+        .all()
+    )
+    conceptos = sorted({concepto_id for _, concepto_id, _ in detalles})
+    resultados = {}
+    for numero, concepto_id in enumerate(conceptos, start=1):
+        resultados[concepto_id] = calcular_precio_unitario(concepto_id=concepto_id, factores=factores)
+        if numero % 20 == 0:
+            contexto.progreso(numero / len(conceptos) * 0.9, f"{numero} de {len(conceptos)} conceptos calculados")
+    if detalles:
+        db.session.execute(update(DetallePresupuesto), [
+            {
+                "id": detalle_id,
+                "costo_directo": decimal_field(resultados[concepto_id]["costo_directo"]),
+                "precio_unitario_calculado": decimal_field(resultados[concepto_id]["precio_unitario"]),
+            }
+            for detalle_id, concepto_id, _ in detalles
+        ])
+        incrementar_versiones(db.session.connection(), [f"proyecto:{proyecto.id}", *{f"partida:{partida_id}" for _, _, partida_id in detalles}])
+    db.session.commit()
+    return {"proyecto_id": proyecto.id, "detalles": len(detalles), "conceptos": len(conceptos)}
+
+
+@tarea("recalcular_portafolio")
+def recalcular_portafolio(payload: Dict, contexto: ContextoJob) -> Dict:
+    """payload: {"proyecto_ids": [...] (opcional, todos por defecto), "procesos": n (opcional, núcleos disponibles)}"""
+    from backend.app.services.portafolio_service import recalcular_portafolio as recalcular
+
+    return recalcular(
+        proyecto_ids=payload.get("proyecto_ids"),
+        procesos=payload.get("procesos"),
+        progreso=lambda hechos, total, mensaje: contexto.progreso(hechos / total if total else 1.0, mensaje),
+    )
+
+
+@tarea("actualizar_cubos")
+def actualizar_cubos(payload: Dict, contexto: ContextoJob) -> Dict:
+    """payload: {"proyecto_ids": [...] (opcional)}. Adelanta el refresco del cubo de analytics, p. ej. tras una carga masiva de precios."""
+    from backend.app.services.cubo_service import actualizar_cubo
+
+    ids = payload.get("proyecto_ids") or [proyecto_id for (proyecto_id,) in db.session.query(Proyecto.id).order_by(Proyecto.id)]
+    recalculadas = 0
+    for numero, proyecto_id in enumerate(ids, start=1):
+        recalculadas += actualizar_cubo(int(proyecto_id))["recalculadas"]
+        contexto.progreso(numero / len(ids), f"{numero} de {len(ids)} proyectos")
+    return {"proyectos": len(ids), "partidas_recalculadas": recalculadas}
+
+
+@tarea("pdf_nota_venta")
+def pdf_nota_venta(payload: Dict, contexto: ContextoJob) -> Dict:
+    """Genera el PDF de la nota de venta del concepto y lo deja en JOBS_DIR para descargarlo por /jobs/<id>/archivo."""
+    from backend.app.services.pdf_service import generar_pdf_nota_venta
+
+    concepto = db.session.get(Concepto, int(payload["concepto_id"]))
+    if concepto is None:
+        raise ValueError(f"Concepto {payload['concepto_id']} no encontrado")
+    registros = [r.to_dict() for r in MatrizInsumo.query.filter_by(concepto_id=concepto.id)]
+    insumos = cargar_insumos((r["tipo_insumo"], r["id_insumo"]) for r in registros if r.get("id_insumo"))
+    caches = tuple(insumos[tipo] for _, tipo, _ in CATALOGOS)
+    matriz_detalle = []
+    for registro in registros:
+        cantidad = decimal_field(registro.get("cantidad"))
+        costo_unitario = obtener_costo_insumo(registro, caches)
+        tipo = registro.get("tipo_insumo")
+        insumo = insumos.get(tipo, {}).get(registro["id_insumo"])
+        nombre, unidad = nombre_y_unidad(tipo, insumo) if insumo is not None else ("", "")
+        matriz_detalle.append({
+            "tipo_insumo": tipo, "nombre": nombre, "cantidad": float(cantidad), "unidad": unidad,
+            "precio_unitario": float(costo_unitario), "importe": float(cantidad * costo_unitario),
+        })
+    contexto.progreso(0.5, "Matriz calculada, generando PDF")
+    pdf_bytes = generar_pdf_nota_venta(concepto.to_dict(), matriz_detalle, calcular_precio_unitario(concepto_id=concepto.id))
+
+    directorio = current_app.config["JOBS_DIR"]
+    os.makedirs(directorio, exist_ok=True)
+    archivo = f"job_{contexto.job_id}_nota_venta_{concepto.id}.pdf"
+    with open(os.path.join(directorio, archivo), "wb") as destino:
+        destino.write(pdf_bytes)
+    return {"archivo": archivo, "mimetype": "application/pdf", "bytes": len(pdf_bytes)}
@@ -0,0 +1,102 @@
+"""
+Reconciliation benchmark: measures how long `conciliar_sugerencias` takes per
+suggested row as the catalog grows, using a synthetic catalog in memory.
+
+- Builds an `IndiceCatalogo` with `--tamanos` entries (default 1k, 10k and
+  100k names made from construction vocabulary) split across the four types.
+- Reconciles `--sugerencias` rows per size: half are catalog names with a
+  typo or a dropped word, half are names that are not in the catalog.
+- No database or app is needed: the index and the threshold are passed
+  explicitly.
+- Reports the median ms per row for each size and fails (exit code 1) if the
+  largest catalog exceeds `--max-ms-fila` or is more than `--max-crecimiento`
+  times slower per row than the smallest.
+
+Run from project root:
+> python -m backend.benchmarks.conciliacion
+> python -m backend.benchmarks.conciliacion --tamanos 1000 100000 --sugerencias 1000 --runs 5
+
+"""
+import argparse
+import random
+import statistics
+import sys
+import time
+from backend.app.services.conciliacion_service import IndiceCatalogo, conciliar_sugerencias
+
+# Límites con margen sobre lo medido en desarrollo
+LIMITE_MS_FILA = 5.0
+LIMITE_CRECIMIENTO = 4.0
+TIPOS = (("Material", "m3"), ("ManoObra", "jornada"), ("Equipo", "hora"), ("Maquinaria", "hora"))
+VOCABULARIO = (
+    "cemento gris arena grava block tabique varilla corrugada alambre recocido clavo madera triplay "
+    "pintura vinilica impermeabilizante tubo pvc cobre cable thw concreto premezclado malla electrosoldada "
+    "oficial albanil peon ayudante electricista plomero fierrero carpintero revolvedora vibrador bomba "
+    "retroexcavadora compactador andamio cortadora pulidora grua camion volteo"
+).split()
+
+
+def catalogo_sintetico(tamano: int, semilla: int = 7) -> IndiceCatalogo:
+    aleatorio = random.Random(semilla)
+    indice = IndiceCatalogo(version=1)
+    for insumo_id in range(1, tamano + 1):
+        tipo, unidad = TIPOS[insumo_id % len(TIPOS)]
+        nombre = " ".join(aleatorio.sample(VOCABULARIO, 3)) + f" {insumo_id}"
+        indice.agregar(tipo, insumo_id, nombre, unidad)
+    return indice
+
+
+def sugerencias_sinteticas(indice: IndiceCatalogo, cantidad: int, semilla: int = 11) -> list:
+    aleatorio = random.Random(semilla)
+    sugerencias = []
+    for numero in range(cantidad):
+        if numero % 2:
+            entrada = aleatorio.choice(indice.entradas)
+            palabras = entrada["nombre"].split()
+            palabras.pop(aleatorio.randrange(len(palabras)))
+            nombre = " ".join(palabras).replace("a", "e", 1)
+            sugerencias.append({"tipo_insumo": entrada["tipo_insumo"], "nombre": nombre, "unidad": entrada["unidad"]})
+        else:
+            sugerencias.append({"tipo_insumo": "Material", "nombre": f"insumo inexistente {numero}", "unidad": "pza"})
+    return sugerencias
+
+
+def medir(tamano: int, cantidad: int, corridas: int) -> dict:
+    inicio = time.perf_counter()
+    indice = catalogo_sintetico(tamano)
+    construccion = time.perf_counter() - inicio
+    sugerencias = sugerencias_sinteticas(indice, cantidad)
+    tiempos = []
+    for _ in range(corridas):
+        inicio = time.perf_counter()
+        conciliar_sugerencias(sugerencias, top_k=3, umbral=0.6, indice=indice)
+        tiempos.append((time.perf_counter() - inicio) * 1000 / cantidad)
+    return {"tamano": tamano, "ms_fila": statistics.median(tiempos), "indice_s": construccion}
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tamanos", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--sugerencias", type=int, default=500)
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--max-ms-fila", type=float, default=LIMITE_MS_FILA)
+    parser.add_argument("--max-crecimiento", type=float, default=LIMITE_CRECIMIENTO)
+    args = parser.parse_args(argv)
+
+    resultados = [medir(tamano, args.sugerencias, args.runs) for tamano in sorted(args.tamanos)]
+    for resultado in resultados:
+        print(f"[{resultado['tamano']:>7} insumos] {resultado['ms_fila']:.3f} ms/fila (índice en {resultado['indice_s']:.1f} s)")
+
+    menor, mayor = resultados[0], resultados[-1]
+    errores = []
+    if mayor["ms_fila"] > args.max_ms_fila:
+        errores.append(f"{mayor['ms_fila']:.3f} ms/fila con {mayor['tamano']} insumos > {args.max_ms_fila} ms")
+    if menor["ms_fila"] and mayor["ms_fila"] / menor["ms_fila"] > args.max_crecimiento:
+        errores.append(f"de {menor['tamano']} a {mayor['tamano']} insumos el costo por fila crece {mayor['ms_fila'] / menor['ms_fila']:.1f}x > {args.max_crecimiento}x")
+    for error in errores:
+        print(f"REGRESIÓN: {error}")
+    return 1 if errores else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
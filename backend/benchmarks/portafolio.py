@@ -0,0 +1,122 @@
+"""
+Portfolio benchmark: measures `recalcular_portafolio` throughput on a
+synthetic portfolio in a temporary SQLite file, with one and with several
+processes.
+
+- Seeds `--detalles` budget lines (default 40 000) spread over `--proyectos`
+  projects and `--conceptos` concepts. Each concept has a 6-row matrix over
+  materials and labour, and each project has its own factors.
+- Runs the recalculation once per value of `--procesos` (default 1 2 4) on the
+  same data and reports seconds, detalles/s and speed-up over the first run.
+- Fails (exit code 1) if any run writes different PU values from the first,
+  or if `--min-aceleracion` is given and the last run is slower than that
+  multiple of the first. Scaling depends on the cores available: with one
+  core, extra processes only add overhead.
+
+Run from project root:
+> python -m backend.benchmarks.portafolio
+> python -m backend.benchmarks.portafolio --detalles 100000 --procesos 1 4 8 --min-aceleracion 2
+
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+from decimal import Decimal
+from sqlalchemy import insert
+from backend.app import create_app, db
+from backend.app.models import Concepto, DetallePresupuesto, ManoObra, Material, MatrizInsumo, Partida, Proyecto
+from backend.app.services.portafolio_service import recalcular_portafolio
+from backend.config import TestingConfig
+
+
+def sembrar(detalles: int, proyectos: int, conceptos: int, semilla: int = 3) -> None:
+    aleatorio = random.Random(semilla)
+    db.session.execute(insert(Material), [
+        {"id": n, "nombre": f"Material {n}", "unidad": "pza", "precio_unitario": Decimal(aleatorio.randint(50, 5000)) / 10}
+        for n in range(1, 201)
+    ])
+    db.session.execute(insert(ManoObra), [
+        {"id": n, "puesto": f"Puesto {n}", "salario_base": Decimal(aleatorio.randint(300, 900)), "fasar": Decimal("1.6")}
+        for n in range(1, 21)
+    ])
+    db.session.execute(insert(Concepto), [
+        {"id": n, "clave": f"C-{n}", "descripcion": f"Concepto {n}", "unidad_concepto": "m2"} for n in range(1, conceptos + 1)
+    ])
+    db.session.execute(insert(MatrizInsumo), [
+        {
+            "concepto_id": concepto_id,
+            "tipo_insumo": "ManoObra" if renglon == 0 else "Material",
+            "id_insumo": aleatorio.randint(1, 20) if renglon == 0 else aleatorio.randint(1, 200),
+            "cantidad": Decimal(aleatorio.randint(1, 400)) / 100,
+        }
+        for concepto_id in range(1, conceptos + 1)
+        for renglon in range(6)
+    ])
+    db.session.execute(insert(Proyecto), [
+        {"id": n, "nombre_proyecto": f"Proyecto {n}", "ajuste_indirectos_activo": True, "ajuste_indirectos_porcentaje": Decimal(aleatorio.randint(5, 20)) / 100}
+        for n in range(1, proyectos + 1)
+    ])
+    db.session.execute(insert(Partida), [{"id": n, "proyecto_id": n, "nombre_partida": "General"} for n in range(1, proyectos + 1)])
+    db.session.execute(insert(DetallePresupuesto), [
+        {
+            "partida_id": aleatorio.randint(1, proyectos), "concepto_id": aleatorio.randint(1, conceptos),
+            "cantidad_obra": Decimal(aleatorio.randint(1, 100)), "precio_unitario_calculado": Decimal("0"),
+        }
+        for _ in range(detalles)
+    ])
+    db.session.commit()
+
+
+def precios() -> list:
+    return [valor for (valor,) in db.session.query(DetallePresupuesto.precio_unitario_calculado).order_by(DetallePresupuesto.id)]
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--detalles", type=int, default=40000)
+    parser.add_argument("--proyectos", type=int, default=200)
+    parser.add_argument("--conceptos", type=int, default=500)
+    parser.add_argument("--procesos", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--min-aceleracion", type=float, default=None)
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as directorio:
+        class ConfigBenchmark(TestingConfig):
+            SQLALCHEMY_DATABASE_URI = f"sqlite:///{os.path.join(directorio, 'portafolio.db')}"
+            COSTOS_COMPARTIDOS = True
+            COSTOS_MMAP_DIR = os.path.join(directorio, "costos")
+
+        app = create_app(ConfigBenchmark, workers=0)
+        with app.app_context():
+            db.create_all()
+            sembrar(args.detalles, args.proyectos, args.conceptos)
+            print(f"{args.detalles} detalles, {args.proyectos} proyectos, {args.conceptos} conceptos; {os.cpu_count()} núcleos")
+
+            errores = []
+            referencia = None
+            resumenes = []
+            for procesos in args.procesos:
+                db.session.execute(DetallePresupuesto.__table__.update().values(precio_unitario_calculado=0))
+                db.session.commit()
+                resumen = recalcular_portafolio(procesos=procesos)
+                resumenes.append(resumen)
+                valores = precios()
+                if referencia is None:
+                    referencia = valores
+                elif valores != referencia:
+                    errores.append(f"con {procesos} procesos los PU difieren de los de {args.procesos[0]}")
+                aceleracion = resumenes[0]["segundos"] / resumen["segundos"] if resumen["segundos"] else 0
+                print(f"[{procesos} procesos] {resumen['segundos']:.2f} s, {resumen['detalles_por_segundo']:.0f} detalles/s, {aceleracion:.2f}x")
+            if args.min_aceleracion is not None and resumenes[-1]["segundos"] * args.min_aceleracion > resumenes[0]["segundos"]:
+                errores.append(f"{args.procesos[-1]} procesos no alcanzan {args.min_aceleracion}x sobre {args.procesos[0]}")
+            db.session.remove()
+
+    for error in errores:
+        print(f"REGRESIÓN: {error}")
+    return 1 if errores else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
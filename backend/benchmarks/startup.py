@@ -0,0 +1,101 @@
+"""
+Startup benchmark: measures the cold import time and RSS of `create_app()`
+in a fresh interpreter, so regressions in worker startup are caught early.
+
+- Each run spawns `python -X importtime` and creates the app with
+  `TestingConfig` (in-memory DB, no job workers).
+- Reports the median total import time, peak RSS and the slowest top-level
+  imports for both `precarga="core"` and `precarga="completa"`.
+- Fails (exit code 1) if the core app imports a deferred subsystem
+  (Gemini / ReportLab) or exceeds the limits below.
+
+Run from project root:
+> python -m backend.benchmarks.startup
+> python -m backend.benchmarks.startup --runs 5 --max-import-ms 800 --max-rss-mb 80
+
+"""
+import argparse
+import json
+import re
+import statistics
+import subprocess
+import sys
+
+# Limites para el modo core, con margen sobre lo medido en desarrollo
+LIMITE_IMPORT_MS = 1000
+LIMITE_RSS_MB = 90
+MODULOS_DIFERIDOS = ("google.generativeai", "reportlab.platypus", "reportlab.pdfgen")
+
+CODIGO_HIJO = """
+import json, resource, sys
+from backend.config import TestingConfig
+from backend.app import create_app
+create_app(TestingConfig, workers=0, precarga=sys.argv[1])
+rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+print(json.dumps({
+    "rss_mb": rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024,
+    "modulos": [m for m in %r if m in sys.modules],
+}))
+""" % (MODULOS_DIFERIDOS,)
+
+LINEA_IMPORTTIME = re.compile(r"import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)")
+
+
+def medir(precarga: str) -> dict:
+    proceso = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", CODIGO_HIJO, precarga],
+        capture_output=True, text=True,
+    )
+    if proceso.returncode != 0:
+        raise SystemExit(f"create_app(precarga={precarga!r}) falló:\n{proceso.stderr[-2000:]}")
+    # Solo los imports de primer nivel: su acumulado ya incluye a los anidados
+    primer_nivel = []
+    for linea in proceso.stderr.splitlines():
+        encontrado = LINEA_IMPORTTIME.match(linea)
+        if encontrado and len(encontrado.group(3)) == 1:
+            primer_nivel.append((int(encontrado.group(2)) / 1000, encontrado.group(4)))
+    datos = json.loads(proceso.stdout.strip().splitlines()[-1])
+    datos["import_ms"] = sum(ms for ms, _ in primer_nivel)
+    datos["mas_lentos"] = sorted(primer_nivel, reverse=True)[:8]
+    return datos
+
+
+def resumir(precarga: str, corridas: int) -> dict:
+    mediciones = [medir(precarga) for _ in range(corridas)]
+    return {
+        "precarga": precarga,
+        "import_ms": statistics.median(m["import_ms"] for m in mediciones),
+        "rss_mb": statistics.median(m["rss_mb"] for m in mediciones),
+        "modulos": mediciones[-1]["modulos"],
+        "mas_lentos": mediciones[-1]["mas_lentos"],
+    }
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--max-import-ms", type=float, default=LIMITE_IMPORT_MS)
+    parser.add_argument("--max-rss-mb", type=float, default=LIMITE_RSS_MB)
+    args = parser.parse_args(argv)
+
+    resultados = [resumir(precarga, args.runs) for precarga in ("core", "completa")]
+    for resultado in resultados:
+        print(f"[{resultado['precarga']}] import {resultado['import_ms']:.0f} ms, RSS {resultado['rss_mb']:.1f} MB")
+        for ms, modulo in resultado["mas_lentos"]:
+            print(f"    {ms:8.1f} ms  {modulo}")
+
+    core = resultados[0]
+    errores = []
+    if core["modulos"]:
+        errores.append(f"el modo core importó subsistemas diferidos: {', '.join(core['modulos'])}")
+    if core["import_ms"] > args.max_import_ms:
+        errores.append(f"import {core['import_ms']:.0f} ms > {args.max_import_ms:.0f} ms")
+    if core["rss_mb"] > args.max_rss_mb:
+        errores.append(f"RSS {core['rss_mb']:.1f} MB > {args.max_rss_mb:.1f} MB")
+    for error in errores:
+        print(f"REGRESIÓN: {error}")
+    return 1 if errores else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
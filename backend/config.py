@@ -17,11 +17,34 @@ class Config:
 
     GEMINI_API_KEY = os.environ.get("GEMINI_API_KEY")
     GEMINI_MODEL = os.environ.get("GEMINI_MODEL", "gemini-1.5-flash")
+    # "gemini" o "falso": modelo de ejemplo sin red para /ia/chat_apu/stream en pruebas y desarrollo
+    IA_MODELO_STREAMING = os.environ.get("IA_MODELO_STREAMING", "gemini")
     PRECIOS_OBSOLETOS_DIAS = int(os.environ.get("PRECIOS_OBSOLETOS_DIAS", "90"))
     ADMIN_USERNAME = os.environ.get("ADMIN_USERNAME", "admin")
     ADMIN_PASSWORD = os.environ.get("ADMIN_PASSWORD", "admin123")
+    PU_SESION_TTL_SEGUNDOS = int(os.environ.get("PU_SESION_TTL_SEGUNDOS", "1800"))
+    PU_SESIONES_MAXIMAS = int(os.environ.get("PU_SESIONES_MAXIMAS", "500"))
+    RESPUESTAS_CACHE_MAXIMAS = int(os.environ.get("RESPUESTAS_CACHE_MAXIMAS", "512"))
+    RESPUESTAS_CACHE_MAX_BYTES = int(os.environ.get("RESPUESTAS_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+    CONCILIACION_UMBRAL = float(os.environ.get("CONCILIACION_UMBRAL", "0.6"))
+    COMPARADOR_CELDAS_MAXIMAS = int(os.environ.get("COMPARADOR_CELDAS_MAXIMAS", "20000"))
+    # Tabla de costos de insumos en un archivo mapeado en memoria que comparten todos los workers
+    COSTOS_COMPARTIDOS = os.environ.get("COSTOS_COMPARTIDOS", "1") == "1"
+    COSTOS_MMAP_DIR = os.environ.get("COSTOS_MMAP_DIR", os.path.join(BASE_DIR, "costos_cache"))
+    # "core": IA y PDF se importan en su primer uso; "completa": se importan al crear la app (gunicorn --preload)
+    PRECARGA = os.environ.get("PRECARGA", "core")
+    # Hilos de la cola por proceso web; 0 por defecto para que cada worker de gunicorn (y cada create_app)
+    # no arranque los suyos. La cola la atiende `python -m backend.run worker`
+    JOB_WORKERS = int(os.environ.get("JOB_WORKERS", "0"))
+    JOB_POLL_SEGUNDOS = float(os.environ.get("JOB_POLL_SEGUNDOS", "2"))
+    JOB_LEASE_SEGUNDOS = int(os.environ.get("JOB_LEASE_SEGUNDOS", "900"))
+    JOB_BACKOFF_BASE_SEGUNDOS = int(os.environ.get("JOB_BACKOFF_BASE_SEGUNDOS", "5"))
+    JOB_BACKOFF_MAXIMO_SEGUNDOS = int(os.environ.get("JOB_BACKOFF_MAXIMO_SEGUNDOS", "600"))
+    JOBS_DIR = os.environ.get("JOBS_DIR", os.path.join(BASE_DIR, "jobs_output"))
 
 class TestingConfig(Config):
     TESTING = True
     SQLALCHEMY_DATABASE_URI = "sqlite:///:memory:"
     WTF_CSRF_ENABLED = False
+    JOB_WORKERS = 0
+    IA_MODELO_STREAMING = "falso"
@@ -0,0 +1,25 @@
+"""
+Migration script to create the `catalogo_cambios` table used by
+`/api/catalogos/snapshot?since=<version>` on an existing database.
+
+- `db.create_all()` only creates missing tables; existing data is untouched.
+- The change log starts empty: clients without a version (or with an unknown
+  one) receive the full snapshot, so no backfill is needed.
+
+Run from project root:
+> python -m backend.migrations.add_catalogo_cambios
+
+"""
+from backend.app import create_app, db
+from backend.app.models import CatalogoCambio
+
+
+def main():
+    app = create_app(workers=0)
+    with app.app_context():
+        db.create_all()
+        print(f"Table '{CatalogoCambio.__tablename__}' ready at {app.config['SQLALCHEMY_DATABASE_URI']}.")
+
+
+if __name__ == "__main__":
+    main()
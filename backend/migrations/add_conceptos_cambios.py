@@ -0,0 +1,30 @@
+"""
+Migration script to create the `conceptos_cambios` table (log of conceptos whose
+matrix changed) on an existing database.
+
+- `db.create_all()` only creates missing tables; existing data is untouched.
+- `cubo_partidas.version_conceptos` now stores the max id of that log instead of
+  the global "conceptos" counter, so the analytics cube is cleared and rebuilt
+  lazily on the next read of each project.
+
+Run from project root:
+> python -m backend.migrations.add_conceptos_cambios
+
+"""
+from sqlalchemy import delete
+from backend.app import create_app, db
+from backend.app.models import ConceptoCambio, CuboCosto, CuboPartida
+
+
+def main():
+    app = create_app(workers=0)
+    with app.app_context():
+        db.create_all()
+        db.session.execute(delete(CuboCosto))
+        db.session.execute(delete(CuboPartida))
+        db.session.commit()
+        print(f"Table '{ConceptoCambio.__tablename__}' ready and analytics cube cleared at {app.config['SQLALCHEMY_DATABASE_URI']}.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,25 @@
+"""
+Migration script to create the `cubo_costos` and `cubo_partidas` tables that
+back `/api/proyectos/<id>/analytics` on an existing database.
+
+- `db.create_all()` only creates missing tables; existing data is untouched.
+- No backfill is needed: each project's cube is built on its first analytics
+  read (or ahead of time with the `actualizar_cubos` job).
+
+Run from project root:
+> python -m backend.migrations.add_cubo_costos
+
+"""
+from backend.app import create_app, db
+from backend.app.models import CuboCosto, CuboPartida
+
+
+def main():
+    app = create_app(workers=0)
+    with app.app_context():
+        db.create_all()
+        print(f"Tables '{CuboCosto.__tablename__}' and '{CuboPartida.__tablename__}' ready at {app.config['SQLALCHEMY_DATABASE_URI']}.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,24 @@
+"""
+Migration script to create the `jobs` table used by the background job
+queue (`POST /api/jobs`, `python -m backend.run worker`) on an existing database.
+
+- `db.create_all()` only creates missing tables; existing data is untouched.
+- Workers are not started here (`workers=0`), the table may not exist yet.
+
+Run from project root:
+> python -m backend.migrations.add_jobs
+
+"""
+from backend.app import create_app, db
+from backend.app.models import Job
+
+
+def main():
+    app = create_app(workers=0)
+    with app.app_context():
+        db.create_all()
+        print(f"Table '{Job.__tablename__}' ready at {app.config['SQLALCHEMY_DATABASE_URI']}.")
+
+
+if __name__ == "__main__":
+    main()
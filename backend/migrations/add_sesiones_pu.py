@@ -0,0 +1,26 @@
+"""
+Migration script to create the `sesiones_pu` and `sesiones_pu_filas` tables on an existing database.
+
+- Incremental PU sessions (`/api/conceptos/calcular_pu/sesiones`) are stored
+  there so every worker can serve any PATCH of a session; `sesiones_pu` holds
+  factors and totals, `sesiones_pu_filas` one row per matrix line.
+- `db.create_all()` only creates missing tables; existing data is untouched.
+  Sessions are short-lived, so no backfill is needed.
+
+Run from project root:
+> python -m backend.migrations.add_sesiones_pu
+
+"""
+from backend.app import create_app, db
+from backend.app.models import SesionCalculoPU, SesionCalculoPUFila
+
+
+def main():
+    app = create_app(workers=0)
+    with app.app_context():
+        db.create_all()
+        print(f"Tables '{SesionCalculoPU.__tablename__}' and '{SesionCalculoPUFila.__tablename__}' ready at {app.config['SQLALCHEMY_DATABASE_URI']}.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,25 @@
+"""
+Migration script to create the `versiones_datos` table that backs the ETag
+cache of project, partida, detalle and dashboard reads on an existing database.
+
+- `db.create_all()` only creates missing tables; existing data is untouched.
+- Counters start empty (version 0) and are bumped on the next write, so no
+  backfill is needed.
+
+Run from project root:
+> python -m backend.migrations.add_versiones_datos
+
+"""
+from backend.app import create_app, db
+from backend.app.models import VersionDatos
+
+
+def main():
+    app = create_app(workers=0)
+    with app.app_context():
+        db.create_all()
+        print(f"Table '{VersionDatos.__tablename__}' ready at {app.config['SQLALCHEMY_DATABASE_URI']}.")
+
+
+if __name__ == "__main__":
+    main()
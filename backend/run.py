@@ -1,9 +1,14 @@
 from backend.app import create_app, db
 from backend.app.models import ConstantesFASAR
+from backend.app.services.job_service import iniciar_workers
+from backend.app.services.portafolio_service import recalcular_portafolio
 from backend.seed_data import seed_all_data
+import argparse
 import os
+import sys
 
-app = create_app()
+# Los workers se arrancan después de crear la base para que no consulten una tabla `jobs` inexistente
+app = create_app(workers=0)
 
 def init_db():
     with app.app_context():
@@ -18,5 +23,27 @@ if __name__ == "__main__":
         print(f"Database not found at '{db_path}'. Creating and initializing...")
         init_db()
 
+    if len(sys.argv) > 1 and sys.argv[1] == "worker":
+        # `python -m backend.run worker`: proceso dedicado a la cola de jobs, sin servidor HTTP
+        cantidad = app.config["JOB_WORKERS"] or 1
+        print(f"Job workers running ({cantidad})")
+        iniciar_workers(app, cantidad).esperar()
+        sys.exit(0)
+
+    if len(sys.argv) > 1 and sys.argv[1] == "recalcular_portafolio":
+        # `python -m backend.run recalcular_portafolio [--procesos N] [--proyecto ID ...]`
+        parser = argparse.ArgumentParser(prog="run.py recalcular_portafolio")
+        parser.add_argument("--procesos", type=int, default=None, help="procesos de cálculo (por defecto, núcleos disponibles)")
+        parser.add_argument("--proyecto", type=int, action="append", dest="proyectos", help="limita el recálculo a estos proyectos")
+        args = parser.parse_args(sys.argv[2:])
+        with app.app_context():
+            resumen = recalcular_portafolio(args.proyectos, args.procesos, progreso=lambda hechos, total, mensaje: print(mensaje, flush=True))
+        print(f"{resumen['detalles']} detalles de {resumen['proyectos']} proyectos en {resumen['segundos']} s ({resumen['detalles_por_segundo']}/s, {resumen['procesos']} procesos)")
+        for omitido in resumen["conceptos_omitidos"]:
+            print(f"Concepto {omitido['concepto_id']} sin recalcular ({omitido['detalles']} detalles): no existe el insumo {omitido['tipo_insumo']} {omitido['id_insumo']}")
+        sys.exit(0)
+
+    if app.config["JOB_WORKERS"] > 0:
+        iniciar_workers(app, app.config["JOB_WORKERS"])
     print("Backend server running at http://localhost:8000")
     app.run(host="0.0.0.0", port=8000)
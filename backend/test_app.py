@@ -3,7 +3,7 @@ from decimal import Decimal
 import json
 
 from backend.app import create_app, db
-from backend.app.models import Material, ManoObra
+from backend.app.models import Material, ManoObra, Concepto, MatrizInsumo, Proyecto, Partida, DetallePresupuesto
 
 @pytest.fixture
 def app():
@@ -47,3 +47,657 @@ def test_get_materiales(client):
     assert isinstance(data, list)
     assert len(data) > 0
     assert data[0]['nombre'] == 'Cemento'
+
+def test_reemplazar_matriz_aplica_diferencias(client):
+    """Prueba que el PUT de matriz inserte, actualice y elimine renglones en una sola llamada."""
+    material = Material.query.first()
+    mano_obra = ManoObra.query.first()
+    concepto = Concepto(clave="MUR-100", descripcion="Muro de prueba", unidad_concepto="m2")
+    db.session.add(concepto)
+    db.session.commit()
+    existente = MatrizInsumo(concepto_id=concepto.id, tipo_insumo="Material", id_insumo=material.id, cantidad=Decimal("1.0"))
+    sobrante = MatrizInsumo(concepto_id=concepto.id, tipo_insumo="Equipo", id_insumo=99, cantidad=Decimal("1.0"))
+    db.session.add_all([existente, sobrante])
+    db.session.commit()
+    payload = {
+        "matriz": [
+            {"id": existente.id, "tipo_insumo": "Material", "id_insumo": material.id, "cantidad": 2.0},
+            {"tipo_insumo": "ManoObra", "id_insumo": mano_obra.id, "cantidad": 0.5},
+        ]
+    }
+    response = client.put(f'/api/conceptos/{concepto.id}/matriz', data=json.dumps(payload), content_type='application/json')
+    assert response.status_code == 200
+    data = response.get_json()
+    assert (data['insertados'], data['actualizados'], data['eliminados']) == (1, 1, 1)
+    assert len(data['matriz']) == 2
+    assert data['precio_unitario'] > 0
+
+    payload["matriz"].append({"tipo_insumo": "Material", "id_insumo": 9999, "cantidad": 1.0})
+    response = client.put(f'/api/conceptos/{concepto.id}/matriz', json=payload)
+    assert response.status_code == 400 and "Material 9999" in response.get_json()['error']
+    assert MatrizInsumo.query.filter_by(concepto_id=concepto.id, id_insumo=9999).count() == 0
+
+def test_sesion_pu_incremental_coincide_con_calculo_completo(client):
+    """Prueba que los cambios por renglón de una sesión den el mismo PU que recalcular toda la matriz."""
+    from backend.app.services.pu_sesion_service import obtener_almacen
+    material = Material.query.first()
+    mano_obra = ManoObra.query.first()
+    factores = {"indirectos": {"activo": True, "porcentaje": 0.15}}
+    response = client.post('/api/conceptos/calcular_pu/sesiones', data=json.dumps({
+        "matriz": [{"clave": "a", "tipo_insumo": "Material", "id_insumo": material.id, "cantidad": 2.0}],
+        "factores": factores,
+    }), content_type='application/json')
+    assert response.status_code == 201
+    token = response.get_json()['token']
+    cambios = {"cambios": [
+        {"op": "update", "clave": "a", "fila": {"cantidad": 3.0}},
+        {"op": "add", "clave": "b", "fila": {"tipo_insumo": "ManoObra", "id_insumo": mano_obra.id, "cantidad": 0.5}},
+    ]}
+    response = client.patch(f'/api/conceptos/calcular_pu/sesiones/{token}', data=json.dumps(cambios), content_type='application/json')
+    assert response.status_code == 200
+    incremental = response.get_json()
+    assert [fila['clave'] for fila in incremental['filas']] == ['a', 'b']
+    completo = client.post('/api/conceptos/calcular_pu', data=json.dumps({
+        "matriz": [
+            {"tipo_insumo": "Material", "id_insumo": material.id, "cantidad": 3.0},
+            {"tipo_insumo": "ManoObra", "id_insumo": mano_obra.id, "cantidad": 0.5},
+        ],
+        "factores": factores,
+    }), content_type='application/json').get_json()
+    assert incremental['costo_directo'] == pytest.approx(completo['costo_directo'])
+    assert client.patch('/api/conceptos/calcular_pu/sesiones/desconocido', json={"cambios": []}).status_code == 404
+
+    # Otro worker no tiene la sesión en memoria: la lee de las tablas compartidas
+    almacen = obtener_almacen()
+    vieja = almacen._sesiones.pop(token)
+    response = client.patch(f'/api/conceptos/calcular_pu/sesiones/{token}', json={"cambios": [{"op": "remove", "clave": "b"}]})
+    assert response.status_code == 200
+    sin_mano_obra = response.get_json()['costo_directo']
+    assert sin_mano_obra < incremental['costo_directo']
+    # Una copia local desfasada choca con la versión guardada: se relee y el lote se aplica sobre la vigente
+    almacen._sesiones[token] = vieja
+    response = client.patch(f'/api/conceptos/calcular_pu/sesiones/{token}', json={"cambios": [{"op": "update", "clave": "a", "fila": {"cantidad": 3.0}}]})
+    assert response.status_code == 200
+    assert response.get_json()['costo_directo'] == pytest.approx(sin_mano_obra)
+    # Un insumo inexistente se rechaza solo; el resto del lote se aplica y la sesión sigue abierta
+    response = client.patch(f'/api/conceptos/calcular_pu/sesiones/{token}', json={"cambios": [
+        {"op": "add", "fila": {"tipo_insumo": "Material", "id_insumo": 99999, "cantidad": 1.0}},
+        {"op": "update", "clave": "a", "fila": {"cantidad": 6.0}},
+    ]})
+    assert response.status_code == 200
+    resultado = response.get_json()
+    assert [r['indice'] for r in resultado['rechazados']] == [0]
+    assert resultado['costo_directo'] == pytest.approx(sin_mano_obra * 2)
+    almacen._sesiones.clear()
+    assert client.patch(f'/api/conceptos/calcular_pu/sesiones/{token}', json={"cambios": []}).get_json()['costo_directo'] == pytest.approx(sin_mano_obra * 2)
+
+def test_catalogo_snapshot_delta(client):
+    """Prueba que el snapshot versionado devuelva solo los insumos cambiados o eliminados desde una versión."""
+    completo = client.get('/api/catalogos/snapshot').get_json()
+    assert completo['completo'] is True
+    assert completo['materiales']['nombre'] == ['Cemento']
+    assert 'obsoleto' not in completo['materiales'] and 'fecha_actualizacion' in completo['materiales']
+    assert completo['dias_obsoleto'] == client.application.config['PRECIOS_OBSOLETOS_DIAS']
+    version = completo['version']
+
+    arena = Material(nombre="Arena", unidad="m3", precio_unitario=Decimal("450.0"))
+    db.session.add(arena)
+    db.session.delete(Material.query.filter_by(nombre="Cemento").first())
+    db.session.commit()
+
+    delta = client.get(f'/api/catalogos/snapshot?since={version}').get_json()
+    assert delta['completo'] is False
+    assert delta['version'] > version
+    assert delta['materiales']['nombre'] == ['Arena']
+    assert len(delta['eliminados']['materiales']) == 1
+    assert delta['mano_obra'] == {}
+    assert client.get(f"/api/catalogos/snapshot?since={delta['version']}").get_json()['materiales'] == {}
+
+def test_job_recalcular_fasar_en_cola(client):
+    """Prueba que un job encolado por la API quede completado al procesarlo un worker."""
+    from backend.app.services.job_service import ejecutar_siguiente_job
+    respuesta = client.post('/api/jobs', json={"tipo": "recalcular_fasar"})
+    assert respuesta.status_code == 202
+    job_id = respuesta.get_json()['id']
+    assert respuesta.headers['Location'].endswith(f'/api/jobs/{job_id}')
+    assert client.post('/api/jobs', json={"tipo": "desconocido"}).status_code == 400
+    assert client.post('/api/jobs', json={"tipo": "recalcular_fasar", "max_intentos": "abc"}).status_code == 400
+    assert client.post('/api/jobs', json={"tipo": "recalcular_fasar", "max_intentos": 0}).status_code == 400
+
+    assert ejecutar_siguiente_job("test").id == job_id
+    assert ejecutar_siguiente_job("test") is None
+    estado = client.get(f'/api/jobs/{job_id}').get_json()
+    assert estado['estado'] == 'completado'
+    assert estado['resultado']['count'] == ManoObra.query.count()
+
+def test_lease_de_job_vivo_no_se_libera(client):
+    """Prueba que un job lento con lease renovado no vuelva a la cola, y uno sin latido sí."""
+    from datetime import datetime, timedelta
+    from backend.app.models import Job
+    from backend.app.services.job_service import encolar, liberar_jobs_abandonados, reclamar_siguiente, renovar_lease
+    encolar("recalcular_fasar", max_intentos="2")
+    job = reclamar_siguiente("worker-a")
+    assert job.max_intentos == 2
+    job.actualizado = datetime.utcnow() - timedelta(hours=1)
+    db.session.commit()
+    assert renovar_lease(job.id, "worker-b") is False
+    assert renovar_lease(job.id, "worker-a") is True
+    assert liberar_jobs_abandonados(60) == 0
+    job.actualizado = datetime.utcnow() - timedelta(hours=1)
+    db.session.commit()
+    assert liberar_jobs_abandonados(60) == 1
+    assert db.session.get(Job, job.id).estado == "pendiente"
+
+def test_job_cancelado_mientras_corre_no_termina_completado(client):
+    """Prueba que el resultado de un worker no pise un job que se liberó y canceló mientras corría."""
+    from sqlalchemy import update
+    from backend.app.models import Job
+    from backend.app.services.job_service import TAREAS, cancelar, ejecutar_job, encolar, reclamar_siguiente
+
+    def liberada_y_cancelada(payload, contexto):
+        # Lo que harían liberar_jobs_abandonados y un POST /cancelar desde otro proceso
+        db.session.execute(update(Job).where(Job.id == contexto.job_id).values(estado="pendiente", worker=None))
+        db.session.commit()
+        assert cancelar(db.session.get(Job, contexto.job_id)).estado == "cancelado"
+        return {"ok": True}
+
+    TAREAS["prueba_cancelada"] = liberada_y_cancelada
+    try:
+        encolar("prueba_cancelada")
+        job = ejecutar_job(reclamar_siguiente("worker-a"))
+    finally:
+        del TAREAS["prueba_cancelada"]
+    assert job.estado == "cancelado"
+    assert job.resultado is None
+
+    en_proceso = encolar("recalcular_fasar")
+    reclamar_siguiente("worker-a")
+    assert cancelar(en_proceso).estado == "en_proceso"
+    assert en_proceso.cancelacion_solicitada is True
+
+def test_servicios_ia_y_pdf_no_importan_dependencias_pesadas():
+    """Prueba que importar los servicios de IA y PDF no cargue Gemini ni ReportLab hasta su primer uso."""
+    import os
+    import subprocess
+    import sys
+    codigo = (
+        "import sys\n"
+        "import backend.app.services.ia_service, backend.app.services.pdf_service\n"
+        "print([m for m in ('google.generativeai', 'reportlab.platypus', 'reportlab.pdfgen') if m in sys.modules])\n"
+    )
+    raiz = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    salida = subprocess.run([sys.executable, "-c", codigo], capture_output=True, text=True, check=True, cwd=raiz)
+    assert salida.stdout.strip() == "[]"
+
+def test_comparador_evalua_rejilla_con_deltas(client):
+    """Prueba que el comparador calcule cada celda como calcular_pu y reporte diferencias contra la base."""
+    material = Material.query.first()
+    mano_obra = ManoObra.query.first()
+    arena = Material(nombre="Arena", unidad="m3", precio_unitario=Decimal("100.0"))
+    concepto = Concepto(clave="MUR-01", descripcion="Muro de block", unidad_concepto="m2")
+    db.session.add_all([arena, concepto])
+    db.session.flush()
+    db.session.add_all([
+        MatrizInsumo(concepto_id=concepto.id, tipo_insumo="Material", id_insumo=material.id, cantidad=Decimal("2")),
+        MatrizInsumo(concepto_id=concepto.id, tipo_insumo="ManoObra", id_insumo=mano_obra.id, cantidad=Decimal("0.5")),
+    ])
+    db.session.commit()
+
+    respuesta = client.post('/api/comparador', json={
+        "conceptos": [concepto.id],
+        "perfiles": [{"nombre": "Sin factores"}, {"nombre": "Utilidad", "factores": {"utilidad": {"activo": True, "porcentaje": 0.10}}}],
+        "escenarios": [
+            {"nombre": "Catálogo"},
+            {"nombre": "Cemento a 300", "precios": [{"tipo_insumo": "Material", "id_insumo": material.id, "costo_unitario": 300}]},
+            {"nombre": "Arena", "sustituciones": [{"tipo_insumo": "Material", "id_insumo": material.id, "por": {"tipo_insumo": "Material", "id_insumo": arena.id}}]},
+        ],
+    })
+    assert respuesta.status_code == 200
+    celdas = {(c['perfil'], c['escenario']): c for c in respuesta.get_json()['conceptos'][0]['celdas']}
+    assert len(celdas) == 6
+    esperado = client.post('/api/conceptos/calcular_pu', json={"matriz": [
+        {"tipo_insumo": "Material", "id_insumo": material.id, "cantidad": 2.0},
+        {"tipo_insumo": "ManoObra", "id_insumo": mano_obra.id, "cantidad": 0.5},
+    ]}).get_json()
+    assert celdas[(0, 0)]['precio_unitario'] == pytest.approx(esperado['precio_unitario'])
+    assert celdas[(0, 0)]['delta'] == 0
+    assert celdas[(1, 0)]['precio_unitario'] == pytest.approx(esperado['precio_unitario'] * 1.10)
+    con_precio = client.post('/api/conceptos/calcular_pu', json={"matriz": [
+        {"tipo_insumo": "Material", "id_insumo": material.id, "cantidad": 2.0, "precio_unitario_sugerido": 300},
+        {"tipo_insumo": "ManoObra", "id_insumo": mano_obra.id, "cantidad": 0.5},
+    ]}).get_json()
+    assert celdas[(0, 1)]['precio_unitario'] == pytest.approx(con_precio['precio_unitario'])
+    assert celdas[(0, 2)]['delta'] < 0
+    assert client.post('/api/comparador', json={"conceptos": []}).status_code == 400
+    # El límite de celdas es el de la app, no el de la clase Config
+    client.application.config['COMPARADOR_CELDAS_MAXIMAS'] = 5
+    excedida = client.post('/api/comparador', json={"conceptos": [concepto.id], "escenarios": [{"nombre": str(n)} for n in range(6)]})
+    assert excedida.status_code == 400 and 'máximo es 5' in excedida.get_json()['error']
+
+def test_comparador_sustituto_dentro_de_la_misma_matriz(client):
+    """Prueba que sustituir un insumo por otro que ya está en la matriz use la merma de catálogo del sustituto, sin importar el orden."""
+    block = Material(nombre="Block", unidad="pza", precio_unitario=Decimal("100"), porcentaje_merma=Decimal("0"), precio_flete_unitario=Decimal("0"))
+    tabique = Material(nombre="Tabique", unidad="pza", precio_unitario=Decimal("100"), porcentaje_merma=Decimal("0"), precio_flete_unitario=Decimal("0"))
+    concepto = Concepto(clave="MUR-02", descripcion="Muro mixto", unidad_concepto="m2")
+    db.session.add_all([block, tabique, concepto])
+    db.session.flush()
+    db.session.add_all([
+        MatrizInsumo(concepto_id=concepto.id, tipo_insumo="Material", id_insumo=insumo.id, cantidad=Decimal("1"), porcentaje_merma=Decimal("0.5"))
+        for insumo in (block, tabique)
+    ])
+    db.session.commit()
+    sustitucion = {"nombre": "Solo tabique", "sustituciones": [
+        {"tipo_insumo": "Material", "id_insumo": block.id, "por": {"tipo_insumo": "Material", "id_insumo": tabique.id}},
+    ]}
+    con_base = client.post('/api/comparador', json={"conceptos": [concepto.id], "escenarios": [{"nombre": "Catálogo"}, sustitucion]}).get_json()
+    solo = client.post('/api/comparador', json={"conceptos": [concepto.id], "escenarios": [sustitucion]}).get_json()
+    base, sustituido = con_base['conceptos'][0]['celdas']
+    assert base['costo_directo'] == pytest.approx(300)
+    assert sustituido['costo_directo'] == pytest.approx(250)
+    assert solo['conceptos'][0]['celdas'][0]['costo_directo'] == pytest.approx(250)
+
+def test_conciliar_sugerencias_con_catalogo(client):
+    """Prueba que la conciliación tolere acentos, mayúsculas y sinónimos de unidad, y reconstruya el índice al cambiar el catálogo."""
+    db.session.add(Material(nombre="Arena de río", unidad="m3", precio_unitario=Decimal("450.0")))
+    db.session.commit()
+    mano_obra = ManoObra.query.first()
+    respuesta = client.post('/api/catalogos/conciliar', json={"sugerencias": [
+        {"tipo_insumo": "Material", "nombre": "ARENA DE RIO", "unidad": "m³"},
+        {"tipo_insumo": "Mano de Obra", "nombre": "Oficial albanil", "unidad": "jornal"},
+        {"tipo_insumo": "ManoObra", "insumo_id": mano_obra.id, "nombre": "cualquiera"},
+        {"tipo_insumo": "Material", "nombre": "Varilla corrugada 3/8", "unidad": "kg"},
+    ], "top_k": 2})
+    assert respuesta.status_code == 200
+    arena, oficial, por_id, varilla = respuesta.get_json()['resultados']
+    assert arena['coincidencia']['nombre'] == "Arena de río" and arena['coincidencia']['confianza'] == 1.0
+    assert oficial['coincidencia']['id_insumo'] == mano_obra.id
+    assert por_id['coincidencia']['id_insumo'] == mano_obra.id
+    assert varilla['coincidencia'] is None
+
+    db.session.add(Material(nombre="Varilla corrugada 3/8\"", unidad="kg", precio_unitario=Decimal("25.0")))
+    db.session.commit()
+    varilla = client.post('/api/catalogos/conciliar', json={"sugerencias": [
+        {"tipo_insumo": "Material", "nombre": "Varilla corrugada 3/8", "unidad": "kg"},
+    ]}).get_json()['resultados'][0]
+    assert varilla['coincidencia']['nombre'] == "Varilla corrugada 3/8\""
+    for top_k in ("abc", 2.5, True, -1):
+        assert client.post('/api/catalogos/conciliar', json={"sugerencias": [], "top_k": top_k}).status_code == 400
+
+def test_dashboard_responde_etag_y_304_hasta_que_cambia_el_proyecto(client):
+    """Prueba que las lecturas de proyecto devuelvan 304 con el mismo ETag y se invaliden al escribir."""
+    material = Material.query.first()
+    concepto = Concepto(clave="LOS-01", descripcion="Losa", unidad_concepto="m2")
+    proyecto = Proyecto(nombre_proyecto="Torre A")
+    db.session.add_all([concepto, proyecto])
+    db.session.flush()
+    partida = Partida(proyecto_id=proyecto.id, nombre_partida="Estructura")
+    db.session.add_all([partida, MatrizInsumo(concepto_id=concepto.id, tipo_insumo="Material", id_insumo=material.id, cantidad=Decimal("1"))])
+    db.session.flush()
+    detalle = DetallePresupuesto(partida_id=partida.id, concepto_id=concepto.id, cantidad_obra=Decimal("10"), precio_unitario_calculado=Decimal("0"))
+    db.session.add(detalle)
+    db.session.commit()
+    url = f'/api/proyectos/{proyecto.id}/dashboard_data'
+
+    primera = client.get(url)
+    etag = primera.headers['ETag']
+    assert primera.status_code == 200 and primera.headers['X-Cache'] == 'MISS'
+    assert client.get(url, headers={"If-None-Match": etag}).status_code == 304
+    repetida = client.get(url)
+    assert repetida.headers['X-Cache'] == 'HIT' and repetida.get_data() == primera.get_data()
+
+    detalle.cantidad_obra = Decimal("20")
+    db.session.commit()
+    cambiada = client.get(url, headers={"If-None-Match": etag})
+    assert cambiada.status_code == 200 and cambiada.headers['ETag'] != etag
+
+    etag = cambiada.headers['ETag']
+    client.put(f'/api/conceptos/{concepto.id}/matriz', json=[{"tipo_insumo": "Material", "id_insumo": material.id, "cantidad": 3.0}])
+    assert client.get(url, headers={"If-None-Match": etag}).status_code == 200
+
+def test_escritura_incrementa_versiones_datos_y_etag_viejo_responde_200(client):
+    """Prueba que escribir un detalle incremente los ámbitos de su partida y proyecto, y que el ETag anterior ya no dé 304."""
+    from backend.app.models import VersionDatos
+
+    def version(clave):
+        registro = db.session.get(VersionDatos, clave)
+        return registro.version if registro else 0
+
+    concepto = Concepto(clave="MUR-01", descripcion="Muro", unidad_concepto="m2")
+    proyecto, otro = Proyecto(nombre_proyecto="Casa C"), Proyecto(nombre_proyecto="Casa D")
+    db.session.add_all([concepto, proyecto, otro])
+    db.session.flush()
+    partida = Partida(proyecto_id=proyecto.id, nombre_partida="Muros")
+    db.session.add(partida)
+    db.session.flush()
+    detalle = DetallePresupuesto(partida_id=partida.id, concepto_id=concepto.id, cantidad_obra=Decimal("5"), precio_unitario_calculado=Decimal("0"))
+    db.session.add(detalle)
+    db.session.commit()
+    url = f'/api/proyectos/{proyecto.id}/presupuesto'
+    etag = client.get(url).headers['ETag']
+    assert client.get(url, headers={"If-None-Match": etag}).status_code == 304
+
+    antes = {clave: version(clave) for clave in ("proyectos", f"proyecto:{proyecto.id}", f"partida:{partida.id}", f"proyecto:{otro.id}")}
+    detalle.cantidad_obra = Decimal("7")
+    db.session.commit()
+    assert version(f"proyecto:{proyecto.id}") == antes[f"proyecto:{proyecto.id}"] + 1
+    assert version(f"partida:{partida.id}") == antes[f"partida:{partida.id}"] + 1
+    assert version("proyectos") == antes["proyectos"] and version(f"proyecto:{otro.id}") == antes[f"proyecto:{otro.id}"]
+    vieja = client.get(url, headers={"If-None-Match": etag})
+    assert vieja.status_code == 200 and vieja.headers['ETag'] != etag
+
+def test_recalcular_portafolio_actualiza_todos_los_detalles(client):
+    """Prueba que el job de portafolio reescriba PU y costo directo igual que calcular_pu, proyecto por proyecto."""
+    from backend.app.services.calculation_service import calcular_precio_unitario
+    from backend.app.services.job_service import ejecutar_siguiente_job
+    material = Material.query.first()
+    mano_obra = ManoObra.query.first()
+    concepto = Concepto(clave="PIS-01", descripcion="Piso", unidad_concepto="m2")
+    proyectos = [Proyecto(nombre_proyecto="Casa A"), Proyecto(nombre_proyecto="Casa B")]
+    db.session.add_all([concepto, *proyectos])
+    db.session.flush()
+    db.session.add_all([
+        MatrizInsumo(concepto_id=concepto.id, tipo_insumo="Material", id_insumo=material.id, cantidad=Decimal("1.5")),
+        MatrizInsumo(concepto_id=concepto.id, tipo_insumo="ManoObra", id_insumo=mano_obra.id, cantidad=Decimal("0.2")),
+    ])
+    partidas = [Partida(proyecto_id=p.id, nombre_partida="Acabados") for p in proyectos]
+    db.session.add_all(partidas)
+    db.session.flush()
+    db.session.add_all([
+        DetallePresupuesto(partida_id=partida.id, concepto_id=concepto.id, cantidad_obra=Decimal("5"), precio_unitario_calculado=Decimal("0"))
+        for partida in partidas
+    ])
+    db.session.commit()
+
+    assert client.post('/api/jobs', json={"tipo": "recalcular_portafolio", "payload": {"procesos": 1}}).status_code == 202
+    job = ejecutar_siguiente_job("test")
+    assert job.estado == "completado"
+    assert job.resultado['detalles'] == 2 and job.resultado['proyectos'] == 2
+    esperado = calcular_precio_unitario(concepto_id=concepto.id)
+    for detalle in DetallePresupuesto.query.all():
+        assert float(detalle.precio_unitario_calculado) == pytest.approx(esperado['precio_unitario'])
+
+    # Un concepto con un insumo borrado se omite y se reporta; el resto del portafolio sí se recalcula
+    from backend.app.services.portafolio_service import recalcular_portafolio
+    roto = Concepto(clave="PIS-03", descripcion="Piso roto", unidad_concepto="m2")
+    db.session.add(roto)
+    db.session.flush()
+    db.session.add(MatrizInsumo(concepto_id=roto.id, tipo_insumo="Material", id_insumo=99999, cantidad=Decimal("1")))
+    db.session.add(DetallePresupuesto(partida_id=partidas[0].id, concepto_id=roto.id, cantidad_obra=Decimal("1"), precio_unitario_calculado=Decimal("7")))
+    material.precio_unitario = Decimal("400.0")
+    db.session.commit()
+    resumen = recalcular_portafolio(procesos=1)
+    assert resumen['detalles'] == 2 and resumen['detalles_omitidos'] == 1
+    assert resumen['conceptos_omitidos'] == [{"concepto_id": roto.id, "tipo_insumo": "Material", "id_insumo": 99999, "detalles": 1}]
+    assert float(DetallePresupuesto.query.filter_by(concepto_id=roto.id).one().precio_unitario_calculado) == 7.0
+    esperado = calcular_precio_unitario(concepto_id=concepto.id)
+    for detalle in DetallePresupuesto.query.filter_by(concepto_id=concepto.id):
+        assert float(detalle.precio_unitario_calculado) == pytest.approx(esperado['precio_unitario'])
+
+def test_recalcular_portafolio_con_pool_de_procesos(tmp_path):
+    """Prueba el camino con procesos: los hijos reciben la configuración de la app y una cancelación detiene el pool."""
+    import glob
+    from backend.app.services.job_service import JobCancelado
+    from backend.app.services.portafolio_service import recalcular_portafolio
+    from backend.config import TestingConfig
+
+    class ConfigArchivo(TestingConfig):
+        SQLALCHEMY_DATABASE_URI = f"sqlite:///{tmp_path / 'portafolio.db'}"
+        COSTOS_MMAP_DIR = str(tmp_path / "costos")
+
+    app = create_app(ConfigArchivo)
+    with app.app_context():
+        db.create_all()
+        material = Material(nombre="Cemento", unidad="saco", precio_unitario=Decimal("200.0"), porcentaje_merma=Decimal("0"), precio_flete_unitario=Decimal("0"))
+        concepto = Concepto(clave="PIS-02", descripcion="Firme", unidad_concepto="m2")
+        proyectos = [Proyecto(nombre_proyecto=f"Casa {n}") for n in range(4)]
+        db.session.add_all([material, concepto, *proyectos])
+        db.session.flush()
+        db.session.add(MatrizInsumo(concepto_id=concepto.id, tipo_insumo="Material", id_insumo=material.id, cantidad=Decimal("2")))
+        partidas = [Partida(proyecto_id=p.id, nombre_partida="Firmes") for p in proyectos]
+        db.session.add_all(partidas)
+        db.session.flush()
+        db.session.add_all([
+            DetallePresupuesto(partida_id=partida.id, concepto_id=concepto.id, cantidad_obra=Decimal("1"), precio_unitario_calculado=Decimal("0"))
+            for partida in partidas
+        ])
+        db.session.commit()
+
+        resumen = recalcular_portafolio(procesos=2)
+        assert resumen['procesos'] == 2 and resumen['detalles'] == 4
+        assert [float(d.precio_unitario_calculado) for d in DetallePresupuesto.query] == pytest.approx([400.0] * 4)
+        # Los hijos construyeron la tabla de costos en el COSTOS_MMAP_DIR de esta app, no en el de Config
+        assert glob.glob(str(tmp_path / "costos" / "costos_insumos_*.bin"))
+
+        def cancelar(hechos, total, mensaje):
+            raise JobCancelado()
+        with pytest.raises(JobCancelado):
+            recalcular_portafolio(procesos=2, progreso=cancelar)
+        db.session.remove()
+        db.drop_all()
+
+def test_tabla_costos_mapeada_da_los_mismos_costos_que_la_base(client, tmp_path):
+    """Prueba que la tabla de costos en mmap reproduzca obtener_costo_insumo y se desactive con bases en memoria."""
+    from backend.app.services.calculation_service import obtener_costo_insumo
+    from backend.app.services.tabla_costos_service import TablaCostos, construir_tabla_costos, obtener_tabla_costos
+    material = Material.query.first()
+    material.porcentaje_merma = Decimal("0.05")
+    material.precio_flete_unitario = Decimal("3.5")
+    mano_obra = ManoObra.query.first()
+    db.session.commit()
+    material.precio_unitario = Decimal("1234567.8901")
+    db.session.commit()
+    ruta = str(tmp_path / "costos.bin")
+    with db.engine.connect() as conexion:
+        construir_tabla_costos(ruta, 7, conexion)
+    tabla = TablaCostos(ruta)
+    assert tabla.version == 7
+    registros = [
+        {"tipo_insumo": "Material", "id_insumo": material.id},
+        {"tipo_insumo": "Material", "id_insumo": material.id, "porcentaje_merma": 0.1, "precio_flete_unitario": 0},
+        {"tipo_insumo": "ManoObra", "id_insumo": mano_obra.id},
+    ]
+    # Los importes salen de la tabla como el mismo Decimal que da el ORM, sin pasar por float
+    for registro in registros:
+        assert obtener_costo_insumo(registro, tabla.caches()) == obtener_costo_insumo(registro, ({}, {}, {}, {}))
+    assert tabla.caches()[0][material.id].precio_unitario == Decimal("1234567.8901")
+    assert tabla.vistas["Material"].costo_efectivo(material.id) == Decimal("1234567.8901") * Decimal("1.05") + Decimal("3.5")
+    assert material.id + 1000 not in tabla.caches()[0]
+    assert obtener_tabla_costos() is None
+
+def test_tabla_costos_solo_se_construye_con_datos_confirmados(tmp_path):
+    """Prueba que con cambios de catálogo sin confirmar no se publique una tabla y que tras el rollback se construya con lo confirmado."""
+    from backend.app.services.calculation_service import obtener_costo_insumo
+    from backend.app.services.tabla_costos_service import TablaCostos, _ruta_tabla, caches_insumos, obtener_tabla_costos
+    from backend.config import TestingConfig
+
+    class ConfigArchivo(TestingConfig):
+        SQLALCHEMY_DATABASE_URI = f"sqlite:///{tmp_path / 'costos.db'}"
+        COSTOS_MMAP_DIR = str(tmp_path / "costos")
+
+    app = create_app(ConfigArchivo)
+    with app.app_context():
+        db.create_all()
+        material = Material(nombre="Cemento", unidad="saco", precio_unitario=Decimal("200.10"), porcentaje_merma=Decimal("0"), precio_flete_unitario=Decimal("0"))
+        db.session.add(material)
+        db.session.commit()
+        version = obtener_tabla_costos().version
+        registro = {"tipo_insumo": "Material", "id_insumo": material.id}
+
+        material.precio_unitario = Decimal("999.99")
+        db.session.flush()
+        # La sesión ve su cambio sin confirmar: se calcula con el ORM y no se publica esa versión
+        assert obtener_tabla_costos() is None
+        assert obtener_costo_insumo(registro, caches_insumos()) == Decimal("999.99")
+        assert TablaCostos(_ruta_tabla()).version == version
+        db.session.rollback()
+
+        material.precio_unitario = Decimal("215.35")
+        db.session.commit()
+        tabla = obtener_tabla_costos()
+        assert tabla.version > version
+        assert obtener_costo_insumo(registro, tabla.caches()) == Decimal("215.35")
+        db.session.remove()
+        db.drop_all()
+
+def test_analytics_del_cubo_agrupa_y_se_refresca_solo_lo_obsoleto(client):
+    """Prueba roll-up y drill-down del cubo, y que un cambio de precio o de matriz solo recalcule las partidas que lo usan."""
+    from backend.app.services.cubo_service import actualizar_cubo
+    material = Material.query.first()
+    material.disciplina, material.calidad = "Obra civil", "Estándar"
+    material.porcentaje_merma, material.precio_flete_unitario = Decimal("0"), Decimal("0")
+    mano_obra = ManoObra.query.first()
+    muro = Concepto(clave="MUR-01", descripcion="Muro", unidad_concepto="m2")
+    pintura = Concepto(clave="PIN-01", descripcion="Pintura", unidad_concepto="m2")
+    proyecto = Proyecto(nombre_proyecto="Bodega")
+    db.session.add_all([muro, pintura, proyecto])
+    db.session.flush()
+    albanileria = Partida(proyecto_id=proyecto.id, nombre_partida="Albañilería")
+    acabados = Partida(proyecto_id=proyecto.id, nombre_partida="Acabados")
+    db.session.add_all([
+        albanileria, acabados,
+        MatrizInsumo(concepto_id=muro.id, tipo_insumo="Material", id_insumo=material.id, cantidad=Decimal("2")),
+        MatrizInsumo(concepto_id=muro.id, tipo_insumo="ManoObra", id_insumo=mano_obra.id, cantidad=Decimal("0.1")),
+        MatrizInsumo(concepto_id=pintura.id, tipo_insumo="ManoObra", id_insumo=mano_obra.id, cantidad=Decimal("0.05")),
+    ])
+    db.session.flush()
+    db.session.add_all([
+        DetallePresupuesto(partida_id=albanileria.id, concepto_id=muro.id, cantidad_obra=Decimal("10"), precio_unitario_calculado=Decimal("0")),
+        DetallePresupuesto(partida_id=acabados.id, concepto_id=pintura.id, cantidad_obra=Decimal("20"), precio_unitario_calculado=Decimal("0")),
+    ])
+    db.session.commit()
+    url = f'/api/proyectos/{proyecto.id}/analytics'
+
+    por_tipo = client.get(url, query_string={"agrupar": "partida,tipo_insumo"}).get_json()
+    assert por_tipo['celdas_totales'] == 3
+    material_albanileria = next(c for c in por_tipo['celdas'] if c['tipo_insumo'] == "Material")
+    assert material_albanileria['partida'] == "Albañilería" and material_albanileria['importe'] == pytest.approx(10 * 2 * 200.0)
+    assert sum(c['porcentaje'] for c in por_tipo['celdas']) == pytest.approx(100)
+    insumos = client.get(url, query_string={"agrupar": "insumo", "disciplina": "Obra civil"}).get_json()['celdas']
+    assert [(c['id_insumo'], c['cantidad']) for c in insumos] == [(material.id, 20.0)]
+    assert client.get(url, query_string={"agrupar": "color"}).status_code == 400
+    assert len(client.get(url, query_string={"agrupar": "partida,tipo_insumo", "limite": 2}).get_json()['celdas']) == 2
+    for limite in (0, -1, "abc"):
+        assert client.get(url, query_string={"limite": limite}).status_code == 400
+
+    material.precio_unitario = Decimal("250.0")
+    db.session.commit()
+    assert actualizar_cubo(proyecto.id) == {"recalculadas": 1, "vigentes": 1, "eliminadas": 0}
+    total = client.get(url, query_string={"agrupar": "tipo_insumo", "tipo_insumo": "Material"}).get_json()['total']
+    assert total == pytest.approx(10 * 2 * 250.0)
+    assert actualizar_cubo(proyecto.id)["recalculadas"] == 0
+
+    # Editar la matriz de un concepto solo recalcula las partidas que lo usan
+    MatrizInsumo.query.filter_by(concepto_id=pintura.id).one().cantidad = Decimal("0.08")
+    db.session.commit()
+    assert actualizar_cubo(proyecto.id) == {"recalculadas": 1, "vigentes": 1, "eliminadas": 0}
+    otro = Concepto(clave="LOS-09", descripcion="Losa sin usar", unidad_concepto="m2")
+    db.session.add(otro)
+    db.session.commit()
+    assert client.put(f'/api/conceptos/{otro.id}/matriz', json=[{"tipo_insumo": "Material", "id_insumo": material.id, "cantidad": 1}]).status_code == 200
+    assert actualizar_cubo(proyecto.id)["recalculadas"] == 0
+
+def test_presupuesto_completo_en_tres_consultas_y_en_stream(client):
+    """Prueba que el árbol del presupuesto salga en tres consultas, con subtotales, y que el modo stream emita lo mismo."""
+    from sqlalchemy import event
+    from backend.app.services.presupuesto_service import obtener_presupuesto
+    muro = Concepto(clave="MUR-02", descripcion="Muro", unidad_concepto="m2")
+    proyecto = Proyecto(nombre_proyecto="Escuela")
+    db.session.add_all([muro, proyecto])
+    db.session.flush()
+    partidas = [Partida(proyecto_id=proyecto.id, nombre_partida=nombre) for nombre in ("Cimentación", "Instalaciones", "Muros")]
+    db.session.add_all(partidas)
+    db.session.flush()
+    db.session.add_all([
+        DetallePresupuesto(partida_id=partidas[0].id, concepto_id=muro.id, cantidad_obra=Decimal("2"), precio_unitario_calculado=Decimal("100"), costo_directo=Decimal("80")),
+        DetallePresupuesto(partida_id=partidas[0].id, concepto_id=muro.id, cantidad_obra=Decimal("1"), precio_unitario_calculado=Decimal("50"), costo_directo=Decimal("40")),
+        DetallePresupuesto(partida_id=partidas[2].id, concepto_id=muro.id, cantidad_obra=Decimal("3"), precio_unitario_calculado=Decimal("10"), costo_directo=Decimal("8")),
+    ])
+    db.session.commit()
+    proyecto_id = proyecto.id
+    db.session.expunge_all()
+
+    consultas = []
+    escuchar = lambda *args: consultas.append(args[2])
+    event.listen(db.engine, "before_cursor_execute", escuchar)
+    try:
+        arbol = obtener_presupuesto(proyecto_id)
+    finally:
+        event.remove(db.engine, "before_cursor_execute", escuchar)
+    assert len(consultas) == 3
+    assert [p['nombre_partida'] for p in arbol['partidas']] == ["Cimentación", "Instalaciones", "Muros"]
+    assert arbol['partidas'][0]['subtotales'] == {"detalles": 2, "costo_directo": 200.0, "importe": 250.0}
+    assert arbol['partidas'][1]['detalles'] == []
+    assert arbol['partidas'][2]['detalles'][0]['concepto_detalle'] == {"clave": "MUR-02", "descripcion": "Muro", "unidad_concepto": "m2"}
+    assert arbol['totales'] == {"detalles": 3, "costo_directo": 224.0, "importe": 280.0}
+
+    respuesta = client.get(f'/api/proyectos/{proyecto_id}/presupuesto')
+    assert respuesta.status_code == 200 and respuesta.get_json() == arbol
+    lineas = [json.loads(linea) for linea in client.get(f'/api/proyectos/{proyecto_id}/presupuesto?stream=1').get_data(as_text=True).splitlines()]
+    assert [l['tipo'] for l in lineas] == ["proyecto", "partida", "partida", "partida", "totales"]
+    assert [l['partida'] for l in lineas[1:4]] == arbol['partidas'] and lineas[-1]['totales'] == arbol['totales']
+    assert client.get('/api/proyectos/9999/presupuesto?stream=1').status_code == 404
+
+def test_chat_apu_stream_emite_insumos_conciliados_conforme_llegan(client):
+    """Prueba el parser incremental (llaves y comillas dentro de cadenas) y los eventos SSE con el modelo falso."""
+    from backend.app.services.ia_stream_service import ModeloFalsoStreaming, ParserInsumosIncremental
+    respuesta = {"explicacion": "Usa \"comillas\" y {llaves}", "insumos": [
+        {"tipo_insumo": "Material", "nombre": "Tubo 1/2\" {PVC}", "cantidad": 1},
+        {"tipo_insumo": "Material", "nombre": "Pegamento", "cantidad": 0.1, "extra": {"lista": [1, 2]}},
+    ]}
+    parser = ParserInsumosIncremental()
+    fragmentos = list(ModeloFalsoStreaming(respuesta, tamano_fragmento=7).generate_content("", stream=True))
+    por_fragmento = [parser.alimentar(f.text) for f in fragmentos]
+    emitidos = [insumo for lote in por_fragmento for insumo in lote]
+    assert emitidos == respuesta['insumos']
+    assert next(i for i, lote in enumerate(por_fragmento) if lote) < len(fragmentos) - 3
+    assert parser.documento() == respuesta
+
+    respuesta = client.post('/api/ia/chat_apu/stream', json={"descripcion": "Muro de block de 15 cm", "unidad": "m2"})
+    assert respuesta.status_code == 200 and respuesta.mimetype == "text/event-stream"
+    eventos = []
+    for bloque in respuesta.get_data(as_text=True).strip().split("\n\n"):
+        nombre, datos = bloque.split("\n")
+        eventos.append((nombre.removeprefix("event: "), json.loads(datos.removeprefix("data: "))))
+    insumos = {datos['insumo']['nombre']: datos['insumo'] for nombre, datos in eventos if nombre == "insumo"}
+    assert len(insumos) == 5 and eventos[-1][0] == "fin" and eventos[-1][1]['total_insumos'] == 5
+    assert insumos['Cemento']['id_insumo'] == Material.query.first().id and insumos['Cemento']['costo_unitario'] > 0
+    assert insumos['Oficial albañil']['tipo_insumo'] == "ManoObra" and insumos['Oficial albañil']['existe_en_catalogo']
+    assert insumos['Block hueco 15x20x40']['existe_en_catalogo'] is False
+    assert client.post('/api/ia/chat_apu/stream', json={}).status_code == 400
+
+def test_chat_apu_stream_lee_el_indice_una_vez_y_tolera_insumos_borrados(client, monkeypatch):
+    """Prueba que el stream consulte la versión del catálogo una sola vez y que un insumo borrado no corte el stream."""
+    import backend.app.services.conciliacion_service as conciliacion
+    from backend.app.services.ia_stream_service import _conciliar
+    lecturas = []
+    version_original = conciliacion.version_catalogo
+    monkeypatch.setattr(conciliacion, "version_catalogo", lambda: lecturas.append(1) or version_original())
+    cuerpo = client.post('/api/ia/chat_apu/stream', json={"descripcion": "Muro de block", "unidad": "m2"}).get_data(as_text=True)
+    assert cuerpo.count("event: insumo") == 5 and "event: fin" in cuerpo
+    assert len(lecturas) == 1
+
+    indice = conciliacion.obtener_indice()
+    cemento = Material.query.filter_by(nombre="Cemento").one()
+    db.session.delete(cemento)
+    db.session.commit()
+    conciliado = _conciliar({"tipo_insumo": "Material", "nombre": "Cemento", "unidad": "saco"}, indice, ({}, {}, {}, {}))
+    assert conciliado['existe_en_catalogo'] is False and conciliado['insumo_id'] is None
+
+def test_chat_apu_stream_separa_errores_de_la_ia_de_los_de_la_base(client, monkeypatch):
+    """Prueba que un fallo de Gemini a mitad del stream se reporte en `fin` y uno de la base no se disfrace de error de la IA."""
+    import backend.app.services.ia_stream_service as ia_stream
+    from sqlalchemy.exc import OperationalError
+
+    class ModeloQueFalla:
+        def generate_content(self, prompt, stream=False):
+            yield ia_stream._Fragmento('{"insumos": [')
+            raise RuntimeError("cuota agotada")
+
+    cuerpo = "".join(ia_stream.stream_chat_apu("Muro de block", "m2", modelo=ModeloQueFalla()))
+    assert '"error": "cuota agotada"' in cuerpo and "event: fin" in cuerpo
+
+    def conciliar_roto(insumo, indice, caches):
+        raise OperationalError("SELECT", {}, Exception("database is locked"))
+    monkeypatch.setattr(ia_stream, "_conciliar", conciliar_roto)
+    with pytest.raises(OperationalError):
+        "".join(ia_stream.stream_chat_apu("Muro de block", "m2", modelo=ia_stream.ModeloFalsoStreaming()))
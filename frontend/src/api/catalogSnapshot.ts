@@ -0,0 +1,88 @@
+import { apiFetch } from "./client";
+
+type Columnar = Record<string, unknown[]>;
+type CatalogKey = "materiales" | "mano_obra" | "equipos" | "maquinaria";
+
+type SnapshotResponse = {
+    version: number;
+    completo: boolean;
+    dias_obsoleto: number;
+    eliminados: Partial<Record<CatalogKey, number[]>>;
+} & Record<CatalogKey, Columnar>;
+
+type CatalogRecord = { id: number } & Record<string, unknown>;
+
+export type CatalogSnapshot = {
+    version: number;
+    diasObsoleto: number;
+} & Record<CatalogKey, Record<number, CatalogRecord>>;
+
+const STORAGE_KEY = "catalogos_snapshot_v2";
+const DIAS_OBSOLETO_DEFAULT = 90;
+const CATALOG_KEYS: CatalogKey[] = ["materiales", "mano_obra", "equipos", "maquinaria"];
+
+let cache: CatalogSnapshot | null = null;
+
+function emptySnapshot(): CatalogSnapshot {
+    return { version: 0, diasObsoleto: DIAS_OBSOLETO_DEFAULT, materiales: {}, mano_obra: {}, equipos: {}, maquinaria: {} };
+}
+
+function readStored(): CatalogSnapshot | null {
+    try {
+        const raw = localStorage.getItem(STORAGE_KEY);
+        return raw ? (JSON.parse(raw) as CatalogSnapshot) : null;
+    } catch {
+        return null;
+    }
+}
+
+function rowsFromColumns(columns: Columnar): CatalogRecord[] {
+    const ids = (columns.id ?? []) as number[];
+    const names = Object.keys(columns);
+    return ids.map((_, idx) => Object.fromEntries(names.map((name) => [name, columns[name][idx]])) as CatalogRecord);
+}
+
+/**
+ * Indica si un precio rebasa `diasObsoleto` dias sin actualizar. El snapshot no trae `obsoleto`
+ * porque cambia con la fecha de hoy y un delta no lo reenviaria.
+ */
+export function esPrecioObsoleto(fechaActualizacion: unknown, diasObsoleto: number): boolean {
+    if (typeof fechaActualizacion !== "string" || !fechaActualizacion) return false;
+    const fecha = Date.parse(`${fechaActualizacion.slice(0, 10)}T00:00:00Z`);
+    if (Number.isNaN(fecha)) return false;
+    const hoy = new Date();
+    const dias = Math.floor((Date.UTC(hoy.getFullYear(), hoy.getMonth(), hoy.getDate()) - fecha) / 86_400_000);
+    return dias > diasObsoleto;
+}
+
+/**
+ * Devuelve los catalogos de insumos sincronizados con el backend.
+ * Solo descarga los cambios posteriores a la version guardada en memoria / localStorage.
+ */
+export async function syncCatalogSnapshot(): Promise<CatalogSnapshot> {
+    const previous = cache ?? readStored();
+    const since = previous?.version ?? 0;
+    const response = await apiFetch<SnapshotResponse>(`/catalogos/snapshot`, { params: since ? { since } : {} });
+
+    const next: CatalogSnapshot = response.completo || !previous ? emptySnapshot() : { ...previous };
+    next.version = response.version;
+    next.diasObsoleto = response.dias_obsoleto ?? DIAS_OBSOLETO_DEFAULT;
+    for (const key of CATALOG_KEYS) {
+        const merged = { ...next[key] };
+        for (const row of rowsFromColumns(response[key] ?? {})) {
+            merged[row.id] = row;
+        }
+        for (const id of response.eliminados?.[key] ?? []) {
+            delete merged[id];
+        }
+        next[key] = merged;
+    }
+
+    cache = next;
+    try {
+        localStorage.setItem(STORAGE_KEY, JSON.stringify(next));
+    } catch {
+        // Sin espacio en localStorage: se conserva solo la copia en memoria.
+    }
+    return next;
+}
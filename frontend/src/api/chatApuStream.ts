@@ -0,0 +1,60 @@
+import { API_BASE_URL } from "./client";
+
+export type ChatApuFin = {
+    explicacion: string;
+    cantidad_obra_detectada: number | null;
+    unidad_obra_detectada: string | null;
+    tipo_documento: string | null;
+    total_insumos: number;
+    error: string | null;
+};
+
+type Handlers<TInsumo> = {
+    onInsumo: (insumo: TInsumo, indice: number) => void;
+    onFin?: (fin: ChatApuFin) => void;
+};
+
+/**
+ * Llama a /ia/chat_apu/stream y entrega cada insumo (ya conciliado con el catalogo) en cuanto
+ * llega. Es un POST, asi que se lee el cuerpo con fetch en lugar de EventSource.
+ */
+export async function streamChatApu<TInsumo>(
+    body: { descripcion: string; unidad: string; concepto_id?: number | null },
+    { onInsumo, onFin }: Handlers<TInsumo>
+): Promise<void> {
+    const response = await fetch(`${API_BASE_URL}/ia/chat_apu/stream`, {
+        method: "POST",
+        credentials: "include",
+        headers: { "Content-Type": "application/json", Accept: "text/event-stream" },
+        body: JSON.stringify(body),
+    });
+    if (!response.ok || !response.body) {
+        throw new Error(`chat_apu/stream respondio ${response.status}`);
+    }
+    const reader = response.body.pipeThrough(new TextDecoderStream()).getReader();
+    let buffer = "";
+    for (;;) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        buffer += value;
+        let fin = buffer.indexOf("\n\n");
+        while (fin >= 0) {
+            despachar(buffer.slice(0, fin), onInsumo, onFin);
+            buffer = buffer.slice(fin + 2);
+            fin = buffer.indexOf("\n\n");
+        }
+    }
+}
+
+function despachar<TInsumo>(bloque: string, onInsumo: Handlers<TInsumo>["onInsumo"], onFin: Handlers<TInsumo>["onFin"]) {
+    let evento = "message";
+    let datos = "";
+    for (const linea of bloque.split("\n")) {
+        if (linea.startsWith("event: ")) evento = linea.slice(7);
+        else if (linea.startsWith("data: ")) datos += linea.slice(6);
+    }
+    if (!datos) return;
+    const payload = JSON.parse(datos);
+    if (evento === "insumo") onInsumo(payload.insumo as TInsumo, payload.indice);
+    else if (evento === "fin") onFin?.(payload as ChatApuFin);
+}
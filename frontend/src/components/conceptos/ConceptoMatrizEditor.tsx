@@ -1,5 +1,6 @@
 ﻿import { useEffect, useMemo, useState, type FormEvent } from "react";
 import { apiFetch } from "../../api/client";
+import { esPrecioObsoleto, syncCatalogSnapshot } from "../../api/catalogSnapshot";
 
 export type MatrizRow = {
     id?: number;
@@ -25,7 +26,6 @@ type MaterialDTO = {
     disciplina?: string;
     calidad?: string;
     fecha_actualizacion?: string;
-    obsoleto?: boolean;
 };
 type ManoObraDTO = {
     id: number;
@@ -36,7 +36,6 @@ type ManoObraDTO = {
     disciplina?: string;
     calidad?: string;
     fecha_actualizacion?: string;
-    obsoleto?: boolean;
 };
 type EquipoDTO = {
     id: number;
@@ -46,7 +45,6 @@ type EquipoDTO = {
     disciplina?: string;
     calidad?: string;
     fecha_actualizacion?: string;
-    obsoleto?: boolean;
 };
 type MaquinariaDTO = {
     id: number;
@@ -56,7 +54,6 @@ type MaquinariaDTO = {
     disciplina?: string;
     calidad?: string;
     fecha_actualizacion?: string;
-    obsoleto?: boolean;
 };
 
 type CatalogData = {
@@ -64,6 +61,7 @@ type CatalogData = {
     manoObra: Record<number, ManoObraDTO>;
     equipos: Record<number, EquipoDTO>;
     maquinaria: Record<number, MaquinariaDTO>;
+    diasObsoleto: number;
 };
 
 type ConceptoResumen = {
@@ -200,17 +198,13 @@ export function ConceptoMatrizEditor({
     }
 
     async function loadCatalogos() {
-        const [materiales, manoObra, equipos, maquinaria] = await Promise.all([
-            apiFetch<MaterialDTO[]>(`/materiales`),
-            apiFetch<ManoObraDTO[]>(`/manoobra`),
-            apiFetch<EquipoDTO[]>(`/equipo`),
-            apiFetch<MaquinariaDTO[]>(`/maquinaria`),
-        ]);
+        const snapshot = await syncCatalogSnapshot();
         setCatalogos({
-            materiales: Object.fromEntries(materiales.map((item) => [item.id, item])),
-            manoObra: Object.fromEntries(manoObra.map((item) => [item.id, item])),
-            equipos: Object.fromEntries(equipos.map((item) => [item.id, item])),
-            maquinaria: Object.fromEntries(maquinaria.map((item) => [item.id, item])),
+            materiales: snapshot.materiales as unknown as Record<number, MaterialDTO>,
+            manoObra: snapshot.mano_obra as unknown as Record<number, ManoObraDTO>,
+            equipos: snapshot.equipos as unknown as Record<number, EquipoDTO>,
+            maquinaria: snapshot.maquinaria as unknown as Record<number, MaquinariaDTO>,
+            diasObsoleto: snapshot.diasObsoleto,
         });
     }
 
@@ -284,16 +278,19 @@ export function ConceptoMatrizEditor({
         if (!conceptoId) {
             return;
         }
-        const payloadRows = rows.map((row) => ({ ...row }));
-        const existentes = await apiFetch<MatrizRow[]>(`/conceptos/${conceptoId}/matriz`);
-        const idsActuales = new Set(payloadRows.filter((row) => row.id).map((row) => row.id as number));
-        const eliminaciones = existentes.filter((registro) => !idsActuales.has(registro.id as number));
-        for (const registro of eliminaciones) {
-            await apiFetch(`/matriz/${registro.id}`, { method: "DELETE" });
-        }
-        for (const row of payloadRows) {
-            await persistRow(row);
+        const matrizPayload = rows
+            .filter((row) => row.id_insumo !== "")
+            .map((row) => ({ id: row.id, ...buildRowPayload(row, conceptoId) }));
+        const body: Record<string, unknown> = { matriz: matrizPayload };
+        const factoresPayload = mapFactoresParaApi(factoresSobrecosto);
+        if (factoresPayload) {
+            body.factores = factoresPayload;
         }
+        const data = await apiFetch<PuResponse>(`/conceptos/${conceptoId}/matriz`, {
+            method: "PUT",
+            body,
+        });
+        setPuResumen({ costo_directo: data.costo_directo, precio_unitario: data.precio_unitario });
         await loadMatriz();
     }
 
@@ -694,18 +691,24 @@ export function ConceptoMatrizEditor({
         if (row.existe_en_catalogo === false) return false;
         if (!catalogos || !row.id_insumo) return false;
         const id = Number(row.id_insumo);
+        let registro: { fecha_actualizacion?: string } | undefined;
         switch (row.tipo_insumo) {
             case "Material":
-                return catalogos.materiales[id]?.obsoleto ?? false;
+                registro = catalogos.materiales[id];
+                break;
             case "ManoObra":
-                return catalogos.manoObra[id]?.obsoleto ?? false;
+                registro = catalogos.manoObra[id];
+                break;
             case "Equipo":
-                return catalogos.equipos[id]?.obsoleto ?? false;
+                registro = catalogos.equipos[id];
+                break;
             case "Maquinaria":
-                return catalogos.maquinaria[id]?.obsoleto ?? false;
+                registro = catalogos.maquinaria[id];
+                break;
             default:
                 return false;
         }
+        return esPrecioObsoleto(registro?.fecha_actualizacion, catalogos.diasObsoleto);
     }
 
     return (
@@ -53,6 +53,17 @@ type Detalle = {
     };
 };
 
+type PartidaPresupuesto = Partida & {
+    detalles: Detalle[];
+    subtotales: { detalles: number; costo_directo: number; importe: number };
+};
+
+type PresupuestoResponse = {
+    proyecto: ProyectoResponse;
+    partidas: PartidaPresupuesto[];
+    totales: { detalles: number; costo_directo: number; importe: number };
+};
+
 type Concepto = {
     id: number;
     clave: string;
@@ -99,6 +110,7 @@ export function PresupuestoManager() {
     const [partidas, setPartidas] = useState<Partida[]>([]);
     const [selectedPartidaId, setSelectedPartidaId] = useState<number | null>(null);
     const [detalles, setDetalles] = useState<Detalle[]>([]);
+    const [detallesPorPartida, setDetallesPorPartida] = useState<Record<number, Detalle[]>>({});
     const [partidaForm, setPartidaForm] = useState({ nombre_partida: "" });
 
     const [conceptos, setConceptos] = useState<Concepto[]>([]);
@@ -112,23 +124,25 @@ export function PresupuestoManager() {
 
     useEffect(() => {
         if (selectedProyectoId) {
-            void loadPartidas(selectedProyectoId);
-            void loadProyectoDetalle(selectedProyectoId);
+            void loadPresupuesto(selectedProyectoId);
         } else {
             setPartidas([]);
             setSelectedPartidaId(null);
             setDetalles([]);
+            setDetallesPorPartida({});
             setProyectoForm(initialProyectoForm());
         }
     }, [selectedProyectoId]);
 
     useEffect(() => {
-        if (selectedPartidaId) {
-            void loadDetalles(selectedPartidaId);
-        } else {
+        if (!selectedPartidaId) {
             setDetalles([]);
+        } else if (detallesPorPartida[selectedPartidaId]) {
+            setDetalles(detallesPorPartida[selectedPartidaId]);
+        } else {
+            void loadDetalles(selectedPartidaId);
         }
-    }, [selectedPartidaId]);
+    }, [selectedPartidaId, detallesPorPartida]);
 
     const filteredConceptos = useMemo(() => {
         const term = conceptSearch.toLowerCase();
@@ -153,13 +167,24 @@ export function PresupuestoManager() {
         }
     }
 
-    async function loadProyectoDetalle(proyectoId: number) {
-        const data = await apiFetch<ProyectoResponse>(`/proyectos/${proyectoId}`);
-        setProyectoForm(formFromResponse(data));
+    // Proyecto, partidas y detalles de todas las partidas en una sola petición
+    async function loadPresupuesto(proyectoId: number) {
+        const data = await apiFetch<PresupuestoResponse>(`/proyectos/${proyectoId}/presupuesto`);
+        setProyectoForm(formFromResponse(data.proyecto));
+        const porPartida: Record<number, Detalle[]> = {};
+        data.partidas.forEach((partida) => {
+            porPartida[partida.id] = partida.detalles.map(normalizarDetalle);
+        });
+        setDetallesPorPartida(porPartida);
+        seleccionarPartidas(data.partidas.map(({ id, nombre_partida, proyecto }) => ({ id, nombre_partida, proyecto })));
     }
 
     async function loadPartidas(proyectoId: number) {
         const data = await apiFetch<Partida[]>(`/proyectos/${proyectoId}/partidas`);
+        seleccionarPartidas(data);
+    }
+
+    function seleccionarPartidas(data: Partida[]) {
         setPartidas(data);
         const currentExists = data.some((partida) => partida.id === selectedPartidaId);
         if (!currentExists) {
@@ -169,14 +194,9 @@ export function PresupuestoManager() {
 
     async function loadDetalles(partidaId: number) {
         const data = await apiFetch<Detalle[]>(`/partidas/${partidaId}/detalles`);
-        setDetalles(
-            data.map((detalle) => ({
-                ...detalle,
-                cantidad_obra: Number(detalle.cantidad_obra),
-                precio_unitario_calculado: Number(detalle.precio_unitario_calculado),
-                costo_directo: Number(detalle.costo_directo ?? detalle.precio_unitario_calculado),
-            }))
-        );
+        const normalizados = data.map(normalizarDetalle);
+        setDetallesPorPartida((prev) => ({ ...prev, [partidaId]: normalizados }));
+        setDetalles(normalizados);
     }
 
     async function loadConceptos() {
@@ -520,6 +540,15 @@ type Resumen = {
     totalCD: number;
 };
 
+function normalizarDetalle(detalle: Detalle): Detalle {
+    return {
+        ...detalle,
+        cantidad_obra: Number(detalle.cantidad_obra),
+        precio_unitario_calculado: Number(detalle.precio_unitario_calculado),
+        costo_directo: Number(detalle.costo_directo ?? detalle.precio_unitario_calculado),
+    };
+}
+
 function calcularResumen(detalles: Detalle[]): Resumen {
     return detalles.reduce(
         (acumulado, detalle) => {
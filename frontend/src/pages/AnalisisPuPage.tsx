@@ -1,6 +1,7 @@
 import { useEffect, useState } from "react";
 
 import { apiFetch } from "../api/client";
+import { streamChatApu } from "../api/chatApuStream";
 import {
     ConceptoMatrizEditor,
     type MatrizRow,
@@ -36,6 +37,8 @@ type ChatApuInsumo = {
     rendimiento_diario?: number | null;
     rendimiento_jornada?: number | null;
     nombre?: string | null;
+    unidad?: string | null;
+    existe_en_catalogo?: boolean;
     justificacion_breve?: string | null;
 };
 
@@ -44,6 +47,42 @@ type ChatApuResponse = {
     insumos: ChatApuInsumo[];
 };
 
+type CoincidenciaCatalogo = {
+    tipo_insumo: "Material" | "ManoObra" | "Equipo" | "Maquinaria";
+    id_insumo: number;
+    nombre: string;
+    confianza: number;
+};
+
+type ConciliacionResponse = {
+    resultados: { indice: number; coincidencia: CoincidenciaCatalogo | null }[];
+};
+
+// Resuelve en una sola llamada que insumos sugeridos ya existen en catalogo.
+async function conciliarConCatalogo(insumos: ChatApuInsumo[]): Promise<ChatApuInsumo[]> {
+    if (insumos.length === 0) return insumos;
+    try {
+        const { resultados } = await apiFetch<ConciliacionResponse>(`/catalogos/conciliar`, {
+            method: "POST",
+            body: { sugerencias: insumos },
+        });
+        return insumos.map((insumo, idx) => {
+            const coincidencia = resultados[idx]?.coincidencia;
+            if (!coincidencia) return { ...insumo, insumo_id: null, id_insumo: "", existe_en_catalogo: false };
+            return {
+                ...insumo,
+                tipo_insumo: coincidencia.tipo_insumo,
+                insumo_id: coincidencia.id_insumo,
+                id_insumo: coincidencia.id_insumo,
+                existe_en_catalogo: true,
+            };
+        });
+    } catch (error) {
+        console.error("Error al conciliar sugerencias con el catalogo", error);
+        return insumos;
+    }
+}
+
 const SOBRECOSTO_FIELDS: Record<FactorToggleKey, { label: string; description: string }> = {
     indirectos: {
         label: "Costos indirectos",
@@ -179,6 +218,25 @@ export function AnalisisPuPage() {
 
     async function handleSugerirAPUConIA() {
         if (!conceptoForm.descripcion) return;
+        const conceptoId = conceptoForm.id ?? 0;
+        // Cada insumo se agrega a la matriz en cuanto la IA lo termina; el backend ya lo concilio con el catalogo
+        setIaRows([]);
+        try {
+            await streamChatApu<ChatApuInsumo>(
+                { descripcion: conceptoForm.descripcion, unidad: conceptoForm.unidad_concepto, concepto_id: conceptoForm.id },
+                {
+                    onInsumo: (insumo) =>
+                        setIaRows((prev) => [...(prev ?? []), ...mapearSugerenciasDesdeIA([insumo], conceptoId)]),
+                    onFin: ({ explicacion }) => {
+                        setIaExplanation(explicacion ?? "");
+                        setTextoDetalles(explicacion ?? "");
+                    },
+                }
+            );
+            return;
+        } catch (error) {
+            console.error("Error en /ia/chat_apu/stream, se usa /ia/chat_apu", error);
+        }
         try {
             const data = await apiFetch<ChatApuResponse>(`/ia/chat_apu`, {
                 method: "POST",
@@ -188,7 +246,8 @@ export function AnalisisPuPage() {
                     concepto_id: conceptoForm.id,
                 },
             });
-            const mappedRows = mapearSugerenciasDesdeIA(data.insumos ?? [], conceptoForm.id ?? 0);
+            const insumos = await conciliarConCatalogo(data.insumos ?? []);
+            const mappedRows = mapearSugerenciasDesdeIA(insumos, conceptoForm.id ?? 0);
             setIaRows(mappedRows);
             const explicacion = data.explicacion ?? "";
             setIaExplanation(explicacion);